@@ -0,0 +1,162 @@
+"""
+Age-matched control selection for the ChemRxiv versions of record.
+
+The R analysis reads OA_REDO_ChemAgeMatch_*.csv and OA_REDO_CompAgeMatch_*.csv.
+This builds them from the two merged metadata + PlumX tables: every
+ChemRxiv version of record is paired with the k comparison articles from
+the same journal whose coverDate is nearest, as long as they are within
+`caliper_days`.
+
+Journals are compared by name (publicationName, case and surrounding
+spaces ignored). Tables enriched with crossref_metadata.enrich_metadata()
+can be matched on Crossref's values instead (by="crossref_publicationName",
+date="crossref_coverDate"); Crossref and Scopus do not always spell a
+journal alike, so both tables have to be matched on the same source.
+
+Controls are kept per journal as a sorted array of days, so finding the
+nearest ones is a searchsorted() plus a look at the k neighbours on either
+side, done for all articles of a journal at once (like merge_asof, but for
+k matches), instead of comparing every pair.
+"""
+import numpy as np
+import pandas as pd
+
+# PlumX column -> name used in the R script
+R_COLUMNS = {"Citation Indexes": "Scopus1", "Tweets": "tweet1", "Readers": "reader1"}
+
+
+def _days(dates):
+    d = pd.to_datetime(dates, errors="coerce")
+    days = (d - pd.Timestamp("1970-01-01")).dt.days
+    return days.to_numpy(dtype=float)
+
+
+def _journal(names):
+    return names.astype("string").str.strip().str.lower()
+
+
+def match_controls(chem, comp, k=1, caliper_days=365, by="publicationName",
+                   date="coverDate", replace=True, window=None,
+                   exclude="is_chemrxiv_vor"):
+    """Pair each row of `chem` with up to k rows of `comp`.
+
+    Returns one row per pair: chem_doi, comp_doi, journal, days (absolute
+    coverDate difference) and rank (1 = nearest). With replace=False a
+    control is used at most once; pairs are then handed out greedily,
+    closest first, from the `window` nearest controls on each side
+    (default 5 * k). Controls with a true `exclude` column (ChemRxiv
+    versions of record that ended up in the comparison sample) are never
+    used.
+    """
+    if window is None:
+        window = k if replace else 5 * k
+    if exclude in comp:
+        comp = comp.loc[~comp[exclude].fillna(False).astype(bool)]
+
+    t_journal = _journal(chem[by])
+    c_journal = _journal(comp[by])
+    t_days = _days(chem[date])
+    c_days = _days(comp[date])
+    t_doi = chem["doi"].to_numpy()
+    c_doi = comp["doi"].to_numpy()
+
+    candidates = []
+    c_groups = pd.Series(np.arange(len(comp))).groupby(c_journal.to_numpy()).indices
+    for journal, t_rows in pd.Series(np.arange(len(chem))).groupby(t_journal.to_numpy()).indices.items():
+        c_rows = c_groups.get(journal)
+        if c_rows is None:
+            continue
+        c_rows = c_rows[~np.isnan(c_days[c_rows])]
+        t_rows = t_rows[~np.isnan(t_days[t_rows])]
+        if len(c_rows) == 0 or len(t_rows) == 0:
+            continue
+        order = np.argsort(c_days[c_rows], kind="stable")
+        c_rows = c_rows[order]
+        days = c_days[c_rows]
+
+        # window of neighbours either side of where each article would go
+        pos = np.searchsorted(days, t_days[t_rows])
+        offsets = np.arange(-window, window)
+        idx = pos[:, None] + offsets[None, :]
+        valid = (idx >= 0) & (idx < len(days))
+        idx = np.clip(idx, 0, len(days) - 1)
+        dist = np.abs(days[idx] - t_days[t_rows][:, None])
+        dist[~valid | (dist > caliper_days)] = np.inf
+
+        t_rep = np.repeat(t_rows, idx.shape[1])
+        keep = np.isfinite(dist.ravel())
+        candidates.append(pd.DataFrame({
+            "t": t_rep[keep],
+            "c": c_rows[idx.ravel()[keep]],
+            "days": dist.ravel()[keep],
+            "journal": journal,
+        }))
+
+    if not candidates:
+        return pd.DataFrame(columns=["chem_doi", "comp_doi", "journal", "days", "rank"])
+    cand = pd.concat(candidates, ignore_index=True)
+    cand = cand.drop_duplicates(["t", "c"]).sort_values(["days", "t", "c"], kind="stable")
+
+    if replace:
+        cand["rank"] = cand.groupby("t").cumcount() + 1
+        pairs = cand.loc[cand["rank"] <= k]
+    else:
+        used = set()
+        count = {}
+        chosen = []
+        for row in cand.itertuples(index=False):
+            if row.c in used or count.get(row.t, 0) >= k:
+                continue
+            used.add(row.c)
+            count[row.t] = count.get(row.t, 0) + 1
+            chosen.append(row)
+        pairs = pd.DataFrame(chosen, columns=cand.columns)
+        pairs["rank"] = pairs.groupby("t").cumcount() + 1
+
+    pairs = pairs.sort_values(["t", "rank"])
+    return pd.DataFrame({"chem_doi": t_doi[pairs["t"].to_numpy()],
+                         "comp_doi": c_doi[pairs["c"].to_numpy()],
+                         "journal": pairs["journal"].to_numpy(),
+                         "days": pairs["days"].to_numpy(),
+                         "rank": pairs["rank"].to_numpy()})
+
+
+def matched_tables(chem, comp, pairs):
+    """The matched ChemRxiv and comparison rows, in pair order.
+
+    A control matched to two articles (replace=True) appears twice.
+    """
+    chem_m = chem.drop_duplicates("doi").set_index("doi").loc[pairs["chem_doi"].unique()]
+    comp_m = comp.drop_duplicates("doi").set_index("doi").loc[pairs["comp_doi"]]
+    comp_m.insert(0, "matched_to", pairs["chem_doi"].to_numpy())
+    return chem_m.reset_index(), comp_m.reset_index()
+
+
+def matched_paths(date_tag):
+    """The files save_matched() writes for `date_tag`."""
+    return ["OA_REDO_ChemAgeMatch_" + date_tag + ".csv",
+            "OA_REDO_CompAgeMatch_" + date_tag + ".csv",
+            "OA_REDO_AgeMatchPairs_" + date_tag + ".csv"]
+
+
+def save_matched(chem, comp, pairs, date_tag, rename=R_COLUMNS):
+    """Write the matched tables and `pairs` to the matched_paths() files.
+
+    PlumX columns are renamed to the names the R script uses (see R_COLUMNS).
+    """
+    chem_m, comp_m = matched_tables(chem, comp, pairs)
+    chem_path, comp_path, pairs_path = matched_paths(date_tag)
+    chem_m.rename(columns=rename).to_csv(chem_path, index=False)
+    comp_m.rename(columns=rename).to_csv(comp_path, index=False)
+    pairs.to_csv(pairs_path, index=False)
+
+
+def write_matched(chem, comp, date_tag, k=1, caliper_days=365, replace=True,
+                  rename=R_COLUMNS, **kwargs):
+    """Match and write OA_REDO_ChemAgeMatch_<date_tag>.csv / OA_REDO_CompAgeMatch_<date_tag>.csv.
+
+    Returns the pairs table, which is written as well.
+    """
+    pairs = match_controls(chem, comp, k, caliper_days, replace=replace, **kwargs)
+    save_matched(chem, comp, pairs, date_tag, rename)
+    return pairs
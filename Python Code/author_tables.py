@@ -0,0 +1,210 @@
+"""
+Normalized works / authors / affiliations tables from ScopusSearch metadata.
+
+The metadata tables keep authors and affiliations as ';' joined strings,
+copied on every row:
+
+    author_names         "Smith J.;Doe A."
+    author_ids           "57190000001;57190000002"
+    author_afids         "60000001-60000002;60000003"   ('-' between one
+                                                         author's affiliations)
+    afid / affilname / affiliation_city / affiliation_country
+                         one entry per affiliation of the work, in step
+
+normalize() splits them once into integer keyed tables:
+
+    works         one row per input row (work = row number), the other columns
+                  typed as in columnar_store (journals, ISSNs as categoricals)
+    authors       author code -> Scopus author id (Int64) and first name seen
+    affiliations  affiliation code -> afid (Int64), name, city, country
+                  (categoricals)
+
+and the links between them as CSR arrays: the authors of work w are
+author[work_ptr[w]:work_ptr[w + 1]] in byline order, and the affiliations
+of author position p are affiliation[aff_ptr[p]:aff_ptr[p + 1]]. Group-bys
+over those arrays are numpy bincounts rather than string splitting:
+
+    from author_tables import normalize
+    t = normalize(plum_and_metadata_compare)
+    t.per_country(plum_and_metadata_compare['Citation Indexes'])
+"""
+from itertools import zip_longest
+
+import numpy as np
+import pandas as pd
+
+from columnar_store import to_typed
+
+# joined columns that normalize() takes apart
+AUTHOR_COLUMNS = ["author_names", "author_ids", "author_afids"]
+AFFILIATION_COLUMNS = ["afid", "affilname", "affiliation_city", "affiliation_country"]
+
+
+def _split(value, sep=";"):
+    if not isinstance(value, str) or value == "":
+        return []
+    return [part.strip() for part in value.split(sep)]
+
+
+def _ids(values):
+    return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").astype("Int64")
+
+
+class AuthorTables:
+    """The tables and link arrays made by normalize()."""
+
+    def __init__(self, works, authors, affiliations, work_ptr, author, aff_ptr, affiliation):
+        self.works = works
+        self.authors = authors
+        self.affiliations = affiliations
+        self.work_ptr = work_ptr        # int64, len(works) + 1
+        self.author = author            # int32 author code per author position
+        self.aff_ptr = aff_ptr          # int64, positions + 1
+        self.affiliation = affiliation  # int32 affiliation code per (position, affiliation)
+
+    def __repr__(self):
+        return ("AuthorTables(" + str(len(self.works)) + " works, "
+                + str(len(self.authors)) + " authors, "
+                + str(len(self.affiliations)) + " affiliations, "
+                + str(len(self.author)) + " author positions)")
+
+    def nbytes(self):
+        """Memory used by the tables and arrays, in bytes."""
+        frames = sum(int(df.memory_usage(deep=True).sum())
+                     for df in (self.works, self.authors, self.affiliations))
+        return frames + sum(a.nbytes for a in (self.work_ptr, self.author,
+                                                self.aff_ptr, self.affiliation))
+
+    def position_work(self):
+        """Work code of every author position."""
+        return np.repeat(np.arange(len(self.works)), np.diff(self.work_ptr))
+
+    def links(self):
+        """Long table: one row per (work, author position, affiliation).
+
+        Author positions without an affiliation get affiliation -1.
+        """
+        counts = np.diff(self.aff_ptr)
+        n_pos = len(self.author)
+        pos = np.repeat(np.arange(n_pos), np.maximum(counts, 1))
+        aff = np.full(len(pos), -1, dtype=np.int32)
+        has = np.repeat(counts > 0, np.maximum(counts, 1))
+        aff[has] = self.affiliation
+        starts = self.work_ptr[:-1]
+        work = self.position_work()
+        return pd.DataFrame({"work": work[pos],
+                             "position": pos - starts[work[pos]],
+                             "author": self.author[pos],
+                             "affiliation": aff})
+
+    def work_countries(self):
+        """Distinct (work, country code) pairs over all authors' affiliations."""
+        links = self.links()
+        links = links.loc[links["affiliation"] >= 0]
+        codes = self.affiliations["country"].cat.codes.to_numpy()[links["affiliation"].to_numpy()]
+        pairs = pd.DataFrame({"work": links["work"].to_numpy(), "country": codes})
+        return pairs.loc[pairs["country"] >= 0].drop_duplicates()
+
+    def per_country(self, values=None, fractional=False):
+        """Sum a per-work value (e.g. citations) by affiliation country.
+
+        `values` is aligned with the works (default: count works). A work
+        counts once for each distinct country of its authors, or with
+        fractional=True is split equally between them.
+        """
+        pairs = self.work_countries()
+        work = pairs["work"].to_numpy()
+        country = pairs["country"].to_numpy()
+        if values is None:
+            weights = np.ones(len(self.works))
+        else:
+            weights = pd.to_numeric(pd.Series(np.asarray(values)), errors="coerce").fillna(0).to_numpy()
+        w = weights[work]
+        if fractional:
+            w = w / np.bincount(work, minlength=len(self.works))[work]
+        names = self.affiliations["country"].cat.categories
+        return pd.Series(np.bincount(country, weights=w, minlength=len(names)), index=names)
+
+    def per_affiliation(self, values=None):
+        """Sum a per-work value by affiliation, each work once per affiliation."""
+        links = self.links()
+        pairs = links.loc[links["affiliation"] >= 0, ["work", "affiliation"]].drop_duplicates()
+        work = pairs["work"].to_numpy()
+        if values is None:
+            weights = np.ones(len(self.works))
+        else:
+            weights = pd.to_numeric(pd.Series(np.asarray(values)), errors="coerce").fillna(0).to_numpy()
+        sums = np.bincount(pairs["affiliation"].to_numpy(), weights=weights[work],
+                           minlength=len(self.affiliations))
+        return pd.Series(sums, index=self.affiliations.index)
+
+
+def normalize(metadata):
+    """Split the joined author/affiliation columns of a metadata table.
+
+    `metadata` is a search_metadata() table or a merged metadata + PlumX
+    table; rows Scopus did not find simply have no authors.
+    """
+    rows = metadata.reset_index(drop=True)
+    author_index = {}     # Scopus author id -> code
+    author_ids, author_names = [], []
+    aff_index = {}        # afid -> code
+    aff_rows = []         # [afid, name, city, country]
+
+    def aff_code(afid):
+        code = aff_index.get(afid)
+        if code is None:
+            code = aff_index[afid] = len(aff_rows)
+            aff_rows.append([afid, None, None, None])
+        return code
+
+    work_ptr = [0]
+    author = []
+    aff_ptr = [0]
+    affiliation = []
+    for values in zip(*(rows[c] if c in rows else [None] * len(rows)
+                        for c in AUTHOR_COLUMNS + AFFILIATION_COLUMNS)):
+        names, ids, afids, w_afid, w_name, w_city, w_country = values
+        ids = _split(ids)
+        if not ids:
+            work_ptr.append(len(author))
+            continue
+
+        # the work level lists name the affiliations the author afids point to
+        for afid, name, city, country in zip_longest(_split(w_afid), _split(w_name),
+                                                     _split(w_city), _split(w_country)):
+            if afid:
+                row = aff_rows[aff_code(afid)]
+                if row[1] is None:
+                    row[1:] = [name or None, city or None, country or None]
+
+        for scopus_id, name, afs in zip_longest(ids, _split(names), _split(afids)):
+            if not scopus_id:
+                continue
+            code = author_index.get(scopus_id)
+            if code is None:
+                code = author_index[scopus_id] = len(author_ids)
+                author_ids.append(scopus_id)
+                author_names.append(name)
+            author.append(code)
+            affiliation.extend(aff_code(a) for a in _split(afs, "-") if a)
+            aff_ptr.append(len(affiliation))
+        work_ptr.append(len(author))
+
+    works = rows.drop(columns=[c for c in AUTHOR_COLUMNS + AFFILIATION_COLUMNS if c in rows])
+    works = to_typed(works, "metadata")
+    # Scopus author ids and afids are numbers; anything else becomes <NA>
+    authors = pd.DataFrame({"scopus_id": _ids(author_ids),
+                            "name": pd.array(author_names, dtype="string")})
+    affiliations = pd.DataFrame(aff_rows, columns=["afid", "name", "city", "country"])
+    affiliations["afid"] = _ids(affiliations["afid"])
+    for column in ("name", "city", "country"):
+        affiliations[column] = affiliations[column].astype("category")
+    authors.index.name = "author"
+    affiliations.index.name = "affiliation"
+
+    return AuthorTables(works, authors, affiliations,
+                        np.asarray(work_ptr, dtype=np.int64),
+                        np.asarray(author, dtype=np.int32),
+                        np.asarray(aff_ptr, dtype=np.int64),
+                        np.asarray(affiliation, dtype=np.int32))
@@ -0,0 +1,213 @@
+"""
+Benchmark the collection pipeline against mock_api_server.py.
+
+Runs the same steps as data_collection_may2023.py (ChemRxiv harvest and
+flattening, Crossref DOI enumeration, PlumX, ScopusSearch, Crossref
+metadata, merging and age matching) against local mock APIs at several sizes, and reports wall time,
+records per second and peak Python memory for every stage:
+
+    python benchmark_pipeline.py                      # 1k, 10k and 100k
+    python benchmark_pipeline.py --scales 1000 --latency 0.02 --csv bench.csv
+
+The ChemRxiv/Crossref mock and the PlumX/Scopus mock run as two separate
+processes, like the real hosts, so their work does not count towards the
+pipeline's time or memory. --error-rate and --rps-limit only apply to the
+PlumX/Scopus mock, whose callers retry. The politeness limits are switched
+off (the mock latency stands in for the API) so what is measured is our own
+code. Peak memory comes from tracemalloc (allocations made by Python code,
+numpy and pandas), reset at the start of each stage; tracing slows the run
+down a lot, so compare wall times from runs made with --no-memory.
+"""
+import argparse
+import socket
+import subprocess
+import sys
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from time import monotonic, sleep
+
+import pandas as pd
+import requests
+
+import chemrxiv_harvest
+import crossref_dois
+import crossref_metadata
+import instrumentation
+from age_match import match_controls
+from chemrxiv_harvest import harvest_pages, page_skips, records_frame
+from crossref_dois import collect_dois
+from crossref_metadata import crossref_works
+from mock_api_server import CHEMRXIV_PATH, plumx_fetch, scopus_search
+from plumx_collect import collect_plumx
+from rate_limit import PoliteLimiter
+from scopus_metadata import search_metadata
+
+SCALES = (1000, 10000, 100000)
+
+# the comparison sample is spread over this many journals and years
+ISSNS = ["0000-" + str(1000 + i) for i in range(10)]
+YEARS = range(2017, 2022)
+
+HERE = Path(__file__).resolve().parent
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def mock_server(*args):
+    """mock_api_server.py in a child process; yields its base URL."""
+    port = _free_port()
+    proc = subprocess.Popen([sys.executable, str(HERE / "mock_api_server.py"),
+                             "--port", str(port), *map(str, args)],
+                            stdout=subprocess.DEVNULL)
+    url = "http://127.0.0.1:" + str(port)
+    try:
+        for _ in range(100):
+            try:
+                requests.get(url + "/", timeout=1)
+                break
+            except requests.ConnectionError:
+                sleep(0.1)
+        else:
+            raise RuntimeError("mock server did not start")
+        yield url
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+class StageTimer:
+    """Collects one result row per stage."""
+
+    def __init__(self, scale, memory=True):
+        self.scale = scale
+        self.memory = memory
+        self.rows = []
+
+    @contextmanager
+    def stage(self, name):
+        """Time the block; set `out["records"]` inside it to get records/s."""
+        out = {"records": None}
+        if self.memory:
+            tracemalloc.reset_peak()
+        start = monotonic()
+        yield out
+        wall = monotonic() - start
+        peak = tracemalloc.get_traced_memory()[1] / 1e6 if self.memory else float("nan")
+        records = out["records"]
+        self.rows.append({"scale": self.scale, "stage": name, "records": records,
+                          "wall_s": wall,
+                          "records_per_s": records / wall if records and wall else float("nan"),
+                          "peak_MB": peak})
+        print("  " + name + ": " + str(round(wall, 2)) + " s", flush=True)
+
+
+def run_scale(scale, args, memory=True):
+    """The whole pipeline for `scale` ChemRxiv items; returns the stage rows."""
+    instrumentation.reset()
+    timer = StageTimer(scale, memory)
+    per_journal_year = max(scale // (len(ISSNS) * len(YEARS)), 1)
+    catalog = ["--items", scale, "--works", per_journal_year,
+               "--latency", args.latency, "--jitter", args.jitter]
+    elsevier = catalog + ["--error-rate", args.error_rate]
+    if args.rps_limit:
+        elsevier += ["--rps-limit", args.rps_limit]
+
+    with mock_server(*catalog) as catalog_url, mock_server(*elsevier) as elsevier_url:
+        chemrxiv_harvest.API = catalog_url + CHEMRXIV_PATH
+        crossref_dois.JBASE_URL = catalog_url + "/journals/"
+        crossref_metadata.WORKS_URL = catalog_url + "/works"
+
+        with timer.stage("chemrxiv.harvest") as out:
+            pages = harvest_pages(page_skips(scale), workers=args.workers,
+                                  min_interval=0, progress=False)
+            out["records"] = sum(len(p["itemHits"]) for p in pages)
+        with timer.stage("chemrxiv.extract") as out:
+            chem = records_frame(pages)
+            out["records"] = len(chem)
+        del pages
+        vor_dois = chem.loc[chem["vorDoi"] != "None", "vorDoi"].tolist()
+
+        with timer.stage("crossref.dois") as out:
+            compare = collect_dois(ISSNS, YEARS, workers=args.workers,
+                                  limiter=PoliteLimiter(0))
+            compare_dois = [doi for years in compare.values()
+                            for dois in years.values() for doi in dois]
+            out["records"] = len(compare_dois)
+
+        fetch = plumx_fetch(elsevier_url)
+        with timer.stage("plumx.fetch") as out:
+            collector = collect_plumx(vor_dois + compare_dois, workers=args.workers,
+                                      rate=args.plumx_rate, burst=args.workers,
+                                      fetch=fetch)
+            out["records"] = len(collector)
+        with timer.stage("plumx.frame") as out:
+            plum = collector.frame()
+            out["records"] = len(plum)
+        del collector
+
+        search = scopus_search(elsevier_url)
+        with timer.stage("scopus.search") as out:
+            meta = search_metadata(vor_dois + compare_dois, delay=0, search=search)
+            out["records"] = len(meta)
+        with timer.stage("crossref.metadata") as out:
+            biblio = crossref_works(vor_dois + compare_dois, workers=args.workers,
+                                    limiter=PoliteLimiter(0), progress=False)
+            out["records"] = int(biblio["title"].notna().sum())
+        del biblio
+
+    with timer.stage("merge") as out:
+        merged = meta.merge(plum.drop_duplicates("doi"), on="doi", how="left")
+        chem_m = merged.iloc[:len(vor_dois)]
+        comp_m = merged.iloc[len(vor_dois):]
+        out["records"] = len(merged)
+    with timer.stage("age_match") as out:
+        pairs = match_controls(chem_m, comp_m, k=1, caliper_days=365)
+        out["records"] = len(chem_m)
+    print("  " + str(len(pairs)) + " matched pairs")
+
+    if args.summary:
+        instrumentation.print_summary()
+    return timer.rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=list(SCALES))
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.005,
+                        help="seconds each mock response takes")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rps-limit", type=int, default=None)
+    parser.add_argument("--plumx-rate", type=float, default=10000,
+                        help="token bucket rate given to collect_plumx()")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip tracemalloc, which slows Python code down")
+    parser.add_argument("--summary", action="store_true",
+                        help="print the instrumentation table after each scale")
+    parser.add_argument("--csv", help="also write the results here")
+    args = parser.parse_args()
+
+    memory = not args.no_memory
+    if memory:
+        tracemalloc.start()
+    rows = []
+    for scale in args.scales:
+        print(str(scale) + " items", flush=True)
+        rows.extend(run_scale(scale, args, memory))
+
+    table = pd.DataFrame(rows)
+    with pd.option_context("display.width", 200, "display.max_rows", 100):
+        print(table.round(2).to_string(index=False))
+    if args.csv:
+        table.to_csv(args.csv, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Run the appendix bootstraps as one parallel, resumable work queue.
+
+The R script calls poweRlaw's bootstrap() and bootstrap_p() with
+sims = 2500 for 3 distributions x 3 variables x 2 cohorts, one job after
+the other. Here every single simulation of every job is a task in one
+process pool, so all cores stay busy until the very end.
+
+Each simulation gets its own seed derived from (seed, cohort name,
+variable name, family, kind, simulation number) with numpy's
+SeedSequence, so the results are the same whatever the number of
+workers, the order tasks finish in or the order cohorts and variables
+are given in. Finished simulations are written to a Journal (see
+doi_journal.py) and skipped when the run is started again. Their keys
+include a hash of the seed, the data and the observed fit, so a run on
+other data or with another seed never picks up old results; a run with
+more `sims` reuses the ones it shares with the earlier run, which are
+the same simulations.
+
+    from bootstrap_scheduler import run_bootstraps, sd_table, p_table
+    res = run_bootstraps({"chem": readfile_chem, "comp": readfile_comp})
+    sd_table(res)   # like calc_sd() in the R script
+    p_table(res)    # like print_p_values()
+"""
+import hashlib
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from doi_journal import Journal
+from powerlaw_fit import FAMILIES, VARIABLES, dist_rand, estimate_xmin, fit_all, prepare
+
+KINDS = ("bootstrap", "bootstrap_p")
+
+Task = namedtuple("Task", "cohort variable family kind sim")
+
+# filled in each worker process by _init()
+_data = {}
+_fits = {}
+
+
+def _name_key(name):
+    # a stable integer for a cohort or variable name, for SeedSequence
+    return int.from_bytes(hashlib.blake2b(str(name).encode("utf-8"), digest_size=8).digest(),
+                          "big")
+
+
+def job_hash(x, fit, seed):
+    """Hash of what a job's simulations depend on: seed, data and observed fit."""
+    h = hashlib.blake2b(digest_size=8)
+    h.update(repr((seed, fit.family, fit.xmin, tuple(fit.pars), fit.ntail)).encode("utf-8"))
+    h.update(np.ascontiguousarray(x, dtype=float).tobytes())
+    return h.hexdigest()
+
+
+def task_key(task, job):
+    return "|".join([job] + [str(part) for part in task])
+
+
+def task_seed(task, seed):
+    """Seed that depends only on what the simulation is, not where it runs."""
+    key = (_name_key(task.cohort), _name_key(task.variable),
+           FAMILIES.index(task.family), KINDS.index(task.kind), task.sim)
+    return np.random.SeedSequence(seed, spawn_key=key)
+
+
+def simulate(x, fit, kind, rng):
+    """One simulation, returning [gof, xmin, *pars, ntail] of the refit.
+
+    bootstrap:   refit a resample (with replacement) of the data.
+    bootstrap_p: refit synthetic data: values below xmin resampled from the
+                 data, the tail drawn from the fitted distribution, in the
+                 same proportion as the observed data (as poweRlaw does).
+    """
+    n = len(x)
+    if kind == "bootstrap":
+        sample = rng.choice(x, size=n, replace=True)
+    else:
+        body = x[x < fit.xmin]
+        n_tail = rng.binomial(n, fit.ntail / n) if len(body) else n
+        tail = dist_rand(fit.family, fit.pars, fit.xmin, n_tail, rng)
+        sample = np.concatenate([rng.choice(body, size=n - n_tail, replace=True)
+                                 if n_tail < n else np.empty(0), tail])
+    refit = estimate_xmin(sample, fit.family)
+    return [refit.gof, refit.xmin, *refit.pars, refit.ntail]
+
+
+def _init(data, fits):
+    _data.update(data)
+    _fits.update(fits)
+
+
+def _run_chunk(chunk):
+    out = []
+    for task, seq in chunk:
+        rng = np.random.default_rng(seq)
+        try:
+            row = simulate(_data[(task.cohort, task.variable)],
+                           _fits[(task.cohort, task.variable, task.family)],
+                           task.kind, rng)
+        except ValueError:
+            # the resample had too few distinct values to fit
+            row = None
+        out.append((task, row))
+    return out
+
+
+def run_bootstraps(datasets, variables=VARIABLES, families=FAMILIES, kinds=KINDS,
+                   sims=2500, seed=1, workers=None,
+                   checkpoint="bootstrap.journal.jsonl", chunksize=10):
+    """Run every simulation of every job in one process pool.
+
+    `datasets` maps a cohort name to a DataFrame with the `variables`
+    columns (for example the two age matched tables the R script reads).
+    Returns a dict with the observed fits ("fits") and, for each
+    (cohort, variable, family, kind), the array of simulation rows.
+    """
+    cohorts = list(datasets)
+    variables = list(variables)
+    data = {(c, v): prepare(datasets[c][v]) for c in cohorts for v in variables}
+    fits = {}
+    for (c, v), x in data.items():
+        for family, fit in fit_all(x, families).items():
+            fits[(c, v, family)] = fit
+
+    jobs = {key: job_hash(data[key[:2]], fit, seed) for key, fit in fits.items()}
+
+    def key_of(t):
+        return task_key(t, jobs[(t.cohort, t.variable, t.family)])
+
+    journal = Journal(checkpoint, fsync=False) if checkpoint else None
+    tasks = [Task(c, v, f, k, i) for c in cohorts for v in variables
+             for f in families for k in kinds for i in range(sims)]
+    todo = [t for t in tasks if journal is None or key_of(t) not in journal]
+    todo = [(t, task_seed(t, seed)) for t in todo]
+    chunks = [todo[i:i + chunksize] for i in range(0, len(todo), chunksize)]
+
+    results = {}
+    if journal is not None:
+        for t in tasks:
+            if key_of(t) in journal:
+                results[t] = journal[key_of(t)]
+
+    if chunks:
+        workers = workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init,
+                                 initargs=(data, fits)) as pool:
+            futures = [pool.submit(_run_chunk, chunk) for chunk in chunks]
+            try:
+                for done, future in enumerate(as_completed(futures), 1):
+                    for task, row in future.result():
+                        results[task] = row
+                        if journal is not None:
+                            journal.append(key_of(task), row)
+                    if done % 100 == 0 or done == len(futures):
+                        print(str(done) + "/" + str(len(futures)) + " chunks done")
+            except KeyboardInterrupt:
+                # what has finished is in the journal; cancel the rest
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+    if journal is not None:
+        journal.close()
+
+    out = {"fits": fits}
+    for c in cohorts:
+        for v in variables:
+            for f in families:
+                for k in kinds:
+                    rows = [results[Task(c, v, f, k, i)] for i in range(sims)]
+                    out[(c, v, f, k)] = np.array([r for r in rows if r is not None], dtype=float)
+    return out
+
+
+def sd_table(results, kind="bootstrap"):
+    """Standard deviation of the bootstrapped xmin (column 2 of poweRlaw's
+    bootstraps data frame, as in calc_sd()), one row per cohort/variable."""
+    rows = {}
+    for key, sims in results.items():
+        if key == "fits" or key[3] != kind:
+            continue
+        cohort, variable, family, _ = key
+        rows.setdefault((cohort, variable), {})[family] = (
+            np.std(sims[:, 1], ddof=1) if len(sims) > 1 else np.nan)
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+def p_table(results, kind="bootstrap_p"):
+    """Goodness of fit p-values: share of simulations whose KS distance is at
+    least the observed one, one row per cohort/variable."""
+    rows = {}
+    for key, sims in results.items():
+        if key == "fits" or key[3] != kind:
+            continue
+        cohort, variable, family, _ = key
+        observed = results["fits"][(cohort, variable, family)].gof
+        rows.setdefault((cohort, variable), {})[family] = (
+            np.mean(sims[:, 0] >= observed) if len(sims) else np.nan)
+    return pd.DataFrame.from_dict(rows, orient="index")
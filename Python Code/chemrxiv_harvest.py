@@ -0,0 +1,325 @@
+"""
+Helpers for harvesting preprint records from the ChemRxiv public API.
+
+https://chemrxiv.org/engage/chemrxiv/public-api/documentation
+
+The serial loop in data_collection_may2023.py requests one page at a time
+with sleep(2) in between. harvest_pages() fetches the same pages with a small
+pool of worker threads that share the ChemRxiv rate_governor (or one
+PoliteLimiter), so the overall request rate stays polite while the waiting
+for responses overlaps.
+"""
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import pandas as pd
+
+import instrumentation
+from http_cache import get_json
+from rate_limit import PoliteLimiter
+
+log = logging.getLogger(__name__)
+
+API = "https://chemrxiv.org/engage/chemrxiv/public-api/v1/"
+PAGE_SIZE = 50  # max page size allowed by the API
+
+
+def items_url(skip=0, limit=PAGE_SIZE, sort=None):
+    url = API + "items?limit=" + str(limit) + "&skip=" + str(skip)
+    if sort is not None:
+        url += "&sort=" + sort
+    return url
+
+
+def get_page(skip, limit=PAGE_SIZE, limiter=None, timeout=60, sort=None):
+    """Get one page of items as parsed JSON."""
+    return get_json(items_url(skip, limit, sort), timeout, limiter)
+
+
+def total_count():
+    """Number of items ChemRxiv currently reports."""
+    return get_page(0, limit=1)["totalCount"]
+
+
+def page_skips(num_items, limit=PAGE_SIZE):
+    """Skip offsets needed to cover `num_items` items."""
+    return list(range(0, num_items, limit))
+
+
+def harvest_pages(skips=None, workers=4, min_interval=None, limiter=None,
+                  progress=True):
+    """Fetch many pages concurrently and return them in skip order.
+
+    `workers` is the number of requests allowed in flight at once. By
+    default the spacing between requests is left to the rate_governor,
+    which adapts it to how ChemRxiv answers; a `min_interval` fixes it
+    instead (the minimum number of seconds between the start of any two
+    requests). Pass an existing `limiter` to share a budget with other code.
+    """
+    if skips is None:
+        skips = page_skips(total_count())
+    if limiter is None and min_interval is not None:
+        limiter = PoliteLimiter(min_interval)
+
+    tracker = instrumentation.Progress(len(skips), "ChemRxiv pages", enabled=progress)
+
+    def fetch(skip):
+        page = get_page(skip, limiter=limiter)
+        tracker.update()
+        return page
+
+    # pool.map hands results back in input order regardless of which
+    # request finished first
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fetch, skips))
+
+
+def items_by_id(pages):
+    """Flatten pages into {ChemRxiv item id: item}, keeping page order.
+
+    Items can shift between pages while a harvest is running, so the same
+    preprint may show up twice; keying by id keeps one copy.
+    """
+    items = {}
+    for page in pages:
+        for hit in page["itemHits"]:
+            item = hit["item"]
+            items[item["id"]] = item
+    return items
+
+
+def harvest_items(skips=None, workers=4, min_interval=None, limiter=None):
+    """harvest_pages() followed by items_by_id()."""
+    return items_by_id(harvest_pages(skips, workers, min_interval, limiter))
+
+
+# columns of the flattened table, in the order used by the saved TSVs
+COLUMNS = ["doi", "status", "statusDate",
+           "first_au_firstName", "first_au_lastName",
+           "first_au_inst", "first_au_country",
+           "last_au_firstName", "last_au_lastName",
+           "last_au_inst", "last_au_country",
+           "title", "abstractViews", "citations",
+           "contentDownloads", "vorDoi"]
+
+# metric description in the API -> column name
+METRICS = {"Abstract Views": "abstractViews",
+           "Citations": "citations",
+           "Content Downloads": "contentDownloads"}
+
+
+def _iter_items(pages):
+    # accept raw pages, or items already flattened by items_by_id()
+    if isinstance(pages, dict):
+        pages = [pages] if "itemHits" in pages else [pages.values()]
+    for page in pages:
+        if isinstance(page, dict):
+            for hit in page["itemHits"]:
+                yield hit["item"]
+        else:
+            yield from page
+
+
+def extract_columns(pages):
+    """Flatten ChemRxiv items into column lists in a single pass.
+
+    `pages` can be one page, a list of pages, or the dict returned by
+    items_by_id(). Returns (ids, columns) where columns maps each name in
+    COLUMNS to a list. Metrics are matched on their description, so their
+    position in the metrics array does not matter.
+    """
+    ids = []
+    cols = {name: [] for name in COLUMNS}
+    append = {name: cols[name].append for name in COLUMNS}
+    metric_names = METRICS.values()
+
+    for item in _iter_items(pages):
+        ids.append(item["id"])
+        append["doi"](item["doi"])
+        append["status"](item["status"])
+        append["statusDate"](item["statusDate"])
+        append["title"](item["title"])
+
+        authors = item["authors"]
+        first = authors[0]
+        append["first_au_firstName"](first["firstName"])
+        append["first_au_lastName"](first["lastName"])
+        # note if author has multiple institution info, this gets first one listed
+        # also sometimes there is country data without institutions and vice versa
+        if first["institutions"]:
+            inst = first["institutions"][0]
+            append["first_au_inst"](inst["name"])
+            append["first_au_country"](inst["country"])
+        else:
+            append["first_au_inst"]("no_data")
+            append["first_au_country"]("no_data")
+
+        if len(authors) > 1:
+            last = authors[-1]
+            append["last_au_firstName"](last["firstName"])
+            append["last_au_lastName"](last["lastName"])
+            if last["institutions"]:
+                inst = last["institutions"][0]
+                append["last_au_inst"](inst["name"])
+                append["last_au_country"](inst["country"])
+            else:
+                append["last_au_inst"]("no_data")
+                append["last_au_country"]("no_data")
+        else:
+            append["last_au_firstName"]("None")
+            append["last_au_lastName"]("None")
+            append["last_au_inst"]("no_data")
+            append["last_au_country"]("no_data")
+
+        found = {}
+        for metric in item["metrics"] or ():
+            name = METRICS.get(metric["description"])
+            if name is not None:
+                found[name] = metric["value"]
+        for name in metric_names:
+            append[name](found.get(name, "no_data"))
+
+        vor = item["vor"]
+        append["vorDoi"]("None" if vor is None else vor["vorDoi"])
+
+    return ids, cols
+
+
+def records_frame(pages):
+    """extract_columns() as a DataFrame indexed by ChemRxiv item id."""
+    with instrumentation.stage("chemrxiv.extract"):
+        ids, cols = extract_columns(pages)
+        df = pd.DataFrame(cols, index=pd.Index(ids), columns=COLUMNS)
+    # same preprint on two pages: keep the latest copy, like the old dict did
+    return df[~df.index.duplicated(keep="last")]
+
+
+# Incremental harvest
+#
+# Instead of walking every page from skip=0, ask for the newest items first
+# and keep those whose statusDate is past the last one we already have. The
+# API only sorts by published date, and a revised item gets a new statusDate
+# but keeps its published date, so paging stops on the published date
+# instead: once it is REVISION_WINDOW days before the watermark. The
+# watermark is saved as a small JSON file next to the TSV:
+#   {"statusDate": "<latest statusDate seen>", "ids": [<ids at that date>]}
+# The ids let us tell apart items that share the watermark date.
+
+NEWEST_FIRST = "PUBLISHED_DATE_DESC"
+
+# days before the watermark that paging goes back in published date, to
+# pick up items revised since the last run
+REVISION_WINDOW = 365
+
+
+def watermark_of(df):
+    """High-water mark of a records_frame() table."""
+    if len(df) == 0:
+        return {"statusDate": None, "ids": []}
+    latest = df["statusDate"].max()
+    ids = df.index[df["statusDate"] == latest].tolist()
+    return {"statusDate": latest, "ids": ids}
+
+
+def load_watermark(path):
+    if not os.path.exists(path):
+        return {"statusDate": None, "ids": []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_watermark(path, watermark):
+    # write then rename so a crash never leaves a half written file
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(watermark, f)
+    os.replace(tmp, path)
+
+
+def harvest_since(watermark, limiter=None, min_interval=None, max_pages=None,
+                  revision_window=REVISION_WINDOW):
+    """Fetch pages newest published first and keep what changed since the watermark.
+
+    Returns the list of pages holding only the new or updated items (by
+    statusDate). Paging stops once the published date is more than
+    `revision_window` days before the watermark; revisions of items
+    published before that are not seen. revision_window=None, like an
+    empty watermark, pages through everything.
+    """
+    if limiter is None and min_interval is not None:
+        limiter = PoliteLimiter(min_interval)
+    since = watermark.get("statusDate")
+    seen = set(watermark.get("ids", ()))
+    stop = None
+    if since is not None and revision_window is not None:
+        stop = (date.fromisoformat(since[:10]) - timedelta(days=revision_window)).isoformat()
+
+    pages = []
+    skip = 0
+    while max_pages is None or len(pages) < max_pages:
+        page = get_page(skip, limiter=limiter, sort=NEWEST_FIRST)
+        hits = page["itemHits"]
+        keep = []
+        reached_old = False
+        for hit in hits:
+            item = hit["item"]
+            published = item.get("publishedDate") or item["statusDate"]
+            if stop is not None and published[:10] < stop:
+                reached_old = True
+                break
+            status_date = item["statusDate"]
+            if since is not None and (status_date < since or
+                                      (status_date == since and item["id"] in seen)):
+                continue
+            keep.append(hit)
+        if keep:
+            pages.append(dict(page, itemHits=keep))
+        if reached_old or len(hits) < PAGE_SIZE:
+            break
+        skip += PAGE_SIZE
+    return pages
+
+
+def upsert(existing, new):
+    """Replace rows of `existing` that appear in `new` and append the rest."""
+    if len(new) == 0:
+        return existing
+    kept = existing.loc[~existing.index.isin(new.index)]
+    return pd.concat([kept, new])
+
+
+def incremental_update(tsv_path, watermark_path=None, min_interval=None):
+    """Bring a saved ChemRxiv TSV up to date and return the merged table.
+
+    Reads `tsv_path` (as written by the notebook), fetches only what is
+    newer than its watermark, upserts the new rows, and writes both the TSV
+    and the watermark back out.
+    """
+    if watermark_path is None:
+        watermark_path = os.path.splitext(tsv_path)[0] + ".watermark.json"
+
+    if os.path.exists(tsv_path):
+        # as text, so "None" (no vorDoi) and "NA" (Namibia) stay what they are
+        existing = pd.read_csv(tsv_path, sep="\t", index_col=0, dtype=str,
+                               keep_default_na=False)
+    else:
+        existing = pd.DataFrame(columns=COLUMNS)
+
+    watermark = load_watermark(watermark_path)
+    if watermark["statusDate"] is None and len(existing):
+        watermark = watermark_of(existing)
+
+    new = records_frame(harvest_since(watermark, min_interval=min_interval))
+    merged = upsert(existing, new)
+    merged.to_csv(tsv_path, sep="\t", header=True)
+
+    # carry the old watermark forward if nothing new came in
+    if len(new):
+        save_watermark(watermark_path, watermark_of(merged))
+    else:
+        save_watermark(watermark_path, watermark)
+    log.info("%d new or updated records", len(new))
+    return merged
@@ -0,0 +1,229 @@
+"""
+Streaming ChemRxiv harvest into rotating on-disk shards.
+
+harvest_pages() keeps every page in memory until the end and the raw JSON
+is thrown away once it has been flattened, so changing what gets extracted
+means another full harvest. harvest_to_shards() instead writes each page,
+as it arrives, to a gzipped JSON lines shard (one page per line) and its
+extracted rows to a matching rows shard:
+
+    shards/raw-00000.jsonl.gz    raw pages
+    shards/rows-00000.parquet    records_frame() of those pages
+                                 (rows-00000.jsonl.gz without pyarrow)
+    shards/manifest.json         finished shards and the skips they hold
+
+Only the current shard's rows are held in memory, and at most a few pages
+are fetched ahead of the writer, so memory stays flat however big the
+corpus gets. A shard only appears in the manifest once both of its files
+are complete, so an interrupted harvest resumes from the last finished
+shard.
+
+Downstream code reads the shards lazily: iter_row_frames() yields one
+DataFrame per shard, iter_pages() the raw pages, and rederive_rows()
+rebuilds every rows shard from the raw pages without refetching.
+"""
+import gzip
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import instrumentation
+from chemrxiv_harvest import get_page, page_skips, records_frame, total_count
+from rate_limit import PoliteLimiter
+
+SHARD_PAGES = 200  # 10,000 items per shard at the API's page size
+
+
+def _has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _bounded_map(pool, fn, items, ahead):
+    """Like pool.map() but with at most `ahead` calls submitted and not yet consumed."""
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= ahead:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _manifest_path(directory):
+    return os.path.join(directory, "manifest.json")
+
+
+def load_manifest(directory):
+    path = _manifest_path(directory)
+    if not os.path.exists(path):
+        return {"shards": []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_manifest(directory, manifest):
+    # write then rename so a crash never leaves a half written file
+    path = _manifest_path(directory)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def _write_rows(df, directory, number, parquet):
+    """Write one rows shard; returns its file name."""
+    if parquet:
+        from columnar_store import save_table
+        name = "rows-" + format(number, "05d") + ".parquet"
+        save_table(df, os.path.join(directory, name + ".tmp"), "chemrxiv")
+    else:
+        name = "rows-" + format(number, "05d") + ".jsonl.gz"
+        df.rename_axis("id").reset_index().to_json(
+            os.path.join(directory, name + ".tmp"), orient="records", lines=True,
+            compression="gzip")
+    os.replace(os.path.join(directory, name + ".tmp"), os.path.join(directory, name))
+    return name
+
+
+class _ShardWriter:
+    """Raw pages and extracted rows for one shard at a time."""
+
+    def __init__(self, directory, manifest, parquet):
+        self.directory = directory
+        self.manifest = manifest
+        self.parquet = parquet
+        self.number = max((s["number"] for s in manifest["shards"]), default=-1) + 1
+        self._open()
+
+    def _open(self):
+        self.raw_name = "raw-" + format(self.number, "05d") + ".jsonl.gz"
+        self._raw = gzip.open(os.path.join(self.directory, self.raw_name + ".tmp"),
+                              "wt", encoding="utf-8")
+        self.pages = []
+        self.skips = []
+
+    def write(self, skip, page):
+        self._raw.write(json.dumps(page) + "\n")
+        self.pages.append(page)
+        self.skips.append(skip)
+
+    def finish(self):
+        """Close the current shard and record it in the manifest."""
+        self._raw.close()
+        if not self.skips:
+            os.remove(os.path.join(self.directory, self.raw_name + ".tmp"))
+            return
+        os.replace(os.path.join(self.directory, self.raw_name + ".tmp"),
+                   os.path.join(self.directory, self.raw_name))
+        df = records_frame(self.pages)
+        rows_name = _write_rows(df, self.directory, self.number, self.parquet)
+        self.manifest["shards"].append({"number": self.number, "raw": self.raw_name,
+                                        "rows": rows_name, "items": len(df),
+                                        "skips": self.skips})
+        _save_manifest(self.directory, self.manifest)
+        self.number += 1
+
+    def rotate(self):
+        self.finish()
+        self._open()
+
+
+def harvest_to_shards(directory, skips=None, workers=4, min_interval=None,
+                      limiter=None, shard_pages=SHARD_PAGES, parquet=None,
+                      progress=True):
+    """Harvest ChemRxiv page by page into shards under `directory`.
+
+    Pages already in a finished shard are not fetched again. Rows shards
+    are Parquet when pyarrow is installed (or `parquet` is True), gzipped
+    JSON lines otherwise. Requests are paced by the rate_governor unless
+    `min_interval` or `limiter` is given, as in harvest_pages(). Returns the
+    manifest.
+    """
+    os.makedirs(directory, exist_ok=True)
+    if parquet is None:
+        parquet = _has_pyarrow()
+    if skips is None:
+        skips = page_skips(total_count())
+    if limiter is None and min_interval is not None:
+        limiter = PoliteLimiter(min_interval)
+
+    manifest = load_manifest(directory)
+    done = {skip for shard in manifest["shards"] for skip in shard["skips"]}
+    todo = [skip for skip in skips if skip not in done]
+    tracker = instrumentation.Progress(len(todo), "ChemRxiv pages", enabled=progress)
+
+    def fetch(skip):
+        page = get_page(skip, limiter=limiter)
+        tracker.update()
+        return skip, page
+
+    writer = _ShardWriter(directory, manifest, parquet)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for skip, page in _bounded_map(pool, fetch, todo, 2 * workers):
+            writer.write(skip, page)
+            if len(writer.skips) >= shard_pages:
+                writer.rotate()
+    writer.finish()
+    return manifest
+
+
+# --- reading shards back -----------------------------------------------------
+
+def iter_pages(directory):
+    """Raw pages from every finished shard, in harvest order."""
+    for shard in load_manifest(directory)["shards"]:
+        with gzip.open(os.path.join(directory, shard["raw"]), "rt", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def read_rows_shard(path, columns=None):
+    if path.endswith(".parquet"):
+        from columnar_store import load_table
+        return load_table(path, columns)
+    df = pd.read_json(path, orient="records", lines=True, compression="gzip",
+                      dtype=False).set_index("id")
+    return df if columns is None else df[columns]
+
+
+def iter_row_frames(directory, columns=None):
+    """One DataFrame (indexed by item id) per shard, read only when needed."""
+    for shard in load_manifest(directory)["shards"]:
+        yield read_rows_shard(os.path.join(directory, shard["rows"]), columns)
+
+
+def read_rows(directory, columns=None):
+    """All shards as one table; an item in two shards keeps the later copy."""
+    frames = list(iter_row_frames(directory, columns))
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    df = pd.concat(frames)
+    return df[~df.index.duplicated(keep="last")]
+
+
+def rederive_rows(directory, extract=records_frame, parquet=None):
+    """Rebuild every rows shard from its raw pages with `extract`.
+
+    `extract` takes a list of pages and returns a DataFrame; use it after
+    changing what records_frame() pulls out, instead of harvesting again.
+    """
+    if parquet is None:
+        parquet = _has_pyarrow()
+    manifest = load_manifest(directory)
+    for shard in manifest["shards"]:
+        with gzip.open(os.path.join(directory, shard["raw"]), "rt", encoding="utf-8") as f:
+            pages = [json.loads(line) for line in f]
+        df = extract(pages)
+        old = shard["rows"]
+        shard["rows"] = _write_rows(df, directory, shard["number"], parquet)
+        shard["items"] = len(df)
+        if old != shard["rows"]:
+            os.remove(os.path.join(directory, old))
+        _save_manifest(directory, manifest)
+    return manifest
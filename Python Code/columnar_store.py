@@ -0,0 +1,116 @@
+"""
+Typed Parquet storage for the intermediate tables.
+
+The TSVs mix integers with the "no_data" / "None" sentinels, so metric
+columns come back from read_csv as object dtype. Here every stage has an
+explicit schema: sentinels become missing values, counts become pandas'
+nullable Int64, dates become datetimes, and repeated labels (countries,
+institutions, journals) become categoricals. Parquet files are much
+smaller than the TSVs and load_table() can read just the columns needed.
+
+Needs pyarrow (pip install pyarrow); have_pyarrow() says whether it is there.
+"""
+import pandas as pd
+
+# values the notebook writes when a field is missing ("no_data" for
+# institutions, countries and metrics, "None" for names, vorDoi and Scopus
+# fields). "NA" is not one of them: it is Namibia's country code.
+SENTINELS = ["no_data", "None", ""]
+# a number or date column cannot hold these either, so there they are missing too
+NUMBER_SENTINELS = SENTINELS + ["none", "NA"]
+
+# stage -> {column: dtype}; "int", "date", "category" and "string" are
+# converted by to_typed(), columns not listed are left alone
+SCHEMAS = {
+    "chemrxiv": {
+        "doi": "string", "status": "category", "statusDate": "date",
+        "first_au_firstName": "string", "first_au_lastName": "string",
+        "first_au_inst": "category", "first_au_country": "category",
+        "last_au_firstName": "string", "last_au_lastName": "string",
+        "last_au_inst": "category", "last_au_country": "category",
+        "title": "string", "abstractViews": "int", "citations": "int",
+        "contentDownloads": "int", "vorDoi": "string",
+    },
+    "metadata": {
+        "doi": "string", "author_names": "string", "author_ids": "string",
+        "author_afids": "string", "afid": "string", "affilname": "string",
+        "affiliation_city": "string", "affiliation_country": "string",
+        "author_count": "int", "title": "string", "coverDate": "date",
+        "publicationName": "category", "issn": "category", "volume": "string",
+        "issueIdentifier": "string", "article_number": "string",
+        "pageRange": "string", "openaccess": "int", "freetoread": "string",
+        "freetoreadLabel": "category",
+    },
+    # PlumX metric columns vary from run to run; see plumx_schema()
+    "plumx": {"doi": "string", "NOTES": "category"},
+}
+
+
+def plumx_schema(columns):
+    """'doi' and 'NOTES' as in SCHEMAS, every other column an integer metric."""
+    fixed = SCHEMAS["plumx"]
+    return {c: fixed.get(c, "int") for c in columns}
+
+
+def schema_for(df, stage):
+    """Schema for `df`. Stage "merged" is metadata plus PlumX columns."""
+    if stage == "plumx":
+        return plumx_schema(df.columns)
+    if stage == "merged":
+        schema = plumx_schema(df.columns)
+        schema.update({c: t for c, t in SCHEMAS["metadata"].items() if c in df.columns})
+        return schema
+    return {c: t for c, t in SCHEMAS[stage].items() if c in df.columns}
+
+
+def to_typed(df, stage):
+    """Copy of `df` with its columns converted to the stage schema."""
+    out = df.copy()
+    for column, kind in schema_for(df, stage).items():
+        values = out[column]
+        if values.dtype == object or pd.api.types.is_string_dtype(values.dtype):
+            missing = NUMBER_SENTINELS if kind in ("int", "date") else SENTINELS
+            values = values.mask(values.isin(missing))
+        if kind == "int":
+            values = pd.to_numeric(values, errors="coerce").round().astype("Int64")
+        elif kind == "date":
+            values = pd.to_datetime(values, errors="coerce", utc=True)
+        elif kind == "category":
+            values = values.astype("string").astype("category")
+        elif kind == "string":
+            values = values.astype("string")
+        out[column] = values
+    return out
+
+
+def have_pyarrow():
+    """True if pyarrow is installed, i.e. save_table() / load_table() can run."""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _require_pyarrow():
+    if not have_pyarrow():
+        raise ImportError("Parquet storage needs pyarrow: pip install pyarrow")
+
+
+def save_table(df, path, stage):
+    """Write `df` to Parquet with the schema of `stage`."""
+    _require_pyarrow()
+    to_typed(df, stage).to_parquet(path, engine="pyarrow", index=True)
+
+
+def load_table(path, columns=None):
+    """Read a table written by save_table(), optionally only some columns."""
+    _require_pyarrow()
+    return pd.read_parquet(path, engine="pyarrow", columns=columns)
+
+
+def tsv_to_parquet(tsv_path, parquet_path, stage):
+    """Convert one of the existing TSVs (written with its index) to Parquet."""
+    df = pd.read_csv(tsv_path, sep="\t", index_col=0, dtype=str, keep_default_na=False)
+    save_table(df, parquet_path, stage)
+    return parquet_path
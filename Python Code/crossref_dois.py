@@ -0,0 +1,156 @@
+"""
+Enumerate journal DOIs from the Crossref REST API.
+
+https://api.crossref.org/swagger-ui/index.html
+
+listOfDois() used to fetch the first page twice and then page with
+&offset=, which Crossref caps and which gets slower the deeper it goes.
+This version uses deep paging with &cursor=* (the first response is also
+the first page of results) and collect_dois() runs the ISSN/year pairs
+concurrently. All requests share the Crossref rate_governor, which paces
+them by the X-Rate-Limit-* headers Crossref sends back, so we stay inside
+the polite pool's limits.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from http_cache import get_json
+from rate_governor import governor
+from rate_limit import PoliteLimiter
+
+JBASE_URL = "https://api.crossref.org/journals/"  # the base url for api calls
+
+# polite pool limits, see the Crossref REST API docs
+POLITE_WORKERS = 3
+POLITE_INTERVAL = 0.1  # seconds between requests per mailto
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(email, min_interval=None):
+    """The limiter shared by every request made with this mailto.
+
+    That is the Crossref rate_governor, or with `min_interval` a fixed
+    PoliteLimiter (e.g. POLITE_INTERVAL) per mailto.
+    """
+    if min_interval is None:
+        return governor.for_url(JBASE_URL)
+    with _limiters_lock:
+        if email not in _limiters:
+            _limiters[email] = PoliteLimiter(min_interval)
+        return _limiters[email]
+
+
+def works_url(issn, year, rows=1000, cursor="*", email=None):
+    # query to get DOIs for one year of one journal
+    url = (JBASE_URL + issn + "/works?filter=from-pub-date:" + str(year)
+           + ",until-pub-date:" + str(year) + "&select=DOI"
+           + "&rows=" + str(rows) + "&cursor=" + quote(cursor, safe="*"))
+    if email:
+        url += "&mailto=" + email
+    return url
+
+
+def _complete(data):
+    # a first page that holds every result; the only kind of page that may
+    # be cached, since the next-cursor of any other expires within minutes
+    message = data["message"]
+    return len(message["items"]) >= message["total-results"]
+
+
+def iter_dois(issn, year, email=None, rows=1000, limiter=None, timeout=60):
+    """Yield every DOI published in `issn` during `year`, page by page.
+
+    Raises RuntimeError if Crossref stops handing out pages before
+    total-results DOIs have come back (an expired cursor, say), so a
+    truncated list is never taken for the whole year.
+    """
+    if limiter is None:
+        limiter = limiter_for(email)
+    cursor = "*"
+    seen = 0
+    while True:
+        keep = _complete if cursor == "*" else (lambda data: False)
+        message = get_json(works_url(issn, year, rows, cursor, email), timeout, limiter,
+                           keep=keep)["message"]
+        items = message["items"]
+        for item in items:
+            yield item["DOI"]
+        seen += len(items)
+        total = message["total-results"]
+        if seen >= total:
+            return
+        if not items:
+            raise RuntimeError("Crossref returned " + str(seen) + " of " + str(total)
+                               + " DOIs for " + issn + " " + str(year)
+                               + " before running out of pages")
+        cursor = message["next-cursor"]
+
+
+def listOfDois(issn, year, rows=1000, email=None, limiter=None):
+    """Get DOIs based on issn and year."""
+    return list(iter_dois(issn, year, email, rows, limiter))
+
+
+def collect_dois(issns, years, email=None, workers=POLITE_WORKERS, rows=1000,
+                 limiter=None):
+    """Run listOfDois() for every ISSN/year pair concurrently.
+
+    Returns {issn: {year: [dois]}} with years as strings, the same shape as
+    the compare_dois dictionary in the notebook.
+    """
+    if limiter is None:
+        limiter = limiter_for(email)
+    pairs = [(issn, str(year)) for issn in issns for year in years]
+
+    def fetch(pair):
+        issn, year = pair
+        return listOfDois(issn, year, rows, email, limiter)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(fetch, pairs))
+
+    out = {}
+    for (issn, year), dois in zip(pairs, results):
+        out.setdefault(issn, {})[year] = dois
+    return out
+
+
+def count_dois(issn, year, email=None, limiter=None, timeout=60):
+    """Number of works in `issn` for `year`, from a single rows=0 request."""
+    if limiter is None:
+        limiter = limiter_for(email)
+    url = works_url(issn, year, rows=0, email=email)
+    return get_json(url, timeout, limiter)["message"]["total-results"]
+
+
+def count_all(issns, years, email=None, workers=POLITE_WORKERS, limiter=None):
+    """count_dois() for every ISSN/year pair, as {(issn, year): count}."""
+    if limiter is None:
+        limiter = limiter_for(email)
+    pairs = [(issn, str(year)) for issn in issns for year in years]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        counts = list(pool.map(lambda p: count_dois(p[0], p[1], email, limiter), pairs))
+    return dict(zip(pairs, counts))
+
+
+def for_each_doi(issns, years, consume, email=None, workers=POLITE_WORKERS,
+                 rows=1000, limiter=None):
+    """Stream every DOI to `consume(issn, year, doi)` without keeping them.
+
+    ISSN/year pairs run concurrently like collect_dois(), so `consume` must
+    be safe to call from several threads.
+    """
+    if limiter is None:
+        limiter = limiter_for(email)
+    pairs = [(issn, str(year)) for issn in issns for year in years]
+
+    def fetch(pair):
+        issn, year = pair
+        for doi in iter_dois(issn, year, email, rows, limiter):
+            consume(issn, year, doi)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(fetch, pairs))
@@ -0,0 +1,161 @@
+"""
+Bibliographic metadata for many DOIs at once from the Crossref REST API.
+
+Title, journal, ISSN, volume, issue, pages and date came only from
+ScopusSearch. Crossref has all of them and returns up to 100 DOIs per
+request with
+
+    /works?filter=doi:a,doi:b,...&select=DOI,title,container-title,...
+
+crossref_works() fetches them that way, concurrently and through the
+shared Crossref rate_governor. enrich_metadata() adds them to the
+ScopusSearch metadata as extra crossref_* columns (crossref_title,
+crossref_publicationName, crossref_coverDate, ...). The Scopus columns are
+left as ScopusSearch returns them, so tables keep their meaning and
+Scopus' journal names, which age matching pairs on by default:
+
+    from crossref_metadata import enrich_metadata
+    metadata_df_compare = enrich_metadata(compare_dois_sample, email=email,
+                                          journal='metadata.journal.jsonl')
+
+Scopus is the only source of the author, affiliation and open access
+columns, so with scopus=True every DOI is still looked up there. Where
+only journal and date are needed (age matching and the R analysis), pass
+scopus=False: no Elsevier call is made, the Scopus columns stay empty and
+age matching uses the Crossref columns instead (by="crossref_publicationName",
+date="crossref_coverDate"). Crossref's journal names are not always
+spelled like Scopus' (e.g. "Angewandte Chemie International Edition" vs
+"Angewandte Chemie - International Edition"), so both cohorts have to be
+matched on the same source.
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import pandas as pd
+
+import instrumentation
+from crossref_dois import POLITE_WORKERS, limiter_for
+from doi_index import canonical_doi
+from http_cache import get_json
+from scopus_metadata import COLUMNS, FIELDS, doi_batches, search_metadata
+
+WORKS_URL = "https://api.crossref.org/works"
+
+# search_metadata() columns that Crossref fills
+CROSSREF_FIELDS = ["title", "publicationName", "issn", "volume", "issueIdentifier",
+                   "article_number", "pageRange", "coverDate"]
+# and the names enrich_metadata() adds them under
+CROSSREF_COLUMNS = ["crossref_" + f for f in CROSSREF_FIELDS]
+# and the ones only Scopus has
+SCOPUS_ONLY = [f for f in FIELDS if f not in CROSSREF_FIELDS]
+
+SELECT = ["DOI", "title", "container-title", "ISSN", "issn-type", "volume", "issue",
+          "article-number", "page", "published-print", "issued"]
+
+_TAG = re.compile(r"<[^>]+>")
+
+
+def works_url(dois, email=None):
+    # one filter=doi:... clause per DOI; commas separate filters, so a DOI
+    # holding one cannot be looked up this way (see crossref_works)
+    url = (WORKS_URL + "?filter=" + ",".join("doi:" + quote(doi, safe="/") for doi in dois)
+           + "&select=" + ",".join(SELECT) + "&rows=" + str(len(dois)))
+    if email:
+        url += "&mailto=" + email
+    return url
+
+
+def _first(item, key):
+    values = item.get(key) or [None]
+    return values[0]
+
+
+def _cover_date(item):
+    # Scopus coverDate is a full ISO date; Crossref may only give year or year and month
+    for key in ("published-print", "issued"):
+        parts = ((item.get(key) or {}).get("date-parts") or [[None]])[0]
+        if parts and parts[0] is not None:
+            parts = list(parts) + [1] * (3 - len(parts))
+            return format(parts[0], "04d") + "-" + format(parts[1], "02d") + "-" \
+                + format(parts[2], "02d")
+    return None
+
+
+def crossref_record(item):
+    """One Crossref work as search_metadata() columns."""
+    issn = None
+    for entry in item.get("issn-type") or []:
+        if entry.get("type") == "print":
+            issn = entry.get("value")
+    issn = issn or _first(item, "ISSN")
+    title = _first(item, "title")
+    if title is not None:
+        title = " ".join(_TAG.sub("", title).split())
+    return {"doi": item.get("DOI"),
+            "title": title,
+            "publicationName": _first(item, "container-title"),
+            # Scopus writes ISSNs without the hyphen
+            "issn": issn.replace("-", "") if issn else None,
+            "volume": item.get("volume"),
+            "issueIdentifier": item.get("issue"),
+            "article_number": item.get("article-number"),
+            "pageRange": item.get("page"),
+            "coverDate": _cover_date(item)}
+
+
+def crossref_works(dois, email=None, workers=POLITE_WORKERS, max_dois=100,
+                   max_length=3000, limiter=None, progress=True):
+    """Crossref metadata for `dois`: one row per input DOI, in input order.
+
+    Rows for DOIs Crossref does not have (and DOIs with a comma in them,
+    which the filter syntax cannot express) are empty.
+    """
+    if limiter is None:
+        limiter = limiter_for(email)
+    keys = {}
+    for doi in dict.fromkeys(dois):
+        key = canonical_doi(doi)
+        if key is not None and "," not in key:
+            keys.setdefault(key, doi)
+    batches = list(doi_batches(list(keys.values()), max_dois, max_length))
+    tracker = instrumentation.Progress(len(keys), "Crossref DOIs", enabled=progress)
+
+    def fetch(batch):
+        message = get_json(works_url(batch, email), limiter=limiter)["message"]
+        tracker.update(len(batch))
+        return message["items"]
+
+    found = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for items in pool.map(fetch, batches):
+            for item in items:
+                found.setdefault(canonical_doi(item.get("DOI")), item)
+
+    with instrumentation.stage("crossref.frame", len(dois)):
+        rows = []
+        for doi in dois:
+            item = found.get(canonical_doi(doi))
+            row = crossref_record(item) if item is not None else {}
+            row["doi"] = doi
+            rows.append(row)
+        return pd.DataFrame(rows, columns=["doi"] + CROSSREF_FIELDS)
+
+
+def enrich_metadata(dois, email=None, scopus=True, journal=None, search=None,
+                    delay=None, workers=POLITE_WORKERS):
+    """search_metadata() plus the Crossref values in CROSSREF_COLUMNS.
+
+    The Scopus columns are unchanged. With scopus=False ScopusSearch is not
+    called and they stay empty. `journal`, `search` and `delay` go to
+    search_metadata().
+    """
+    crossref = crossref_works(dois, email, workers)
+    if scopus:
+        out = search_metadata(dois, delay=delay, search=search, journal=journal)
+    else:
+        out = pd.DataFrame({"doi": list(dois)}, columns=COLUMNS)
+    with instrumentation.stage("crossref.enrich", len(out)):
+        for field, column in zip(CROSSREF_FIELDS, CROSSREF_COLUMNS):
+            out[column] = crossref[field].to_numpy()
+    return out
@@ -20,9 +20,30 @@
 import json
 import requests
 from pprint import pprint
-from time import sleep
 import pandas as pd
 
+# %%
+# cache API responses on disk so re-running cells doesn't hit the APIs again
+# set offline=True to replay only from the cache (a missing response raises CacheMiss)
+import http_cache
+from http_cache import get_json
+http_cache.use_cache(http_cache.ResponseCache('api_cache.sqlite', offline=False))
+
+# %%
+# PlumX and ScopusSearch results are reused until they are older than
+# 7 days (PlumX) / 90 days (metadata); only stale or new DOIs cost Elsevier quota
+import elsevier_cache
+elsevier_cache.use_cache(elsevier_cache.ElsevierCache('elsevier_cache.sqlite'))
+
+# %%
+# contact address for the Crossref polite pool
+email = "email_address"
+
+# %%
+# latency / error / sleep counters for every API call, see instrumentation.print_summary()
+import instrumentation
+instrumentation.reset()
+
 # %%
 # here is an example
 api = "https://chemrxiv.org/engage/chemrxiv/public-api/v1/"
@@ -31,7 +52,7 @@ limit = "?limit=50" # max page size
 page = "&skip=8000"
 
 # %%
-api_data = requests.get(api + query + limit + page).json()
+api_data = get_json(api + query + limit + page)
 
 # view first record
 api_data["itemHits"][0]
@@ -90,84 +111,21 @@ api = "https://chemrxiv.org/engage/chemrxiv/public-api/v1/"
 query = "items"
 limit = "?limit=50" # max page size
 page = "&skip=8000" # example
-api_data = requests.get(api + query + limit + page).json()
-
-# %%
-api_data_dict = {}
-for idx in range(len(api_data["itemHits"])):
-    # setting the key as the ChemRXiv ID
-    key = api_data["itemHits"][idx]["item"]["id"]
-    
-    # add selected data fields
-    doi = api_data["itemHits"][idx]["item"]["doi"]
-    status = api_data["itemHits"][idx]["item"]["status"]
-    statusDate = api_data["itemHits"][idx]["item"]["statusDate"]      
-    title = api_data["itemHits"][idx]["item"]["title"]
-    
-    # get first author info
-    first_au_firstName = api_data["itemHits"][idx]["item"]["authors"][0]["firstName"]
-    first_au_lastName = api_data["itemHits"][idx]["item"]["authors"][0]["lastName"]
-    
-    # note if author has multiple instituion info, this gets first one listed
-    first_au_inst = api_data["itemHits"][idx]["item"]["authors"][0]["institutions"][0]["name"]
-    first_au_country = api_data["itemHits"][idx]["item"]["authors"][0]["institutions"][0]["country"]
-   
-    # get last author
-    len_authors = len(api_data["itemHits"][idx]["item"]["authors"])
-    
-    if len_authors > 1:
-        last_au_firstName = api_data["itemHits"][idx]["item"]["authors"][len_authors-1]["firstName"]
-        last_au_lastName = api_data["itemHits"][idx]["item"]["authors"][len_authors-1]["lastName"]
-        
-        last_au_inst = api_data["itemHits"][idx]["item"]["authors"][len_authors-1]["institutions"][0]["name"]
-        last_au_country = api_data["itemHits"][idx]["item"]["authors"][len_authors-1]["institutions"][0]["country"]               
-    else:
-        last_au_firstName = "None"
-        last_au_lastName = "None"
-        
-        last_au_inst = "None"
-        last_au_country = "None"
-      
-    # metrics
-       
-    if api_data["itemHits"][idx]["item"]["metrics"][0]["description"] == "Abstract Views":
-        abstractViews = api_data["itemHits"][idx]["item"]["metrics"][0]["value"]
-    else:
-        abstractViews = "no_data"
-        
-    if api_data["itemHits"][idx]["item"]["metrics"][1]["description"] == "Citations":
-        citations = api_data["itemHits"][idx]["item"]["metrics"][1]["value"]
-    else:
-        citations = "no_data"
-        
-    if api_data["itemHits"][idx]["item"]["metrics"][2]["description"] == "Content Downloads":
-        downloads = api_data["itemHits"][idx]["item"]["metrics"][2]["value"]
-    else:
-        downloads = "no_data"
-        
-    # handle version of record doi
-    if api_data["itemHits"][idx]["item"]["vor"] is None:
-        vorDoi = "None"
-    else:
-        vorDoi = api_data["itemHits"][idx]["item"]["vor"]["vorDoi"]
-    
-    # add data to dictionary    
-    api_data_dict[key] = {"doi": doi,"status": status, "statusDate": statusDate,
-                          "first_au_firstName": first_au_firstName, "first_au_lastName": first_au_lastName,
-                          "first_au_inst": first_au_inst, "first_au_country": first_au_country,
-                          "last_au_firstName": last_au_firstName, "last_au_lastName": last_au_lastName,                          
-                          "last_au_inst": last_au_inst, "last_au_country": last_au_country,
-                          "title":title, "abstractViews": abstractViews, "citations": citations,
-                          "contentDownloads": downloads, "vorDoi": vorDoi}
-
-# %%
-list(api_data_dict)[0]
-
-# %%
-list(api_data_dict.values())[0]
-
-# %%
-df = pd.DataFrame.from_dict(api_data_dict,orient="index")
+api_data = get_json(api + query + limit + page)
+
+# %%
+# flatten the page into one row per preprint, keyed by the ChemRXiv ID
+# (metrics are matched by their description, not their position)
+from chemrxiv_harvest import records_frame
+df = records_frame(api_data)
+
+# %%
+df.index[0]
+
+# %%
+df.iloc[0]
+
+# %%
 df.head(5)
 
 # %%
@@ -177,7 +135,7 @@ query = "items"
 limit = "?limit=50" # max page size
 page = "&skip="
 
-api_data = requests.get(api + query + limit).json()
+api_data = get_json(api + query + limit)
 num_preprints = api_data["totalCount"]
 print(num_preprints)
 
@@ -191,110 +149,52 @@ len(skips)
 api + query + limit + page + str(skips[0])
 
 # %%
-####### loop through all ~355 pages of preprint data
-####### this will take ~ 30 min.
-
-api_data_dict = {}
-for skip in skips:
-    api_data = requests.get(api + query + limit + page + str(skip)).json()
-    sleep(2)    
-    for idx in range(len(api_data["itemHits"])):
-        # setting the key as the ChemRXiv ID
-        key = api_data["itemHits"][idx]["item"]["id"]
-    
-        # add selected data fields
-        doi = api_data["itemHits"][idx]["item"]["doi"]
-        status = api_data["itemHits"][idx]["item"]["status"]
-        statusDate = api_data["itemHits"][idx]["item"]["statusDate"]    
-        title = api_data["itemHits"][idx]["item"]["title"]
-        
-        # get first author info
-        first_au_firstName = api_data["itemHits"][idx]["item"]["authors"][0]["firstName"]
-        first_au_lastName = api_data["itemHits"][idx]["item"]["authors"][0]["lastName"]
-    
-        # note if author has multiple instituion info, this gets first one listed
-        # also sometimes there is country data without institutions and vice versa
-        
-        len_first_au_inst = len(api_data["itemHits"][idx]["item"]["authors"][0]["institutions"])
-        
-        if len_first_au_inst >= 1:
-            first_au_inst = api_data["itemHits"][idx]["item"]["authors"][0]["institutions"][0]["name"]
-            first_au_country = api_data["itemHits"][idx]["item"]["authors"][0]["institutions"][0]["country"]           
-        else:
-            first_au_inst = "no_data"
-            first_au_country = "no_data"
-                 
-        # get last author info
-        len_authors = len(api_data["itemHits"][idx]["item"]["authors"])
-    
-        if len_authors > 1:
-            last_au_firstName = api_data["itemHits"][idx]["item"]["authors"][len_authors-1]["firstName"]
-            last_au_lastName = api_data["itemHits"][idx]["item"]["authors"][len_authors-1]["lastName"]          
-            
-        else:
-            last_au_firstName = "None"
-            last_au_lastName = "None"
-            
-          
-        len_last_au_inst = len(api_data["itemHits"][idx]["item"]["authors"][len_authors-1]["institutions"])
-        
-        if len_authors > 1 and len_last_au_inst >=1:
-            last_au_inst = api_data["itemHits"][idx]["item"]["authors"][len_authors-1]["institutions"][0]["name"]
-            last_au_country = api_data["itemHits"][idx]["item"]["authors"][len_authors-1]["institutions"][0]["country"]  
-         
-        else:
-            last_au_inst = "no_data"
-            last_au_country = "no_data"
-           
-        # metrics
-       
-        if api_data["itemHits"][idx]["item"]["metrics"][0]["description"] == "Abstract Views":
-            abstractViews = api_data["itemHits"][idx]["item"]["metrics"][0]["value"]
-        else:
-            abstractViews = "no_data"
-        
-        if api_data["itemHits"][idx]["item"]["metrics"][1]["description"] == "Citations":
-            citations = api_data["itemHits"][idx]["item"]["metrics"][1]["value"]
-        else:
-            citations = "no_data"
-        
-        if api_data["itemHits"][idx]["item"]["metrics"][2]["description"] == "Content Downloads":
-            downloads = api_data["itemHits"][idx]["item"]["metrics"][2]["value"]
-        else:
-            downloads = "no_data"
-        
-        # handle version of record doi
-        if api_data["itemHits"][idx]["item"]["vor"] is None:
-            vorDoi = "None"
-        else:
-            vorDoi = api_data["itemHits"][idx]["item"]["vor"]["vorDoi"]
-    
-        # add data to dictionary       
-        api_data_dict[key] = {"doi": doi,"status": status, "statusDate": statusDate,
-                             "first_au_firstName": first_au_firstName, "first_au_lastName": first_au_lastName,
-                             "first_au_inst": first_au_inst, "first_au_country": first_au_country,
-                             "last_au_firstName": last_au_firstName, "last_au_lastName": last_au_lastName,                          
-                             "last_au_inst": last_au_inst, "last_au_country": last_au_country,
-                             "title":title, "abstractViews": abstractViews, "citations": citations,
-                             "contentDownloads": downloads, "vorDoi": vorDoi}
-
-# %%
-len(api_data_dict)
-
-# %%
-list(api_data_dict)[0]
-
-# %%
-list(api_data_dict.values())[0]
-
-# %%
-df1 = pd.DataFrame.from_dict(api_data_dict,orient="index")
+####### fetch all ~355 pages of preprint data
+####### 4 workers share one politeness budget, paced by the rate governor
+####### (never faster than one request a second, two in flight; pass
+####### min_interval=2 for the old fixed one request every 2 s);
+####### pages already in the response cache are not fetched or waited for
+from chemrxiv_harvest import harvest_pages
+
+pages_all = harvest_pages(skips, workers=4)
+
+# %%
+# flatten all pages in one pass, one row per ChemRXiv ID
+df1 = records_frame(pages_all)
+len(df1)
+
+# %%
+####### instead of the two cells above, the harvest can be streamed to shards on disk:
+####### each page (raw JSON) and its rows are written as they arrive, so memory stays
+####### flat, and rerunning resumes after the last finished shard
+from chemrxiv_shards import harvest_to_shards, read_rows, rederive_rows
+
+# harvest_to_shards('chemrxiv_shards', workers=4)
+# df1 = read_rows('chemrxiv_shards')
+# after changing the extraction, rebuild the rows from the saved raw pages:
+# rederive_rows('chemrxiv_shards')
+
+# %%
+df1.index[0]
+
+# %%
+df1.iloc[0]
+
+# %%
 df1.head(5)
 
 # %%
 # save to CSV
 df1.to_csv('chemrxiv_data_2023-05-04-ALL.tsv', sep='\t', header=True)
 
+# %%
+# typed Parquet copy: metrics as nullable integers, countries/institutions as categories.
+# Parquet needs pyarrow, which is optional: without it only the TSVs are written
+from columnar_store import have_pyarrow, save_table, load_table
+PARQUET = have_pyarrow()
+if PARQUET:
+    save_table(df1, 'chemrxiv_data_2023-05-04-ALL.parquet', 'chemrxiv')
+
 # %%
 # create a dataframe with only the preprints that have a version of record DOI
 df2 = df1.loc[~df1['vorDoi'].str.contains("None")]
@@ -305,6 +205,18 @@ len(df2)
 
 # %%
 df2.to_csv('chemrxiv_data_2023-05-04-vor_only.tsv', sep='\t', header=True)
+if PARQUET:
+    save_table(df2, 'chemrxiv_data_2023-05-04-vor_only.parquet', 'chemrxiv')
+
+# %%
+####### incremental refresh: on a later run, instead of the full harvest above, bring the
+####### saved table up to date, fetching only preprints new or revised since (the file is
+####### rewritten in place; its statusDate high-water mark is kept next to it in
+####### chemrxiv_data_2023-05-04-ALL.watermark.json)
+from chemrxiv_harvest import incremental_update
+
+# df1 = incremental_update('chemrxiv_data_2023-05-04-ALL.tsv')
+# df2 = df1.loc[~df1['vorDoi'].str.contains("None")]
 
 # %% [markdown]
 # # Get Scopus PlumX Data for ChemRxiv records with a published version of record
@@ -312,6 +224,8 @@ df2.to_csv('chemrxiv_data_2023-05-04-vor_only.tsv', sep='\t', header=True)
 # %%
 # load data
 df2 = pd.read_csv('chemrxiv_data_2023-05-04-vor_only.tsv', sep='\t',index_col=0)
+# or the typed copy, only the columns needed here:
+# df2 = load_table('chemrxiv_data_2023-05-04-vor_only.parquet', columns=['doi', 'vorDoi'])
 df2.head(5)
 
 # %%
@@ -341,71 +255,32 @@ vorDois = df2.loc[:,"vorDoi"].tolist()
 len(vorDois)
 
 # %%
-# Get all PlumX data in a loop
-plum_df_all = pd.DataFrame()
-
-for doi in vorDois:
-        
-    try:
-    
-        # query search
-        plum = PlumXMetrics(doi, id_type='doi',refresh=True)
-    
-        # delay between api calls to be nice to Elsevier
-        sleep(0.25)
-    
-        # account for when the API returns no data
-        if plum.category_totals is None:
-        
-            # create a dataframe with an empty row and note
-            category_totals = pd.Series(['NOTES'])
-            total = pd.Series(['API returned plum.category_totals as None'])
-            plum_df = pd.DataFrame({'name': category_totals, 'total': total})
-            plum_df = plum_df.set_index('name')
-            plum_df = plum_df.transpose()
-            plum_df['doi'] = doi
-            first_column = plum_df.pop('doi')
-            plum_df.insert(0, 'doi', first_column)
-      
-        # account for when API returns data
-        if plum.category_totals is not None:
-          # save to dataframes
-            df_capture = pd.DataFrame(plum.capture)
-            df_citation = pd.DataFrame(plum.citation)
-            df_mention = pd.DataFrame(plum.mention)
-            df_social = pd.DataFrame(plum.social_media)
-            df_use = pd.DataFrame(plum.usage)
-    
-            # concatenate frames and set new index
-            frames = [df_capture, df_citation, df_mention, df_social, df_use]
-            plum_df = pd.concat(frames)
-            plum_df = plum_df.set_index('name')
-            plum_df = plum_df.transpose()
-            plum_df['doi'] = doi
-            first_column = plum_df.pop('doi')
-            plum_df.insert(0, 'doi', first_column)
-    
-        # add to overall frame
-        plum_df_all = pd.concat([plum_df_all, plum_df])
-    
-    except:
-     # handle the case when Scopus returns a 404 or some other error
-     # create a dataframe with an empty row and note
-            category_totals = pd.Series(['NOTES'])
-            total = pd.Series(['exception error: API returned Scopus error'])
-            plum_df = pd.DataFrame({'name': category_totals, 'total': total})
-            plum_df = plum_df.set_index('name')
-            plum_df = plum_df.transpose()
-            plum_df['doi'] = doi
-            first_column = plum_df.pop('doi')
-            plum_df.insert(0, 'doi', first_column)
-            plum_df_all = pd.concat([plum_df_all, plum_df])
-            
+# put the DOIs in one canonical form (lower case, no https://doi.org/ etc.)
+# and keep each one once, so duplicates are not fetched twice.
+# the same index is used for the comparison cohort below
+from doi_index import DoiIndex
+doi_index = DoiIndex()
+vorDois = doi_index.add_all(vorDois, 'chemrxiv_vor')
+len(vorDois)
+
+# %%
+# Get all PlumX data: several workers sharing one budget
+# the rate governor paces requests to what Elsevier allows our key (pass rate=3
+# for a fixed requests/second); 429 and 5xx errors are retried with backoff, other errors
+# (e.g. a 404) become a NOTES row, as does a DOI the API returns no data for.
+# each DOI is saved to the journal file as it finishes; re-running the cell
+# after a crash only fetches the DOIs that are not in the journal yet
+from plumx_collect import collect_plumx
+
+plum_collector = collect_plumx(vorDois, workers=4, journal='PlumX.journal.jsonl')
+plum_df_all = plum_collector.frame()
 plum_df_all.head(10)
 
 # %%
 # save
 plum_df_all.to_csv("PlumX_chemrxiv_data_2023-05-04-vor_only.tsv", sep = '\t', index=True)
+if PARQUET:
+    save_table(plum_df_all, "PlumX_chemrxiv_data_2023-05-04-vor_only.parquet", 'plumx')
 
 # %%
 # Collect the metadata for each vor DOI
@@ -420,71 +295,19 @@ q1_df = pd.DataFrame(q1.results)
 q1_df.columns
 
 # %%
-metadata = []
-for i,doi in enumerate(vorDois):
-    q = ScopusSearch('DOI('+ doi + ')', download=True)    
-    num = q.get_results_size()
-    sleep(0.25)
-    print(i)
-    
-    if num == 0:
-        metadata.append([doi,"Not able to get metadata, DOI not found in ScopusSearch"])
-    
-    else:
-       # create a dataframe
-        q_df = pd.DataFrame(q.results)
-        
-       # save metadata
-       # There is definetely a better way to do this....but it works.
-        
-        author_names = q_df.author_names.tolist()[0]
-        author_ids = q_df.author_ids.tolist()[0]
-        author_afids = q_df.author_afids.tolist()[0]
-        afid = q_df.afid.tolist()[0]
-        affilname = q_df.affilname.tolist()[0]
-        affiliation_city = q_df.affiliation_city.tolist()[0]
-        affiliation_country = q_df.affiliation_country.tolist()[0]
-        author_count = q_df.author_count.tolist()[0]
-        title = q_df.title.tolist()[0]
-        coverDate = q_df.coverDate.tolist()[0]
-        publicationName = q_df.publicationName.tolist()[0]
-        issn = q_df.issn.tolist()[0]
-        volume = q_df.volume.tolist()[0]
-        issueIdentifier = q_df.issueIdentifier.tolist()[0]
-        article_number = q_df.article_number.tolist()[0]
-        pageRange = q_df.pageRange.tolist()[0]
-        openaccess = q_df.openaccess.tolist()[0]
-        freetoread = q_df.freetoread.tolist()[0]
-        freetoreadLabel = q_df.freetoreadLabel.tolist()[0]
-        
-        metadata.append([doi,
-                         author_names,
-                         author_ids,
-                         author_afids,
-                         afid,
-                         affilname,
-                         affiliation_city,
-                         affiliation_country,
-                         author_count,
-                         title,
-                         coverDate,
-                         publicationName,
-                         issn,
-                         volume,
-                         issueIdentifier,
-                         article_number,
-                         pageRange,
-                         openaccess,
-                         freetoread,
-                         freetoreadLabel])
-        
-metadata_df = pd.DataFrame(metadata)
-metadata_df.rename(columns={0: "doi",1: "author_names",2: "author_ids", 3: "author_afids",
-                            4: "afid", 5: "affilname", 6: "affiliation_city", 7: "affiliation_country",
-                            8: "author_count", 9: "title", 10: "coverDate", 11: "publicationName",
-                            12: "issn", 13: "volume", 14: "issueIdentifier", 15: "article_number",
-                            16: "pageRange", 17: "openaccess", 18: "freetoread", 19: "freetoreadLabel"},
-                            inplace=True)
+# look up many DOIs per query: DOI(a) OR DOI(b) OR ...
+# results are matched back to vorDois, with a note for DOIs Scopus doesn't have
+# (or couldn't be asked about; rerun the cell to try those again)
+from scopus_metadata import search_metadata
+
+# the journal keeps finished DOIs so an interrupted run can pick up where it stopped
+# (both cohorts share one journal, so a DOI in both is only looked up once)
+metadata_df = search_metadata(vorDois, journal='metadata.journal.jsonl')
+
+# when only journal and date are needed (age matching), Crossref has them for 100 DOIs
+# per request without using Elsevier quota; they come as crossref_* columns, e.g.
+# from crossref_metadata import enrich_metadata
+# metadata_df = enrich_metadata(vorDois, email=email, scopus=False)
 
 # %%
 metadata_df.head(3)
@@ -498,6 +321,7 @@ len(plum_df_all)
 
 # %%
 # There appears to be a few duplicate vDOIs from the ChemRXiv data, so we will remove these rows before merging
+# (vorDois is de-duplicated by doi_index before fetching now, so this should no longer drop anything)
 metadata_df.drop_duplicates('doi',keep=False, inplace=True)
 print(len(metadata_df))
 
@@ -515,6 +339,8 @@ len(plum_and_metadata)
 
 # %%
 plum_and_metadata.to_csv("metadata_AND_PlumX_chemrxiv_data_2023-05-04-vor_only.tsv", sep = '\t', index=True)
+if PARQUET:
+    save_table(plum_and_metadata, "metadata_AND_PlumX_chemrxiv_data_2023-05-04-vor_only.parquet", 'merged')
 
 # %%
 
@@ -545,40 +371,19 @@ name_dictionary = {
     "2050-7488": "Journal of Materials Chemistry A"
 }
 
-email = "email_address"
 mailto = "&mailto=" + email
 
 # %%
-# create a function to get DOIs based on issn and year
-
-def listOfDois(issn, year, rows = 1000):
-    jbase_url = "https://api.crossref.org/journals/"  # the base url for api calls
-    journal_works = "/works?filter=from-pub-date:"+year+",until-pub-date:"+year+"&select=DOI"  # query to get DOIs for year
-    rows = "&rows=" + str(rows)
-    requestData = requests.get(jbase_url + issn + journal_works + rows + mailto).json()
-    numResults = requestData["message"]["total-results"]
-    sleep(1)
-    
-    doi_list = []
-    for n in range(int(numResults/1000)+1): # list(range(int(numberOfResults/1000)+1)) = [0,1]
-        query = requests.get(jbase_url + issn + journal_works + rows + "&offset=" + str(1000*n) + mailto).json()
-        sleep(1)
-        for doi in range(len(query["message"]["items"])):
-            doi_list.append(query["message"]["items"][doi]["DOI"])  
-    print(requestData["message"]["total-results"])
-    return doi_list
+# function to get DOIs based on issn and year
+# (uses Crossref cursor paging; see crossref_dois.py)
+from crossref_dois import listOfDois, collect_dois
 
 # %%
 from time import time
 start = time()
 # query crossref to get DOIs
-compare_dois = {}
-for issn in name_dictionary.keys():
-    years = {}
-    for year in range(2017,2024):
-        dois = listOfDois(issn, str(year))
-        years[str(year)] = dois
-    compare_dois[issn] = years
+# all ISSN/year pairs run concurrently, sharing one polite-pool budget for our mailto
+compare_dois = collect_dois(name_dictionary.keys(), range(2017,2024), email=email)
 print(f"Runtime = {(time() - start)}")
 
 # %%
@@ -613,147 +418,51 @@ compare_dois_sample[0:50]
 len(compare_dois_sample)
 
 # %%
-# Grab all of the PlumX data for comparison DOIs
-# Get all PlumX data in a loop
-
-# Get all PlumX data in a loop
-plum_df_all_compare = pd.DataFrame()
-
-for doi in compare_dois_sample:
-        
-    try:
-    
-        # query search
-        plum = PlumXMetrics(doi, id_type='doi',refresh=True)
-    
-        # delay between api calls to be nice to Elsevier
-        sleep(0.25)
-    
-        # account for when the API returns no data
-        if plum.category_totals is None:
-        
-            # create a dataframe with an empty row and note
-            category_totals = pd.Series(['NOTES'])
-            total = pd.Series(['API returned plum.category_totals as None'])
-            plum_df = pd.DataFrame({'name': category_totals, 'total': total})
-            plum_df = plum_df.set_index('name')
-            plum_df = plum_df.transpose()
-            plum_df['doi'] = doi
-            first_column = plum_df.pop('doi')
-            plum_df.insert(0, 'doi', first_column)
-      
-        # account for when API returns data
-        if plum.category_totals is not None:
-          # save to dataframes
-            df_capture = pd.DataFrame(plum.capture)
-            df_citation = pd.DataFrame(plum.citation)
-            df_mention = pd.DataFrame(plum.mention)
-            df_social = pd.DataFrame(plum.social_media)
-            df_use = pd.DataFrame(plum.usage)
-    
-            # concatenate frames and set new index
-            frames = [df_capture, df_citation, df_mention, df_social, df_use]
-            plum_df = pd.concat(frames)
-            plum_df = plum_df.set_index('name')
-            plum_df = plum_df.transpose()
-            plum_df['doi'] = doi
-            first_column = plum_df.pop('doi')
-            plum_df.insert(0, 'doi', first_column)
-    
-        # add to overall frame
-        plum_df_all_compare = pd.concat([plum_df_all_compare, plum_df])
-    
-    except:
-     # handle the case when Scopus returns a 404 or some other error
-     # create a dataframe with an empty row and note
-            category_totals = pd.Series(['NOTES'])
-            total = pd.Series(['exception error: API returned Scopus error'])
-            plum_df = pd.DataFrame({'name': category_totals, 'total': total})
-            plum_df = plum_df.set_index('name')
-            plum_df = plum_df.transpose()
-            plum_df['doi'] = doi
-            first_column = plum_df.pop('doi')
-            plum_df.insert(0, 'doi', first_column)
-            plum_df_all_compare = pd.concat([plum_df_all_compare, plum_df])
-            
+# instead of collecting every DOI and sampling them (the cells above), the sample can be
+# drawn while paging through Crossref, without building compare_dois / compare_dois_list
+# (memory stays at ~5000 DOIs). reproducible for a given seed, but not the same sample as
+# random.sample(); mode='proportional' or 'equal' stratifies by ISSN x year
+from doi_sampler import sample_crossref
+
+# compare_dois_sample = sample_crossref(name_dictionary.keys(), range(2017,2024), n=5000,
+#                                       mode='uniform', seed=30, email=email)
+
+# %%
+# canonical, de-duplicated comparison DOIs
+compare_dois_sample = doi_index.add_all(compare_dois_sample, 'comparison')
+
+# control DOIs that are actually ChemRxiv versions of record
+chemrxiv_in_controls = doi_index.overlap('comparison', 'chemrxiv_vor')
+print(len(compare_dois_sample), len(chemrxiv_in_controls))
+
+# %%
+# Grab all of the PlumX data for comparison DOIs (as for the vor-only DOIs above)
+plum_collector_compare = collect_plumx(compare_dois_sample, workers=4,
+                                       journal='PlumX.journal.jsonl')
+plum_df_all_compare = plum_collector_compare.frame()
 plum_df_all_compare.head(10)
 
 # %%
 len(plum_df_all_compare)
 
+# %%
+# per-metric counts and sums for both cohorts, straight from the long arrays of
+# the collectors collect_plumx() returned
+# (category_frame('social_media') / sparse_frame() give other views of the same data)
+from plumx_collect import cohort_totals
+cohort_totals({'vor': plum_collector, 'comparison': plum_collector_compare})
+
 # %%
 # next get the metadata
-metadata_compare = []
-for i,doi in enumerate(compare_dois_sample):
-    q = ScopusSearch('DOI('+ doi + ')', download=True)    
-    num = q.get_results_size()
-    sleep(0.25)
-    print(i)
-    
-    if num == 0:
-        metadata_compare.append([doi,"Not able to get metadata, DOI not found in ScopusSearch"])
-    
-    else:
-       # create a dataframe
-        q_df = pd.DataFrame(q.results)
-        
-       # save metadata
-       # There is definetely a better way to do this....but it works.
-        
-        author_names = q_df.author_names.tolist()[0]
-        author_ids = q_df.author_ids.tolist()[0]
-        author_afids = q_df.author_afids.tolist()[0]
-        afid = q_df.afid.tolist()[0]
-        affilname = q_df.affilname.tolist()[0]
-        affiliation_city = q_df.affiliation_city.tolist()[0]
-        affiliation_country = q_df.affiliation_country.tolist()[0]
-        author_count = q_df.author_count.tolist()[0]
-        title = q_df.title.tolist()[0]
-        coverDate = q_df.coverDate.tolist()[0]
-        publicationName = q_df.publicationName.tolist()[0]
-        issn = q_df.issn.tolist()[0]
-        volume = q_df.volume.tolist()[0]
-        issueIdentifier = q_df.issueIdentifier.tolist()[0]
-        article_number = q_df.article_number.tolist()[0]
-        pageRange = q_df.pageRange.tolist()[0]
-        openaccess = q_df.openaccess.tolist()[0]
-        freetoread = q_df.freetoread.tolist()[0]
-        freetoreadLabel = q_df.freetoreadLabel.tolist()[0]
-        
-        metadata_compare.append([doi,
-                         author_names,
-                         author_ids,
-                         author_afids,
-                         afid,
-                         affilname,
-                         affiliation_city,
-                         affiliation_country,
-                         author_count,
-                         title,
-                         coverDate,
-                         publicationName,
-                         issn,
-                         volume,
-                         issueIdentifier,
-                         article_number,
-                         pageRange,
-                         openaccess,
-                         freetoread,
-                         freetoreadLabel])
-        
-metadata_df_compare = pd.DataFrame(metadata_compare)
-metadata_df_compare.rename(columns={0: "doi",1: "author_names",2: "author_ids", 3: "author_afids",
-                            4: "afid", 5: "affilname", 6: "affiliation_city", 7: "affiliation_country",
-                            8: "author_count", 9: "title", 10: "coverDate", 11: "publicationName",
-                            12: "issn", 13: "volume", 14: "issueIdentifier", 15: "article_number",
-                            16: "pageRange", 17: "openaccess", 18: "freetoread", 19: "freetoreadLabel"},
-                            inplace=True)
+metadata_df_compare = search_metadata(compare_dois_sample,
+                                      journal='metadata.journal.jsonl')
 
 # %%
 len(metadata_df_compare)
 
 # %%
 # not sure why there are a few duplicates from crossref...maybe overlap of year
+# (also de-duplicated by doi_index before fetching now)
 metadata_df_compare.drop_duplicates('doi',keep=False, inplace=True)
 print(len(metadata_df_compare))
 
@@ -764,6 +473,8 @@ print(len(plum_df_all_compare))
 # %%
 # merge data
 plum_and_metadata_compare = pd.merge(metadata_df_compare, plum_df_all_compare, on='doi')
+# flag controls that are also ChemRxiv versions of record
+doi_index.flag(plum_and_metadata_compare, 'chemrxiv_vor', 'is_chemrxiv_vor')
 plum_and_metadata_compare.head(3)
 
 # %%
@@ -771,7 +482,59 @@ len(plum_and_metadata_compare)
 
 # %%
 plum_and_metadata_compare.to_csv("metadata_AND_PlumX_comparison_data_2023-05-04.tsv", sep = '\t', index=True)
+if PARQUET:
+    save_table(plum_and_metadata_compare, "metadata_AND_PlumX_comparison_data_2023-05-04.parquet", 'merged')
+
+# %%
+# reload only the columns needed, e.g.
+# load_table("metadata_AND_PlumX_comparison_data_2023-05-04.parquet", columns=['doi', 'Citation Indexes', 'Readers'])
+
 
 
 
 
+
+# %%
+# authors and affiliations as integer keyed tables instead of ';' joined strings,
+# e.g. citations of the comparison works by affiliation country
+from author_tables import normalize
+authors_compare = normalize(plum_and_metadata_compare)
+authors_compare.per_country(plum_and_metadata_compare['Citation Indexes']).sort_values(ascending=False).head(10)
+
+# %% [markdown]
+# # Age-matched tables for the R analysis
+
+# %%
+# pair each ChemRxiv version of record with the nearest comparison article(s)
+# from the same journal by coverDate (k controls each, at most 365 days apart)
+from age_match import write_matched
+age_pairs = write_matched(plum_and_metadata, plum_and_metadata_compare, '2023-05-04',
+                          k=1, caliper_days=365)
+len(age_pairs)
+
+# %%
+# where did the time go? (API latency vs. our own rate limiting vs. pandas work)
+instrumentation.print_summary()
+
+# %%
+# Elsevier cache hits / stale entries / misses for this session
+elsevier_cache.current_cache().stats()
+
+# %%
+# what the rate governor currently allows per host (interval, concurrency,
+# the servers' advertised limits and remaining quota, 429s seen)
+import rate_governor
+rate_governor.governor.budget()
+
+# %% [markdown]
+# # The whole collection as a pipeline
+
+# %%
+# every step above as a named stage, to run instead of the cells above: rerunning only
+# redoes stages whose code, parameters or inputs changed, and the ChemRxiv and comparison
+# branches run in parallel (outputs are cached in .pipeline_cache/)
+from pipeline_runner import collection_pipeline
+
+# pipeline = collection_pipeline(name_dictionary.keys(), range(2017,2024), '2023-05-04', email=email)
+# outputs = pipeline.run()
+# pipeline.status
@@ -0,0 +1,81 @@
+"""
+Canonical DOI index shared by the ChemRxiv and comparison cohorts.
+
+The notebook used to find duplicate DOIs only after PlumX and ScopusSearch
+had been called for every copy, and then dropped all copies with
+drop_duplicates('doi', keep=False). Here DOIs are put in one canonical
+form (trimmed, lower case, no https://doi.org/ or doi: prefix) before
+anything is fetched, so each DOI is fetched once. The index also
+remembers which cohorts each DOI belongs to, which shows the control DOIs
+that are really ChemRxiv versions of record.
+"""
+import re
+from urllib.parse import unquote
+
+_PREFIX = re.compile(r"^(?:https?://(?:dx\.)?doi\.org/|doi:\s*)", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+
+# what the ChemRxiv table holds when there is no version of record
+MISSING = {"", "none", "nan", "no_data"}
+
+
+def canonical_doi(doi):
+    """Canonical form of a DOI, or None if it is empty or a placeholder."""
+    if doi is None:
+        return None
+    doi = _SPACE.sub("", str(doi))
+    doi = _PREFIX.sub("", doi)
+    if "%" in doi:
+        doi = unquote(doi)
+    doi = doi.lower()
+    if doi in MISSING:
+        return None
+    return doi
+
+
+class DoiIndex:
+    """Canonical DOIs in first-seen order, with the cohorts they belong to."""
+
+    def __init__(self):
+        self._cohorts = {}    # canonical doi -> set of cohort names
+        self._spellings = {}  # canonical doi -> original strings, one per add()
+
+    def __len__(self):
+        return len(self._cohorts)
+
+    def __contains__(self, doi):
+        return canonical_doi(doi) in self._cohorts
+
+    def add(self, doi, cohort):
+        """Add one DOI; returns its canonical form (None if it was empty)."""
+        key = canonical_doi(doi)
+        if key is None:
+            return None
+        self._cohorts.setdefault(key, set()).add(cohort)
+        self._spellings.setdefault(key, []).append(doi)
+        return key
+
+    def add_all(self, dois, cohort):
+        """Add many DOIs; returns the cohort's canonical DOIs, each once."""
+        keys = (self.add(doi, cohort) for doi in dois)
+        return list(dict.fromkeys(k for k in keys if k is not None))
+
+    def unique(self, cohort=None):
+        """Canonical DOIs to fetch, once each, for one cohort or for all."""
+        return [k for k, c in self._cohorts.items() if cohort is None or cohort in c]
+
+    def cohorts_of(self, doi):
+        return set(self._cohorts.get(canonical_doi(doi), ()))
+
+    def overlap(self, cohort, other):
+        """DOIs that are in both cohorts."""
+        return [k for k, c in self._cohorts.items() if cohort in c and other in c]
+
+    def duplicates(self):
+        """{canonical doi: [spellings]} for DOIs that were added more than once."""
+        return {k: v for k, v in self._spellings.items() if len(v) > 1}
+
+    def flag(self, df, cohort, name, column="doi"):
+        """Add a boolean column `name`: is the row's DOI also in `cohort`?"""
+        df[name] = [cohort in self._cohorts.get(canonical_doi(d), ()) for d in df[column]]
+        return df
@@ -0,0 +1,81 @@
+"""
+Append-only journal of per-DOI results for the long API loops.
+
+Each finished DOI is written as one JSON line and flushed to disk straight
+away, so a kernel restart or a dropped connection only loses the call that
+was in flight. On the next run, keys already in the journal are skipped and
+the final tables are rebuilt from what the journal holds.
+
+A half written last line (from a crash mid-write) is ignored on load.
+"""
+import json
+import os
+import threading
+
+
+class Journal:
+    """Dictionary-like view of a JSONL file that is only ever appended to.
+
+    If a key is written more than once the last value wins.
+    """
+
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._values = {}
+        if os.path.exists(path):
+            self._load()
+        self._file = open(path, "a", encoding="utf-8")
+        # start on a fresh line if the last write was cut short
+        if self._file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self._values[entry["key"]] = entry["value"]
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def keys(self):
+        return self._values.keys()
+
+    def missing(self, keys):
+        """Keys not in the journal yet, in order and without repeats."""
+        return [key for key in dict.fromkeys(keys) if key not in self._values]
+
+    def append(self, key, value):
+        line = json.dumps({"key": key, "value": value}) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._values[key] = value
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
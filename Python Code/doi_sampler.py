@@ -0,0 +1,141 @@
+"""
+Reproducible sampling of the comparison DOI cohort straight from a stream.
+
+Instead of building the full list of DOIs and calling random.sample(), every
+DOI gets a pseudo-random priority computed from a hash of (seed, DOI) and
+each stratum keeps only the k DOIs with the smallest priorities (bottom-k
+reservoir sampling). This gives a uniform random sample of each stratum
+while holding at most k DOIs per stratum in memory. Because the priority
+depends only on the seed and the DOI, the sample is the same no matter in
+which order the DOIs arrive, so the concurrent Crossref fan-out does not
+change it.
+
+N.B. the sample is not the same one random.seed(30) + random.sample() gave
+for the May 2023 collection.
+"""
+import hashlib
+import heapq
+import threading
+
+from crossref_dois import POLITE_WORKERS, count_all, for_each_doi
+
+
+def priority(doi, seed):
+    """Deterministic pseudo-random number in [0, 1) for a DOI."""
+    digest = hashlib.blake2b((str(seed) + ":" + doi.lower()).encode("utf-8"),
+                             digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64
+
+
+class Reservoir:
+    """Keep the k lowest priority DOIs seen so far."""
+
+    def __init__(self, k, seed=30):
+        self.k = k
+        self.seed = seed
+        self.seen = 0
+        self._heap = []  # (-priority, doi), so heap[0] is the one to drop next
+        self._dois = set()
+
+    def add(self, doi):
+        self.seen += 1
+        if self.k <= 0 or doi in self._dois:
+            return
+        p = priority(doi, self.seed)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, (-p, doi))
+            self._dois.add(doi)
+        elif p < -self._heap[0][0]:
+            _, dropped = heapq.heapreplace(self._heap, (-p, doi))
+            self._dois.discard(dropped)
+            self._dois.add(doi)
+
+    def sample(self):
+        """The sampled DOIs, lowest priority first (i.e. in random order)."""
+        return [doi for _, doi in sorted(self._heap, reverse=True)]
+
+
+class StratifiedSampler:
+    """One Reservoir per stratum, with k given per stratum by `allocation`.
+
+    Safe to feed from several threads. Strata missing from `allocation`
+    get `default_k` (0 unless set).
+    """
+
+    def __init__(self, allocation, seed=30, default_k=0):
+        self.allocation = dict(allocation)
+        self.seed = seed
+        self.default_k = default_k
+        self.reservoirs = {}
+        self._lock = threading.Lock()
+
+    def add(self, stratum, doi):
+        with self._lock:
+            reservoir = self.reservoirs.get(stratum)
+            if reservoir is None:
+                k = self.allocation.get(stratum, self.default_k)
+                reservoir = self.reservoirs[stratum] = Reservoir(k, self.seed)
+            reservoir.add(doi)
+
+    def sample(self):
+        """All strata merged, as one list in random order."""
+        merged = []
+        for reservoir in self.reservoirs.values():
+            merged.extend((priority(doi, self.seed), doi) for doi in reservoir.sample())
+        merged.sort()
+        # a DOI listed under two strata (e.g. two years) is only kept once
+        return list(dict.fromkeys(doi for _, doi in merged))
+
+    def sample_by_stratum(self):
+        return {s: r.sample() for s, r in self.reservoirs.items()}
+
+
+def proportional_allocation(counts, n):
+    """Split n over strata in proportion to `counts` (largest remainder)."""
+    total = sum(counts.values())
+    if total == 0:
+        return {s: 0 for s in counts}
+    n = min(n, total)
+    exact = {s: n * c / total for s, c in counts.items()}
+    alloc = {s: int(e) for s, e in exact.items()}
+    left = n - sum(alloc.values())
+    for s in sorted(exact, key=lambda s: exact[s] - alloc[s], reverse=True)[:left]:
+        alloc[s] += 1
+    return alloc
+
+
+def equal_allocation(strata, k):
+    return {s: k for s in strata}
+
+
+def sample_crossref(issns, years, n=5000, mode="uniform", seed=30, email=None,
+                    workers=POLITE_WORKERS):
+    """Sample comparison DOIs from Crossref without listing them all.
+
+    mode is one of
+      "uniform"      - n DOIs drawn uniformly from everything (like random.sample)
+      "proportional" - n DOIs split over ISSN x year in proportion to their size
+                       (sizes come from one cheap rows=0 request per stratum)
+      "equal"        - n DOIs from each ISSN x year stratum
+    """
+    years = [str(y) for y in years]
+    issns = list(issns)
+    if mode == "uniform":
+        sampler = StratifiedSampler({"all": n}, seed)
+
+        def consume(issn, year, doi):
+            sampler.add("all", doi)
+    else:
+        if mode == "proportional":
+            allocation = proportional_allocation(count_all(issns, years, email, workers), n)
+        elif mode == "equal":
+            allocation = equal_allocation([(i, y) for i in issns for y in years], n)
+        else:
+            raise ValueError("mode must be 'uniform', 'proportional' or 'equal'")
+        sampler = StratifiedSampler(allocation, seed)
+
+        def consume(issn, year, doi):
+            sampler.add((issn, year), doi)
+
+    for_each_doi(issns, years, consume, email, workers)
+    return sampler.sample()
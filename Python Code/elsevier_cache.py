@@ -0,0 +1,177 @@
+"""
+Per-DOI cache of PlumX and ScopusSearch results with a maximum age per endpoint.
+
+PlumXMetrics(..., refresh=True) downloads every DOI again, even one looked
+up a few minutes earlier, and nothing is shared between cohorts or runs.
+With a cache in use, collect_plumx() and search_results() first take every
+DOI whose saved result is younger than the endpoint's maximum age (PlumX
+metrics 7 days, Scopus metadata 90 days by default) and only send the rest
+to Elsevier:
+
+    import elsevier_cache
+    elsevier_cache.use_cache(elsevier_cache.ElsevierCache("elsevier_cache.sqlite"))
+    elsevier_cache.prewarm(vorDois + compare_dois_sample)   # optional, in bulk
+    ... collect_plumx() / search_metadata() as usual ...
+    elsevier_cache.current_cache().stats()
+
+Results are stored in the same JSON friendly form the journals use:
+plumx_record() / error_record() for PlumX and the result dict (or None
+when Scopus does not know the DOI) for ScopusSearch. Errors that may go
+away on their own (rate limits, 5xx, network) are never cached.
+"""
+import json
+import sqlite3
+import threading
+import zlib
+from time import time
+
+import pandas as pd
+
+import instrumentation
+from doi_index import canonical_doi
+from http_cache import DAY
+
+# maximum age of a saved result, per endpoint
+DEFAULT_MAX_AGE = {"plumx": 7 * DAY, "scopus": 90 * DAY}
+
+
+class ElsevierCache:
+    """SQLite backed store of per-DOI results with hit / stale / miss counts."""
+
+    def __init__(self, path, max_age=None):
+        self.path = path
+        self.max_age = dict(DEFAULT_MAX_AGE, **(max_age or {}))
+        self.counts = {}  # endpoint -> {"hits", "stale", "misses", "stored"}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS results (
+                                endpoint TEXT,
+                                doi TEXT,
+                                fetched REAL,
+                                body BLOB,
+                                PRIMARY KEY (endpoint, doi))""")
+        self._db.commit()
+
+    def _count(self, endpoint, what, n=1):
+        counts = self.counts.setdefault(endpoint, {"hits": 0, "stale": 0, "misses": 0, "stored": 0})
+        counts[what] += n
+
+    def get_many(self, endpoint, dois):
+        """{doi: saved result} for the DOIs with a fresh entry."""
+        keys = {}
+        for doi in dict.fromkeys(dois):
+            key = canonical_doi(doi)
+            if key is not None:
+                keys.setdefault(key, []).append(doi)
+        cutoff = time() - self.max_age[endpoint]
+        found = {}
+        hits = stale = 0
+        with self._lock:
+            wanted = list(keys)
+            for i in range(0, len(wanted), 500):
+                chunk = wanted[i:i + 500]
+                rows = self._db.execute(
+                    "SELECT doi, fetched, body FROM results WHERE endpoint = ? AND doi IN ("
+                    + ",".join("?" * len(chunk)) + ")", [endpoint] + chunk).fetchall()
+                for key, fetched, body in rows:
+                    if fetched < cutoff:
+                        stale += 1
+                        continue
+                    hits += 1
+                    value = json.loads(zlib.decompress(body))
+                    for doi in keys[key]:
+                        found[doi] = value
+            self._count(endpoint, "hits", hits)
+            self._count(endpoint, "stale", stale)
+            self._count(endpoint, "misses", len(keys) - hits - stale)
+        for _ in range(hits):
+            instrumentation.metrics.cache_hit(endpoint)
+        return found
+
+    def put(self, endpoint, doi, value):
+        key = canonical_doi(doi)
+        if key is None:
+            return
+        body = zlib.compress(json.dumps(value).encode("utf-8"))
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                             (endpoint, key, time(), body))
+            self._db.commit()
+            self._count(endpoint, "stored")
+
+    def stale(self, endpoint, dois):
+        """DOIs that would be fetched: no entry, or one older than the maximum age."""
+        cutoff = time() - self.max_age[endpoint]
+        with self._lock:
+            fresh = {key for key, in self._db.execute(
+                "SELECT doi FROM results WHERE endpoint = ? AND fetched >= ?",
+                (endpoint, cutoff))}
+        return [doi for doi in dict.fromkeys(dois) if canonical_doi(doi) not in fresh]
+
+    def stats(self):
+        """Hits, stale entries, misses and results stored per endpoint since opening."""
+        with self._lock:
+            sizes = dict(self._db.execute(
+                "SELECT endpoint, COUNT(*) FROM results GROUP BY endpoint").fetchall())
+            rows = {endpoint: dict(counts, entries=sizes.get(endpoint, 0))
+                    for endpoint, counts in self.counts.items()}
+        for endpoint, n in sizes.items():
+            rows.setdefault(endpoint, {"hits": 0, "stale": 0, "misses": 0, "stored": 0,
+                                       "entries": n})
+        out = pd.DataFrame.from_dict(rows, orient="index")
+        if len(out):
+            looked_up = out["hits"] + out["stale"] + out["misses"]
+            out["hit_rate"] = out["hits"] / looked_up.where(looked_up > 0)
+        return out
+
+    def clear(self, endpoint=None):
+        with self._lock:
+            if endpoint is None:
+                self._db.execute("DELETE FROM results")
+            else:
+                self._db.execute("DELETE FROM results WHERE endpoint = ?", (endpoint,))
+            self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+
+_cache = None
+
+
+def use_cache(cache):
+    """Route collect_plumx() and search_results() through `cache` (None turns it off)."""
+    global _cache
+    _cache = cache
+
+
+def current_cache():
+    return _cache
+
+
+def prewarm(dois, plumx=True, metadata=True, **kwargs):
+    """Fetch everything missing or stale for `dois` into the active cache.
+
+    Nothing is fetched for DOIs with fresh entries. Keyword arguments go
+    to collect_plumx() and search_results() (e.g. workers, rate, delay).
+    Returns the number of DOIs fetched per endpoint.
+    """
+    from plumx_collect import collect_plumx
+    from scopus_metadata import search_results
+
+    if _cache is None:
+        raise RuntimeError("no cache in use, call use_cache() first")
+    fetched = {}
+    if plumx:
+        todo = _cache.stale("plumx", dois)
+        options = {k: v for k, v in kwargs.items()
+                   if k in ("workers", "rate", "burst", "retries", "fetch")}
+        collect_plumx(todo, **options)
+        fetched["plumx"] = len(todo)
+    if metadata:
+        todo = _cache.stale("scopus", dois)
+        options = {k: v for k, v in kwargs.items()
+                   if k in ("max_dois", "max_length", "delay", "search")}
+        search_results(todo, **options)
+        fetched["scopus"] = len(todo)
+    return fetched
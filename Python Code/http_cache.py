@@ -0,0 +1,216 @@
+"""
+On-disk cache for the JSON responses from ChemRxiv and Crossref.
+
+Responses are stored in a single SQLite file, keyed by a hash of the
+normalized URL (query parameters sorted, mailto dropped). Each endpoint can
+have its own time-to-live, the file is trimmed back to `max_bytes` by
+evicting the least recently used entries, and offline mode serves only
+what is already cached so past collections can be replayed without
+touching the APIs. Crossref's cursor pages are only cached when the first
+page already holds every result (see crossref_dois.iter_dois): a cursor
+expires within minutes, so a cached one would lead nowhere.
+
+Usage from the notebook:
+
+    import http_cache
+    http_cache.use_cache(http_cache.ResponseCache("api_cache.sqlite"))
+    # ... every get_json() call now goes through the cache
+
+    http_cache.use_cache(http_cache.ResponseCache("api_cache.sqlite", offline=True))
+    # ... replay only, a missing response raises CacheMiss
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import zlib
+from time import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+
+import instrumentation
+from http_transport import transport
+from rate_governor import THROTTLED, governor
+
+DAY = 24 * 60 * 60
+
+# time-to-live per endpoint, matched on the longest "host/path" prefix
+DEFAULT_TTLS = {
+    "chemrxiv.org/engage/chemrxiv/public-api/": 1 * DAY,
+    "api.crossref.org/": 7 * DAY,
+}
+
+# query parameters that do not change the response
+IGNORED_PARAMS = {"mailto"}
+
+# times a throttled (429 / 503) request is tried again under the rate governor
+THROTTLED_RETRIES = 5
+
+
+class CacheMiss(LookupError):
+    """Raised in offline mode when a URL has not been cached."""
+
+
+def normalize_url(url):
+    parts = urlsplit(url)
+    params = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                    if k not in IGNORED_PARAMS)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path,
+                       urlencode(params), ""))
+
+
+def url_key(url):
+    return hashlib.sha256(normalize_url(url).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite backed response cache with per-endpoint TTLs and LRU eviction."""
+
+    def __init__(self, path, ttls=None, default_ttl=DAY, max_bytes=2 * 1024 ** 3,
+                 offline=False):
+        self.path = path
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                key TEXT PRIMARY KEY,
+                                url TEXT,
+                                fetched REAL,
+                                used REAL,
+                                size INTEGER,
+                                body BLOB)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+        self._db.commit()
+
+    def ttl_for(self, url):
+        parts = urlsplit(url)
+        where = parts.netloc.lower() + parts.path
+        best = None
+        for prefix in self.ttls:
+            if where.startswith(prefix) and (best is None or len(prefix) > len(best)):
+                best = prefix
+        return self.default_ttl if best is None else self.ttls[best]
+
+    def get(self, url):
+        """Cached body for `url`, or None if missing or expired.
+
+        In offline mode expired entries are still returned and a missing
+        entry raises CacheMiss.
+        """
+        key = url_key(url)
+        now = time()
+        with self._lock:
+            row = self._db.execute("SELECT fetched, body FROM responses WHERE key = ?",
+                                   (key,)).fetchone()
+            if row is not None and (self.offline or now - row[0] <= self.ttl_for(url)):
+                self._db.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+                self._db.commit()
+                self.hits += 1
+                return zlib.decompress(row[1])
+            self.misses += 1
+        if self.offline:
+            raise CacheMiss(url)
+        return None
+
+    def put(self, url, body):
+        data = zlib.compress(body)
+        now = time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                             (url_key(url), normalize_url(url), now, now, len(data), data))
+            self._db.commit()
+            self._evict()
+
+    def _evict(self):
+        # drop least recently used entries until we are under max_bytes
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute(
+                "SELECT key, size FROM responses ORDER BY used").fetchall():
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self._db.commit()
+
+    def size(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+
+_cache = None
+
+
+def use_cache(cache):
+    """Route get_json() through `cache` (None turns caching off)."""
+    global _cache
+    _cache = cache
+
+
+def current_cache():
+    return _cache
+
+
+def get_json(url, timeout=60, limiter=None, keep=None):
+    """GET a JSON endpoint, using the active cache if there is one.
+
+    The politeness `limiter` is only waited on when we actually go to the
+    network, so cached replays run at full speed. Without one the host's
+    rate_governor is used. A limiter with a done() method (the governor)
+    is told the status and headers of every response, and a 429 or 503
+    is tried again once the governor has slowed down. Requests go through
+    the pooled http_transport, which retries dropped connections and 5xx
+    answers itself; `timeout` is the read timeout.
+
+    `keep(data)`, if given, says whether a response may be cached; a cached
+    one it turns down is fetched again (or raises CacheMiss when offline).
+    """
+    endpoint = instrumentation.endpoint_for(url)
+    cache = _cache
+    if cache is not None:
+        body = cache.get(url)
+        if body is not None:
+            data = json.loads(body)
+            if keep is None or keep(data):
+                instrumentation.metrics.cache_hit(endpoint)
+                return data
+            if cache.offline:
+                raise CacheMiss(url)
+    if limiter is None:
+        limiter = governor.for_url(url)
+    adaptive = hasattr(limiter, "done")
+    for attempt in range(THROTTLED_RETRIES + 1):
+        instrumentation.metrics.slept(endpoint, limiter.wait())
+        status = headers = None
+        try:
+            with instrumentation.timed(endpoint, lambda: len(response.content)):
+                response = transport.get(url, timeout=timeout)
+                status, headers = response.status_code, response.headers
+                response.raise_for_status()
+            break
+        except requests.HTTPError:
+            if not adaptive or status not in THROTTLED or attempt == THROTTLED_RETRIES:
+                raise
+            instrumentation.metrics.retry(endpoint)
+        finally:
+            if adaptive:
+                limiter.done(status, headers)
+    data = response.json()
+    if cache is not None and (keep is None or keep(data)):
+        cache.put(url, response.content)
+    return data
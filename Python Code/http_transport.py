@@ -0,0 +1,131 @@
+"""
+Shared HTTP transport for the requests based API calls.
+
+A bare requests.get() opens a new connection (and TLS handshake) for every
+page and gives up on the first dropped connection or 502, which over
+thousands of small ChemRxiv and Crossref pages is a real share of the run
+time and the usual reason a long loop dies halfway. Transport keeps
+
+  - one requests Session per host, with a pool of keep-alive connections
+    large enough for the workers of a harvest;
+  - compressed transfer (Accept-Encoding: gzip, deflate);
+  - separate connect and read timeouts;
+  - retries of idempotent requests (GET / HEAD) after connection errors,
+    read errors and 500 / 502 / 504 answers, with jittered exponential
+    backoff. 429 and 503 are not retried here: they are left to the
+    rate_governor, which slows the whole host down first;
+  - streaming of large bodies to disk with download().
+
+get_json() goes through the module level `transport`, so the ChemRxiv
+pager and listOfDois() use it without further changes:
+
+    from http_transport import transport
+    transport.get(url).json()
+    transport.download(url, "dump.json.gz")
+"""
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import instrumentation
+
+CONNECT_TIMEOUT = 10   # seconds to open a connection
+READ_TIMEOUT = 60      # seconds to wait for the server between bytes
+POOL_SIZE = 16         # keep-alive connections per host
+RETRIES = 3
+BACKOFF = 0.5          # 0.5, 1, 2 s ... plus jitter
+RETRY_STATUSES = (500, 502, 504)
+
+
+class _CountingRetry(Retry):
+    """Retry that records each retry in instrumentation.metrics."""
+
+    def increment(self, method=None, url=None, response=None, error=None,
+                  _pool=None, _stacktrace=None):
+        if _pool is not None:
+            netloc = _pool.host if _pool.port in (None, 80, 443) else \
+                _pool.host + ":" + str(_pool.port)
+            instrumentation.metrics.retry(instrumentation.endpoint_for("//" + netloc))
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+class Transport:
+    """Pooled keep-alive sessions, one per host. Safe to share between threads."""
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 pool_size=POOL_SIZE, retries=RETRIES, backoff=BACKOFF,
+                 retry_statuses=RETRY_STATUSES):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_statuses = retry_statuses
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _retry(self):
+        return _CountingRetry(total=self.retries, connect=self.retries, read=self.retries,
+                              status=self.retries, other=0,
+                              status_forcelist=self.retry_statuses,
+                              allowed_methods=frozenset(["GET", "HEAD"]),
+                              backoff_factor=self.backoff, backoff_jitter=self.backoff,
+                              raise_on_status=False)
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                              max_retries=self._retry())
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["Accept-Encoding"] = "gzip, deflate"
+        return session
+
+    def session_for(self, url):
+        """The Session shared by every request to this URL's host."""
+        parts = urlsplit(url)
+        key = (parts.scheme.lower(), parts.netloc.lower())
+        with self._lock:
+            if key not in self._sessions:
+                self._sessions[key] = self._new_session()
+            return self._sessions[key]
+
+    def get(self, url, timeout=None, stream=False, **kwargs):
+        """GET through the host's pooled session; `timeout` is the read timeout.
+
+        The response is returned whatever its status, as requests.get()
+        does. With stream=True the body is not read yet; close the response
+        (or use it in a with block) to give the connection back to the pool.
+        """
+        read = self.read_timeout if timeout is None else timeout
+        return self.session_for(url).get(url, timeout=(self.connect_timeout, read),
+                                         stream=stream, **kwargs)
+
+    def download(self, url, path, timeout=None, chunk_size=1 << 16):
+        """Stream a response body to `path` without holding it in memory.
+
+        Written to a temporary file and renamed, so `path` is either complete
+        or absent. Returns the number of bytes written.
+        """
+        written = 0
+        with self.get(url, timeout, stream=True) as response:
+            response.raise_for_status()
+            with open(path + ".tmp", "wb") as f:
+                for chunk in response.iter_content(chunk_size):
+                    f.write(chunk)
+                    written += len(chunk)
+        os.replace(path + ".tmp", path)
+        return written
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+
+
+transport = Transport()
@@ -0,0 +1,221 @@
+"""
+Counters and timers for the API calls and the DataFrame work around them.
+
+Every ChemRxiv, Crossref, PlumX and ScopusSearch call made through the
+helper modules is recorded here: latency (as a histogram), bytes received,
+errors and retries, and the time spent sleeping for politeness or backoff.
+Parsing / pandas stages are timed with stage(). summary() puts it all in
+one table, which shows whether a slow run is waiting on the API, on our
+own rate limiting or on DataFrame work.
+
+    import instrumentation
+    instrumentation.reset()
+    ... run the collection ...
+    instrumentation.print_summary()
+"""
+import threading
+from contextlib import contextmanager
+from time import monotonic
+from urllib.parse import urlsplit
+
+import pandas as pd
+
+# latency histogram bucket upper bounds, in seconds
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+
+HOSTS = {"chemrxiv.org": "chemrxiv", "api.crossref.org": "crossref"}
+
+
+def endpoint_for(url):
+    """Short endpoint name for a URL (the host if it is not one we know)."""
+    host = urlsplit(url).netloc.lower()
+    return HOSTS.get(host, host)
+
+
+class _Endpoint:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.bytes = 0
+        self.busy = 0.0    # time inside requests
+        self.sleep = 0.0   # politeness waits and backoff
+        self.min = float("inf")
+        self.max = 0.0
+        self.histogram = [0] * len(BUCKETS)
+
+    def add(self, seconds):
+        self.calls += 1
+        self.busy += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.histogram[i] += 1
+                break
+
+    def quantile(self, q):
+        # upper bucket bound containing the q-th call
+        target = q * self.calls
+        seen = 0
+        for bound, count in zip(BUCKETS, self.histogram):
+            seen += count
+            if count and seen >= target:
+                return min(bound, self.max)
+        return float("nan")
+
+
+class Metrics:
+    """Thread-safe registry of per-endpoint counters and stage timers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = monotonic()
+            self.endpoints = {}
+            self.stages = {}
+
+    def _ep(self, endpoint):
+        ep = self.endpoints.get(endpoint)
+        if ep is None:
+            ep = self.endpoints[endpoint] = _Endpoint()
+        return ep
+
+    def request(self, endpoint, seconds, nbytes=0, error=False):
+        with self._lock:
+            ep = self._ep(endpoint)
+            ep.add(seconds)
+            ep.bytes += nbytes
+            if error:
+                ep.errors += 1
+
+    def retry(self, endpoint):
+        with self._lock:
+            self._ep(endpoint).retries += 1
+
+    def cache_hit(self, endpoint):
+        with self._lock:
+            self._ep(endpoint).cache_hits += 1
+
+    def slept(self, endpoint, seconds):
+        if seconds:
+            with self._lock:
+                self._ep(endpoint).sleep += seconds
+
+    def stage_time(self, name, seconds, rows=None):
+        with self._lock:
+            calls, total, n = self.stages.get(name, (0, 0.0, 0))
+            self.stages[name] = (calls + 1, total + seconds, n + (rows or 0))
+
+    def summary(self):
+        """One row per endpoint and per stage.
+
+        busy_s and sleep_s are summed over worker threads, so with several
+        workers they can add up to more than the wall clock time.
+        """
+        wall = monotonic() - self.started
+        rows = []
+        with self._lock:
+            for name, ep in sorted(self.endpoints.items()):
+                rows.append({
+                    "name": name, "kind": "endpoint", "calls": ep.calls,
+                    "errors": ep.errors, "retries": ep.retries,
+                    "cache_hits": ep.cache_hits, "MB": ep.bytes / 1e6,
+                    "busy_s": ep.busy, "sleep_s": ep.sleep,
+                    "mean_s": ep.busy / ep.calls if ep.calls else float("nan"),
+                    "p50_s": ep.quantile(0.5), "p95_s": ep.quantile(0.95),
+                    "max_s": ep.max if ep.calls else float("nan"),
+                    "per_s": ep.calls / wall if wall else float("nan"),
+                })
+            for name, (calls, total, n) in sorted(self.stages.items()):
+                rows.append({"name": name, "kind": "stage", "calls": calls,
+                             "busy_s": total, "rows": n,
+                             "mean_s": total / calls if calls else float("nan")})
+        return pd.DataFrame(rows).set_index("name") if rows else pd.DataFrame()
+
+    def histogram(self, endpoint):
+        ep = self.endpoints.get(endpoint)
+        labels = ["<=" + str(b) + "s" for b in BUCKETS[:-1]] + [">" + str(BUCKETS[-2]) + "s"]
+        return pd.Series(ep.histogram if ep else [0] * len(BUCKETS), index=labels)
+
+
+metrics = Metrics()
+
+
+def reset():
+    metrics.reset()
+
+
+def summary():
+    return metrics.summary()
+
+
+def print_summary():
+    wall = monotonic() - metrics.started
+    print("run time " + str(round(wall, 1)) + " s")
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        print(metrics.summary().round(3))
+
+
+@contextmanager
+def timed(endpoint, nbytes=None):
+    """Time one API call; an exception counts as an error and is re-raised.
+
+    `nbytes` can be a callable returning the size once the call is done.
+    """
+    start = monotonic()
+    try:
+        yield
+    except BaseException:
+        metrics.request(endpoint, monotonic() - start, error=True)
+        raise
+    metrics.request(endpoint, monotonic() - start, nbytes() if callable(nbytes) else nbytes or 0)
+
+
+@contextmanager
+def stage(name, rows=None):
+    """Time a parsing / pandas step."""
+    start = monotonic()
+    try:
+        yield
+    finally:
+        metrics.stage_time(name, monotonic() - start, rows)
+
+
+class Progress:
+    """Prints "label: done/total (rate/s, ETA ...)" every `every` seconds.
+
+    Replaces the bare print(i) in the loops. Thread-safe.
+    """
+
+    def __init__(self, total, label="", every=10.0, enabled=True):
+        self.total = total
+        self.label = label
+        self.every = every
+        self.enabled = enabled
+        self.done = 0
+        self._start = monotonic()
+        self._last = self._start
+        self._lock = threading.Lock()
+
+    def update(self, n=1):
+        with self._lock:
+            self.done += n
+            now = monotonic()
+            if not self.enabled or (now - self._last < self.every and self.done < self.total):
+                return
+            self._last = now
+            line = self.line(now)
+        print(line)
+
+    def line(self, now=None):
+        now = monotonic() if now is None else now
+        elapsed = now - self._start
+        rate = self.done / elapsed if elapsed else 0.0
+        eta = str(round((self.total - self.done) / rate)) + " s" if rate else "?"
+        return (self.label + ": " + str(self.done) + "/" + str(self.total)
+                + " (" + str(round(rate, 2)) + "/s, ETA " + eta + ")")
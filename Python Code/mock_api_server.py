@@ -0,0 +1,334 @@
+"""
+Local stand-in for the ChemRxiv, Crossref, PlumX and ScopusSearch APIs.
+
+Serves synthetic, deterministic responses so collection changes can be
+benchmarked without spending live quota:
+
+  /engage/chemrxiv/public-api/v1/items?limit=&skip=&sort=   ChemRxiv items
+  /journals/{issn}/works?filter=...&rows=&cursor=           Crossref DOIs
+  /works?filter=doi:a,doi:b,...                             Crossref metadata
+  /plumx/{doi}                                              PlumX metrics
+  /scopus?query=DOI(a) OR DOI(b) ...                        ScopusSearch results
+
+Latency, error rate and a requests-per-second limit (answered with 429)
+are configurable. pybliometrics cannot be pointed at another host, so for
+PlumX and Scopus this module also provides plumx_fetch() / scopus_search()
+clients with the same shape as PlumXMetrics / ScopusSearch.results, to be
+passed as `fetch=` / `search=` to collect_plumx() and search_metadata().
+
+Run standalone with:  python mock_api_server.py --items 20000 --port 8765
+"""
+import argparse
+import datetime
+import json
+import random
+import re
+import threading
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep
+from types import SimpleNamespace
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+import requests
+
+from scopus_metadata import FIELDS
+
+CHEMRXIV_PATH = "/engage/chemrxiv/public-api/v1/"
+
+
+class MockConfig:
+    """What the mock serves and how badly it behaves."""
+
+    def __init__(self, items=10000, works_per_journal_year=500, vor_share=0.6,
+                 latency=0.0, jitter=0.0, error_rate=0.0, not_found_rate=0.05,
+                 rps_limit=None, seed=0):
+        self.items = items
+        self.works_per_journal_year = works_per_journal_year
+        self.vor_share = vor_share
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate          # share of requests answered with 500
+        self.not_found_rate = not_found_rate  # share of DOIs PlumX/Scopus do not know
+        self.rps_limit = rps_limit            # above this, answer 429
+        self.seed = seed
+
+
+# --- synthetic records ---------------------------------------------------
+
+def _rng(*key):
+    return random.Random(":".join(str(k) for k in key))
+
+
+def chemrxiv_item(i, config):
+    """Item number i; higher numbers are older (as with PUBLISHED_DATE_DESC)."""
+    r = _rng(config.seed, "item", i)
+    day = config.items - i
+    authors = [{"firstName": "F" + str(a), "lastName": "L" + str(i) + "_" + str(a),
+                "institutions": ([{"name": "Uni " + str(r.randrange(500)),
+                                   "country": r.choice(["US", "UK", "DE", "CN", "JP", "IN"])}]
+                                 if r.random() < 0.9 else [])}
+               for a in range(r.randint(1, 6))]
+    metrics = [{"description": "Abstract Views", "value": r.randrange(5000)},
+               {"description": "Citations", "value": r.randrange(50)},
+               {"description": "Content Downloads", "value": r.randrange(2000)}]
+    r.shuffle(metrics)
+    vor = {"vorDoi": vor_doi(i)} if r.random() < config.vor_share else None
+    return {"id": format(i, "024x"), "doi": "10.26434/chemrxiv-bench-" + str(i),
+            "status": "PUBLISHED",
+            "statusDate": "2017-01-01T00:00:00.000Z" if day <= 0 else
+            _date(day) + "T00:00:00.000Z",
+            "title": "Benchmark preprint " + str(i), "authors": authors,
+            "metrics": metrics, "vor": vor}
+
+
+def vor_doi(i):
+    return "10.9999/bench.vor." + str(i)
+
+
+def _date(day):
+    # day number -> ISO date, counted from 2017-01-01
+    return (datetime.date(2017, 1, 1) + datetime.timedelta(days=day % 2500)).isoformat()
+
+
+def crossref_doi(issn, year, k):
+    return "10.9999/" + issn + "." + str(year) + "." + str(k)
+
+
+def crossref_work(doi, config):
+    """Crossref /works item for a DOI, or None for one Crossref does not know."""
+    r = _rng(config.seed, "crossref", doi.lower())
+    if r.random() < config.not_found_rate / 2:
+        return None
+    year, month = 2017 + r.randrange(7), r.randint(1, 12)
+    first = r.randint(1, 9000)
+    return {"DOI": doi.lower(), "title": ["Work <i>" + doi + "</i>"],
+            "container-title": ["Journal " + str(r.randrange(19))],
+            "ISSN": ["0000-" + str(r.randrange(1000, 9999))],
+            "volume": str(r.randrange(1, 150)), "issue": str(r.randint(1, 24)),
+            "page": str(first) + "-" + str(first + r.randint(1, 20)),
+            "issued": {"date-parts": [[year, month]]}}
+
+
+def plumx_body(doi, config):
+    r = _rng(config.seed, "plumx", doi.lower())
+    if r.random() < config.not_found_rate:
+        return None
+    body = {"category_totals": [{"name": c, "total": 1} for c in ("capture", "citation")],
+            "capture": [{"name": "Readers", "total": r.randrange(300)}],
+            "citation": [{"name": "Citation Indexes", "total": r.randrange(100)}],
+            "mention": [], "social_media": [], "usage": []}
+    if r.random() < 0.4:
+        body["social_media"].append({"name": "Tweets", "total": r.randrange(40)})
+    if r.random() < 0.2:
+        body["mention"].append({"name": "News Mentions", "total": r.randrange(5)})
+    if r.random() < 0.05:
+        body["category_totals"] = None
+    return body
+
+
+def scopus_result(doi, config):
+    r = _rng(config.seed, "scopus", doi.lower())
+    if r.random() < config.not_found_rate:
+        return None
+    out = {f: None for f in FIELDS}
+    n = r.randint(1, 8)
+    out.update({"doi": doi,
+                "author_names": ";".join("Author " + str(r.randrange(10 ** 5)) for _ in range(n)),
+                "author_ids": ";".join(str(r.randrange(10 ** 10)) for _ in range(n)),
+                "author_afids": ";".join(str(r.randrange(6 * 10 ** 7, 6 * 10 ** 7 + 3000)) for _ in range(n)),
+                "afid": str(r.randrange(6 * 10 ** 7, 6 * 10 ** 7 + 3000)),
+                "affilname": "Uni " + str(r.randrange(500)),
+                "affiliation_city": "City", "affiliation_country": r.choice(["United States", "Germany", "China"]),
+                "author_count": n, "title": "Work " + doi,
+                "coverDate": _date(r.randrange(2500)),
+                "publicationName": "Journal " + str(r.randrange(19)),
+                "issn": "0000" + str(r.randrange(1000, 9999)), "volume": str(r.randrange(1, 150)),
+                "openaccess": r.randrange(2), "freetoread": None, "freetoreadLabel": None})
+    return out
+
+
+# --- server --------------------------------------------------------------
+
+class _Handler(BaseHTTPRequestHandler):
+    mock = None  # set on the subclass made by MockAPI
+    protocol_version = "HTTP/1.1"  # keep-alive, as the real APIs do
+    disable_nagle_algorithm = True  # headers and body go out in two writes
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=None, headers=()):
+        data = b"" if body is None else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in headers:
+            self.send_header(k, v)
+        if self.mock.config.rps_limit:
+            # advertise the limit the way Crossref does
+            self.send_header("X-Rate-Limit-Limit", str(self.mock.config.rps_limit))
+            self.send_header("X-Rate-Limit-Interval", "1s")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        mock = self.mock
+        config = mock.config
+        if config.latency or config.jitter:
+            sleep(config.latency + random.random() * config.jitter)
+        if not mock.admit():
+            return self._send(429, {"error": "rate limited"}, [("Retry-After", "1")])
+        if config.error_rate and random.random() < config.error_rate:
+            return self._send(500, {"error": "injected failure"})
+
+        parts = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        path = unquote(parts.path)
+        if path.startswith(CHEMRXIV_PATH + "items"):
+            return self._send(200, mock.items_page(query))
+        m = re.match(r"^/journals/([^/]+)/works$", path)
+        if m:
+            return self._send(200, mock.works_page(m.group(1), query))
+        if path == "/works":
+            dois = re.findall(r"doi:([^,]+)", query.get("filter", ""))
+            found = [crossref_work(d, config) for d in dois]
+            found = [f for f in found if f]
+            return self._send(200, {"status": "ok", "message": {
+                "total-results": len(found), "items": found}})
+        if path.startswith("/plumx/"):
+            body = plumx_body(path[len("/plumx/"):], config)
+            return self._send(200 if body else 404, body or {"error": "not found"})
+        if path == "/scopus":
+            dois = re.findall(r"DOI\(([^)]*)\)", query.get("query", ""))
+            found = [scopus_result(d, config) for d in dois]
+            return self._send(200, {"results": [f for f in found if f]})
+        self._send(404, {"error": "unknown path"})
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # the default of 5 drops bursts of connections
+
+
+class MockAPI:
+    """A running mock server; use as a context manager or call stop()."""
+
+    def __init__(self, config=None, port=0):
+        self.config = config or MockConfig()
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._window = (0, 0)  # (second, count)
+        handler = type("Handler", (_Handler,), {"mock": self})
+        self.server = _Server(("127.0.0.1", port), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return "http://" + host + ":" + str(port)
+
+    def admit(self):
+        # simple fixed one second window
+        with self._lock:
+            self.requests += 1
+            if not self.config.rps_limit:
+                return True
+            second = int(monotonic())
+            start, count = self._window
+            if second != start:
+                start, count = second, 0
+            self._window = (start, count + 1)
+            return count < self.config.rps_limit
+
+    def items_page(self, query):
+        limit = int(query.get("limit", 50))
+        skip = int(query.get("skip", 0))
+        hits = [{"item": chemrxiv_item(i, self.config)}
+                for i in range(skip, min(skip + limit, self.config.items))]
+        return {"totalCount": self.config.items, "itemHits": hits}
+
+    def works_page(self, issn, query):
+        years = re.findall(r"from-pub-date:(\d+)", query.get("filter", ""))
+        year = years[0] if years else "2020"
+        rows = int(query.get("rows", 20))
+        cursor = query.get("cursor", "*")
+        start = 0 if cursor == "*" else int(cursor)
+        total = self.config.works_per_journal_year
+        items = [{"DOI": crossref_doi(issn, year, k)}
+                 for k in range(start, min(start + rows, total))]
+        return {"status": "ok", "message": {"total-results": total, "items": items,
+                                            "next-cursor": str(start + rows)}}
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# --- clients shaped like pybliometrics -----------------------------------
+
+Metric = namedtuple("Metric", "name total")
+SearchResult = namedtuple("SearchResult", ["doi"] + FIELDS)
+
+_session = threading.local()
+
+
+def _get(url):
+    if not hasattr(_session, "s"):
+        _session.s = requests.Session()
+    return _session.s.get(url, timeout=30)
+
+
+def plumx_fetch(base_url):
+    """fetch= function for collect_plumx() that talks to the mock."""
+
+    def fetch(doi):
+        response = _get(base_url + "/plumx/" + quote(doi, safe=""))
+        response.raise_for_status()
+        body = response.json()
+        return SimpleNamespace(category_totals=body["category_totals"], **{
+            c: [Metric(m["name"], m["total"]) for m in body[c]] or None
+            for c in ("capture", "citation", "mention", "social_media", "usage")})
+    return fetch
+
+
+def scopus_search(base_url):
+    """search= function for search_metadata() that talks to the mock."""
+
+    def search(query):
+        response = _get(base_url + "/scopus?query=" + quote(query, safe=""))
+        response.raise_for_status()
+        return [SearchResult(**r) for r in response.json()["results"]]
+    return search
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--works", type=int, default=500, help="works per journal and year")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rps-limit", type=int, default=None)
+    args = parser.parse_args()
+    config = MockConfig(items=args.items, works_per_journal_year=args.works,
+                        latency=args.latency, jitter=args.jitter,
+                        error_rate=args.error_rate, rps_limit=args.rps_limit)
+    api = MockAPI(config, args.port)
+    print("mock APIs on " + api.url + " (Ctrl-C to stop)", flush=True)
+    try:
+        api.thread.join()
+    except KeyboardInterrupt:
+        api.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+"""
+Run the collection as named stages and only redo the ones that changed.
+
+The notebook is a chain of cells (harvest -> vor DOIs -> PlumX ->
+ScopusSearch -> dedupe -> merge -> save, and the same again for the
+comparison cohort) that has to be re-run by hand after any change. Here
+each step is a stage with declared inputs (other stages), keyword params,
+files it reads, modules whose code it runs and files it writes:
+
+    p = Pipeline(".pipeline_cache")
+    p.add("records", load_records, files=["chemrxiv_data-ALL.tsv"])
+    p.add("vor", vor_only, inputs=["records"], params={"column": "vorDoi"},
+          code=["doi_index"])
+    p.run()
+
+A stage's key is a hash of its function's source, the source of its
+`code` modules, its params, its `tag`, the contents of its files and the
+hashes of its inputs' outputs. Outputs are pickled into `cache_dir` and
+manifest.json records the key each one was made with, so a stage whose
+key has not changed and whose `outputs` files all still exist is skipped
+and its saved output reused. Because the key uses what the inputs
+produced rather than their keys, a fix upstream that does not change its
+output does not rerun anything downstream.
+
+A stage that reads from the network has no inputs to tell it the data
+changed; give it a `tag` (the collection date) so a new collection
+fetches again, or run with force=[name].
+
+Stages run in a thread pool as soon as their inputs are ready, so
+independent branches (the ChemRxiv chain and the Crossref chain) run side
+by side.
+
+Only the stage function's own source and its declared `code` modules are
+hashed, not everything they import in turn; list each module whose
+changes should rerun the stage.
+"""
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import pickle
+import threading
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from time import monotonic
+
+import pandas as pd
+
+import instrumentation
+
+Stage = namedtuple("Stage", "name func inputs params files code outputs tag")
+
+
+def _digest(*parts):
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def code_hash(func, modules=()):
+    """Hash of a function's source (its qualified name if there is no source)
+    and of the source files of `modules`, given by import name."""
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = getattr(func, "__qualname__", repr(func))
+    return _digest(source, *(module_hash(m) for m in modules))
+
+
+def module_hash(name):
+    spec = importlib.util.find_spec(name)
+    if spec is None or not spec.has_location:
+        raise ValueError("no source file for module " + repr(name))
+    return file_hash(spec.origin)
+
+
+def file_hash(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class Pipeline:
+    """Named stages with content-hash caching of their outputs."""
+
+    def __init__(self, cache_dir=".pipeline_cache", workers=4):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.stages = {}
+        self.status = {}  # stage -> "ran" / "cached", from the last run()
+        self._values = {}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._manifest_path = os.path.join(cache_dir, "manifest.json")
+        self._manifest = self._load_manifest()
+
+    def add(self, name, func, inputs=(), params=None, files=(), code=(), outputs=(),
+            tag=None):
+        """Register func(*<outputs of inputs>, **params) as stage `name`.
+
+        `code` lists modules func relies on, `outputs` files it writes
+        (rerun when one is missing) and `tag` is a value that only goes
+        into the key.
+        """
+        if name in self.stages:
+            raise ValueError("stage " + repr(name) + " is already defined")
+        self.stages[name] = Stage(name, func, tuple(inputs), dict(params or {}), tuple(files),
+                                  tuple(code), tuple(outputs), tag)
+        return name
+
+    # --- bookkeeping ------------------------------------------------------
+
+    def _load_manifest(self):
+        if not os.path.exists(self._manifest_path):
+            return {}
+        with open(self._manifest_path) as f:
+            return json.load(f)
+
+    def _save_manifest(self):
+        # write then rename so a crash never leaves a half written file
+        tmp = self._manifest_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp, self._manifest_path)
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name + ".pkl")
+
+    def key(self, name, input_hashes):
+        stage = self.stages[name]
+        params = json.dumps(stage.params, sort_keys=True, default=repr)
+        return _digest(name, code_hash(stage.func, stage.code), params, repr(stage.tag),
+                       *input_hashes, *(file_hash(f) for f in stage.files))
+
+    def _order(self, targets):
+        """Stages needed for `targets`, inputs before the stages using them."""
+        order = []
+        state = {}
+
+        def visit(name, path):
+            if name not in self.stages:
+                raise ValueError("unknown stage " + repr(name)
+                                 + (" (input of " + repr(path[-1]) + ")" if path else ""))
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError("stages form a cycle: " + " -> ".join(path + [name]))
+            state[name] = "visiting"
+            for dep in self.stages[name].inputs:
+                visit(dep, path + [name])
+            state[name] = "done"
+            order.append(name)
+
+        for name in targets:
+            visit(name, [])
+        return order
+
+    def value(self, name):
+        """Output of a stage, from this run or loaded from the cache."""
+        with self._lock:
+            if name in self._values:
+                return self._values[name]
+        with open(self._path(name), "rb") as f:
+            out = pickle.load(f)
+        with self._lock:
+            self._values[name] = out
+        return out
+
+    # --- running ----------------------------------------------------------
+
+    def _run_stage(self, name, input_hashes, force):
+        stage = self.stages[name]
+        key = self.key(name, input_hashes)
+        entry = self._manifest.get(name)
+        if (not force and entry is not None and entry["key"] == key
+                and os.path.exists(self._path(name))
+                and all(os.path.exists(f) for f in stage.outputs)):
+            print(name + ": up to date")
+            return entry["output"], "cached"
+
+        args = [self.value(dep) for dep in stage.inputs]
+        start = monotonic()
+        with instrumentation.stage("pipeline." + name):
+            out = stage.func(*args, **stage.params)
+        data = pickle.dumps(out, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp = self._path(name) + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._path(name))
+
+        output = _digest(data)
+        with self._lock:
+            self._values[name] = out
+            self._manifest[name] = {"key": key, "output": output}
+            self._save_manifest()
+        print(name + ": ran in " + str(round(monotonic() - start, 1)) + " s")
+        return output, "ran"
+
+    def run(self, targets=None, force=()):
+        """Run whatever is out of date for `targets` (default: every stage).
+
+        `force` lists stages to rerun regardless (True for all of them).
+        Returns {target: output}.
+        """
+        targets = list(self.stages) if targets is None else list(targets)
+        order = self._order(targets)
+        force = set(order) if force is True else set(force)
+        waiting = {name: set(self.stages[name].inputs) for name in order}
+        hashes = {}
+        self.status = {}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            running = {}
+
+            def submit_ready():
+                for name in [n for n, deps in waiting.items() if not deps]:
+                    del waiting[name]
+                    inputs = [hashes[dep] for dep in self.stages[name].inputs]
+                    running[pool.submit(self._run_stage, name, inputs, name in force)] = name
+
+            submit_ready()
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    hashes[name], self.status[name] = future.result()
+                    for deps in waiting.values():
+                        deps.discard(name)
+                submit_ready()
+
+        return {name: self.value(name) for name in targets}
+
+
+# --- the notebook's collection as a pipeline ------------------------------
+
+# the metadata stages of both cohorts share a journal and run at the same
+# time, so they must append through the same Journal object
+_journals = {}
+_journals_lock = threading.Lock()
+
+
+def _journal(path):
+    from doi_journal import Journal
+    with _journals_lock:
+        if path not in _journals:
+            _journals[path] = Journal(path)
+        return _journals[path]
+
+
+def _harvest(workers, min_interval):
+    from chemrxiv_harvest import harvest_pages, records_frame
+    return records_frame(harvest_pages(workers=workers, min_interval=min_interval))
+
+
+def _vor_dois(records):
+    from doi_index import DoiIndex
+    vor = records.loc[~records["vorDoi"].astype(str).str.contains("None")]
+    return DoiIndex().add_all(vor["vorDoi"], "chemrxiv_vor")
+
+
+def _compare_dois(issns, years, n, mode, seed, email):
+    from doi_index import DoiIndex
+    from doi_sampler import sample_crossref
+    sample = sample_crossref(issns, years, n=n, mode=mode, seed=seed, email=email)
+    return DoiIndex().add_all(sample, "comparison")
+
+
+def _plumx(*cohorts, workers, rate, journal):
+    # one fetch for the DOIs of all cohorts: a DOI in two of them is fetched
+    # once, and a fixed `rate` is one token bucket rather than one per cohort
+    from plumx_collect import collect_plumx
+    dois = list(dict.fromkeys(doi for cohort in cohorts for doi in cohort))
+    return collect_plumx(dois, workers=workers, rate=rate, journal=_journal(journal)).frame()
+
+
+def _metadata(dois, journal, crossref=False, email=None, scopus=True):
+    if crossref:
+        from crossref_metadata import enrich_metadata
+        return enrich_metadata(dois, email, scopus=scopus,
+                               journal=_journal(journal) if scopus else None)
+    from scopus_metadata import search_metadata
+    return search_metadata(dois, journal=_journal(journal))
+
+
+def _merge(metadata, plum, vor_dois=None):
+    # same as the notebook: drop DOIs seen twice, then an inner merge
+    metadata = metadata.drop_duplicates("doi", keep=False)
+    plum = plum.drop_duplicates("doi", keep=False)
+    merged = pd.merge(metadata, plum, on="doi")
+    if vor_dois is not None:
+        from doi_index import DoiIndex
+        index = DoiIndex()
+        index.add_all(vor_dois, "chemrxiv_vor")
+        index.flag(merged, "chemrxiv_vor", "is_chemrxiv_vor")
+    return merged
+
+
+def _age_match(chem, comp, k, caliper_days, by="publicationName", date="coverDate"):
+    from age_match import match_controls
+    return match_controls(chem, comp, k, caliper_days, by=by, date=date)
+
+
+def _table_paths(date_tag, metadata_tag):
+    return ["chemrxiv_data_" + date_tag + "-ALL.tsv",
+            "metadata_AND_PlumX_chemrxiv_data_" + metadata_tag + "-vor_only.tsv",
+            "metadata_AND_PlumX_comparison_data_" + metadata_tag + ".tsv"]
+
+
+def _save(records, vor_merged, compare_merged, pairs, date_tag, metadata_tag):
+    # the merged tables, and the age matched tables the R script reads
+    from age_match import matched_paths, save_matched
+    paths = _table_paths(date_tag, metadata_tag)
+    for path, df in zip(paths, [records, vor_merged, compare_merged]):
+        df.to_csv(path, sep="\t", header=True, index=True)
+    save_matched(vor_merged, compare_merged, pairs, metadata_tag)
+    return sorted(paths + matched_paths(metadata_tag))
+
+
+def collection_pipeline(issns, years, date_tag, email=None, n=5000, mode="uniform",
+                        seed=30, plumx_rate=None, cache_dir=".pipeline_cache",
+                        plumx_journal=None, metadata_journal=None, crossref=True,
+                        scopus=False):
+    """The data_collection_may2023 notebook as a Pipeline.
+
+    The ChemRxiv branch (chemrxiv -> vor.*) and the comparison branch
+    (compare.*) run in parallel up to their DOI lists. PlumX is then
+    fetched once for both (the plumx stage, on the union of their DOIs),
+    and each merge keeps its own cohort's rows. PlumX and
+    ScopusSearch results are journaled per `date_tag` (PlumX_<date_tag>.journal.jsonl,
+    metadata_<date_tag>.journal.jsonl), so a stage that reruns within a
+    collection only fetches DOIs it has not seen, while a new date tag
+    fetches fresh metrics (an elsevier_cache in use decides freshness
+    itself, whatever the journal holds). Request pacing is
+    left to the rate_governor unless `plumx_rate` fixes it for PlumX.
+    The ChemRxiv harvest and the Crossref sample are tagged with
+    `date_tag` too, so they are fetched again for a new collection and
+    reused within one.
+
+    With `crossref` both cohorts also get Crossref's bibliographic
+    columns, fetched in bulk (crossref_* columns, see crossref_metadata).
+    Age matching and the R analysis only need journal and date, so
+    ScopusSearch is not called unless `scopus` is set (for the author,
+    affiliation and open access columns); without it both cohorts are
+    age matched on the Crossref journal names and dates, and with it on
+    Scopus' as in the notebook. Without `crossref` all of the metadata
+    comes from ScopusSearch.
+
+    The save stage writes the notebook's files. Without `scopus` the
+    merged and age matched ones are named with <date_tag>-crossref
+    instead (e.g. OA_REDO_ChemAgeMatch_<date_tag>-crossref.csv), so they
+    never overwrite the notebook's full tables.
+    """
+    if not crossref:
+        scopus = True
+    if plumx_journal is None:
+        plumx_journal = "PlumX_" + date_tag + ".journal.jsonl"
+    if metadata_journal is None:
+        metadata_journal = "metadata_" + date_tag + ".journal.jsonl"
+    from age_match import matched_paths
+    metadata = {"journal": metadata_journal, "crossref": crossref, "email": email,
+                "scopus": scopus}
+    metadata_code = ["scopus_metadata", "crossref_metadata"]
+    p = Pipeline(cache_dir)
+    p.add("chemrxiv", _harvest, params={"workers": 4, "min_interval": None},
+          code=["chemrxiv_harvest"], tag=date_tag)
+    p.add("vor.dois", _vor_dois, ["chemrxiv"], code=["doi_index"])
+    p.add("vor.metadata", _metadata, ["vor.dois"], metadata, code=metadata_code)
+
+    p.add("compare.dois", _compare_dois,
+          params={"issns": list(issns), "years": [str(y) for y in years], "n": n,
+                  "mode": mode, "seed": seed, "email": email},
+          code=["doi_sampler", "crossref_dois", "doi_index"], tag=date_tag)
+    p.add("compare.metadata", _metadata, ["compare.dois"], metadata, code=metadata_code)
+
+    p.add("plumx", _plumx, ["vor.dois", "compare.dois"],
+          {"workers": 4, "rate": plumx_rate, "journal": plumx_journal},
+          code=["plumx_collect"])
+    p.add("vor.merged", _merge, ["vor.metadata", "plumx"], code=["doi_index"])
+    p.add("compare.merged", _merge, ["compare.metadata", "plumx", "vor.dois"],
+          code=["doi_index"])
+
+    match = {"k": 1, "caliper_days": 365}
+    if not scopus:
+        match.update(by="crossref_publicationName", date="crossref_coverDate")
+    p.add("age_match", _age_match, ["vor.merged", "compare.merged"], match,
+          code=["age_match"])
+    # without Scopus the tables lack the author, affiliation and open access
+    # columns, so they must not replace the notebook's full ones
+    metadata_tag = date_tag if scopus else date_tag + "-crossref"
+    p.add("save", _save, ["chemrxiv", "vor.merged", "compare.merged", "age_match"],
+          {"date_tag": date_tag, "metadata_tag": metadata_tag}, code=["age_match"],
+          outputs=_table_paths(date_tag, metadata_tag) + matched_paths(metadata_tag))
+    return p
@@ -0,0 +1,322 @@
+"""
+Collect PlumX metrics for many DOIs without growing a DataFrame per DOI.
+
+The original loops built five small frames per DOI, transposed them and
+pd.concat'ed the result onto the running table, which copies the whole
+table every time. PlumXCollector just appends (row, category, name, total)
+to compact integer arrays and builds the wide table once at the end.
+"""
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+
+import numpy as np
+import pandas as pd
+
+import elsevier_cache
+import instrumentation
+from doi_journal import Journal
+from rate_governor import PLUMX_API, elsevier_quota, governor
+from rate_limit import TokenBucket, backoff_delay, is_transient, status_of
+
+# PlumXMetrics attributes holding lists of (name, total) tuples
+CATEGORIES = ("capture", "citation", "mention", "social_media", "usage")
+
+# notes written in the NOTES column, same text as the original notebook
+NOTES = "NOTES"
+NOTE_NO_TOTALS = "API returned plum.category_totals as None"
+NOTE_ERROR = "exception error: API returned Scopus error"
+
+
+def plumx_record(plum):
+    """Plain, JSON friendly copy of one PlumXMetrics result."""
+    # account for when the API returns no data
+    if plum.category_totals is None:
+        return {"note": NOTE_NO_TOTALS}
+    metrics = []
+    for category in CATEGORIES:
+        for metric in getattr(plum, category) or ():
+            metrics.append([category, metric.name, metric.total])
+    return {"metrics": metrics}
+
+
+def error_record():
+    return {"note": NOTE_ERROR}
+
+
+class PlumXCollector:
+    """Accumulate PlumX results in long format and pivot them on demand.
+
+    Each add*() call makes one output row (its row number is the DOI id),
+    so a DOI added twice shows up twice, just like the concat loop it
+    replaces. Metrics are kept as four parallel arrays: row, category
+    code, metric name code and an integer total; the category and name
+    dictionaries are `categories` and `names`. Notes (no data, errors) are
+    kept per row in `notes`.
+
+    frame() gives the wide table the notebook saves, category_frame() the
+    same for one category, sparse_frame() a sparse wide table and
+    metric_totals() per-metric counts and sums straight from the arrays.
+    """
+
+    def __init__(self):
+        self.dois = []
+        self.categories = list(CATEGORIES)
+        self.names = []
+        self.notes = {}  # row -> note
+        self.row = array("i")
+        self.category = array("b")
+        self.name = array("i")
+        self.total = array("q")
+        self._category_codes = {c: i for i, c in enumerate(self.categories)}
+        self._name_codes = {}
+
+    def __len__(self):
+        return len(self.dois)
+
+    def _code(self, codes, values, value):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(values)
+            values.append(value)
+        return code
+
+    def add(self, doi, plum):
+        """Add a PlumXMetrics result (or anything with the same attributes)."""
+        self.add_record(doi, plumx_record(plum))
+
+    def add_record(self, doi, record):
+        """Add a result saved by plumx_record() or error_record()."""
+        if "note" in record:
+            self.add_note(doi, record["note"])
+            return
+        # convert every total before appending anything, so a bad one
+        # (raising here) leaves the arrays and dois in step
+        metrics = [(category, name, int(total)) for category, name, total in record["metrics"]]
+        row = len(self.dois)
+        self.dois.append(doi)
+        for category, name, total in metrics:
+            self.row.append(row)
+            self.category.append(self._code(self._category_codes, self.categories, category))
+            self.name.append(self._code(self._name_codes, self.names, name))
+            self.total.append(total)
+
+    def add_note(self, doi, note):
+        row = len(self.dois)
+        self.dois.append(doi)
+        # keeps the NOTES column where it first turned up, as before
+        self._code(self._name_codes, self.names, NOTES)
+        self.notes[row] = note
+
+    def add_error(self, doi):
+        # handle the case when Scopus returns a 404 or some other error
+        self.add_note(doi, NOTE_ERROR)
+
+    def nbytes(self):
+        """Memory held by the metric arrays, in bytes."""
+        return sum(a.itemsize * len(a) for a in (self.row, self.category, self.name, self.total))
+
+    def _raw(self):
+        return tuple(np.frombuffer(a, dtype=dtype) if len(a) else np.empty(0, dtype)
+                     for a, dtype in ((self.row, np.int32), (self.category, np.int8),
+                                      (self.name, np.int32), (self.total, np.int64)))
+
+    def _arrays(self, category=None):
+        row, cat, name, total = self._raw()
+        # a metric name repeated within one result keeps its first value,
+        # the same as the old set_index('name') + concat would show first
+        key = row.astype(np.int64) * max(len(self.names), 1) + name
+        keep = np.zeros(len(row), dtype=bool)
+        keep[np.unique(key, return_index=True)[1]] = True
+        if category is not None:
+            keep &= cat == self._category_codes.get(category, -1)
+        return row[keep], cat[keep], name[keep], total[keep]
+
+    def long_frame(self):
+        """One row per (doi, metric): row, doi, category, name, total.
+
+        Notes are not metrics and are left out; see `notes`.
+        """
+        row, cat, name, total = self._raw()
+        dois = np.asarray(self.dois + [None], dtype=object)
+        return pd.DataFrame({
+            "row": row, "doi": dois[row],
+            "category": pd.Categorical.from_codes(cat, self.categories),
+            "name": pd.Categorical.from_codes(name, self.names),
+            "total": total})
+
+    def frame(self):
+        """Wide table: one row per add*() call, 'doi' first then one column per metric."""
+        with instrumentation.stage("plumx.pivot", len(self.dois)):
+            return self._wide(None)
+
+    def category_frame(self, category):
+        """Wide table of the metrics of one category (e.g. "social_media")."""
+        return self._wide(category)
+
+    def _wide(self, category):
+        row, _, name, total = self._arrays(category)
+        used = np.zeros(len(self.names), dtype=bool)
+        used[name] = True
+        if category is None and self.notes:
+            used[self._name_codes[NOTES]] = True
+        columns = [n for n, u in zip(self.names, used) if u]
+        position = np.cumsum(used) - 1
+
+        # the single pivot: scatter the totals into a dense block
+        values = np.zeros((len(self.dois), len(columns)), dtype=np.int64)
+        present = np.zeros(values.shape, dtype=bool)
+        values[row, position[name]] = total
+        present[row, position[name]] = True
+
+        wide = pd.DataFrame({"doi": self.dois})
+        for j, column in enumerate(columns):
+            if column == NOTES and category is None and self.notes:
+                notes = pd.Series(self.notes, dtype=object)
+                wide[column] = notes.reindex(range(len(self.dois))).to_numpy()
+            else:
+                wide[column] = pd.arrays.IntegerArray(values[:, j], ~present[:, j])
+        return wide
+
+    def sparse_frame(self):
+        """Wide table with sparse integer columns (absent metric = 0), indexed by doi."""
+        from scipy import sparse
+        row, _, name, total = self._arrays()
+        matrix = sparse.coo_matrix((total, (row, name)), shape=(len(self.dois), len(self.names)))
+        wide = pd.DataFrame.sparse.from_spmatrix(matrix.tocsc(), columns=self.names)
+        wide.index = pd.Index(self.dois, name="doi")
+        return wide.drop(columns=[NOTES], errors="ignore")
+
+    def metric_totals(self):
+        """Per metric: its category, how many rows report it, their sum and mean."""
+        row, cat, name, total = self._arrays()
+        n = np.bincount(name, minlength=len(self.names))
+        sums = np.bincount(name, weights=total, minlength=len(self.names))
+        category = np.full(len(self.names), -1, dtype=np.int8)
+        category[name] = cat
+        out = pd.DataFrame({"category": pd.Categorical.from_codes(category, self.categories),
+                            "n": n, "sum": sums.astype(np.int64)},
+                           index=pd.Index(self.names, name="name"))
+        out["mean"] = out["sum"] / out["n"].where(out["n"] > 0)
+        return out.drop(index=[NOTES], errors="ignore")
+
+
+def cohort_totals(collectors):
+    """metric_totals() of several collectors side by side, e.g.
+    cohort_totals({"vor": plum_collector, "comparison": plum_collector_compare})."""
+    return pd.concat({cohort: c.metric_totals() for cohort, c in collectors.items()},
+                     names=["cohort"])
+
+
+def _plumx_metrics(doi):
+    # imported here so the rest of this module works without pybliometrics
+    from pybliometrics.scopus import PlumXMetrics
+    return PlumXMetrics(doi, id_type='doi', refresh=True)
+
+
+def fetch_plumx(dois, workers=4, rate=None, burst=1, retries=5, fetch=None,
+                on_result=None, progress=True):
+    """Fetch PlumX metrics for many DOIs concurrently.
+
+    All `workers` share the PlumX rate_governor, which speeds up while
+    requests succeed, backs off on 429s and pauses if the key's quota
+    runs out. A `rate` (requests per second) instead puts them on
+    one fixed token bucket. Rate limited (429), server (5xx) and network
+    errors are retried with jittered exponential backoff. Returns a list of
+    (doi, result) in input order, where result is the PlumXMetrics object
+    or the exception that stopped it. `on_result(doi, result)` is called
+    from the worker thread as soon as each DOI finishes.
+    """
+    if fetch is None:
+        fetch = _plumx_metrics
+    if rate is None:
+        limiter = governor.for_host(PLUMX_API)
+    else:
+        limiter = TokenBucket(rate, burst)
+    done = getattr(limiter, "done", None)
+    metrics = instrumentation.metrics
+    tracker = instrumentation.Progress(len(dois), "PlumX", enabled=progress)
+
+    def attempt_all(doi):
+        for attempt in range(retries + 1):
+            metrics.slept("plumx", limiter.wait())
+            try:
+                with instrumentation.timed("plumx"):
+                    result = fetch(doi)
+            except Exception as e:
+                if done is not None:
+                    done(status_of(e))
+                if attempt == retries or not is_transient(e):
+                    return e
+                metrics.retry("plumx")
+                delay = backoff_delay(attempt)
+                sleep(delay)
+                metrics.slept("plumx", delay)
+            else:
+                if done is not None:
+                    done(200, elsevier_quota(result))
+                return result
+
+    def one(doi):
+        result = attempt_all(doi)
+        if on_result is not None:
+            on_result(doi, result)
+        tracker.update()
+        return doi, result
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(one, dois))
+
+
+def collect_plumx(dois, workers=4, rate=None, burst=1, retries=5, fetch=None,
+                  collector=None, journal=None):
+    """fetch_plumx() straight into a PlumXCollector (new one by default).
+
+    With `journal` (a Journal or a path to one) every DOI is saved as soon
+    as it finishes, DOIs already in the journal are not fetched again, and
+    the table is built from the journal. Errors that may go away on their
+    own (rate limits, 5xx, network) are left out of the journal so the next
+    run tries them again.
+
+    If an elsevier_cache is in use it decides what is fetched: DOIs with a
+    fresh cached result are taken from it, all others are fetched again
+    even if the journal has them (the journal is then only the crash log
+    of the run), and everything fetched is added to it.
+    """
+    if isinstance(journal, str):
+        # opened here, so closed here too
+        with Journal(journal) as opened:
+            return collect_plumx(dois, workers, rate, burst, retries, fetch, collector, opened)
+    if collector is None:
+        collector = PlumXCollector()
+    cache = elsevier_cache.current_cache()
+
+    todo = list(dict.fromkeys(dois))
+    records = {}
+    if cache is not None:
+        # freshness first: a journaled DOI whose cached result is stale is fetched again
+        records = cache.get_many("plumx", todo)
+        todo = [doi for doi in todo if doi not in records]
+    elif journal is not None:
+        todo = journal.missing(todo)
+
+    def save(doi, result):
+        if not isinstance(result, Exception):
+            record = plumx_record(result)
+        elif not is_transient(result):
+            record = error_record()
+        else:
+            return
+        records[doi] = record
+        if journal is not None:
+            journal.append(doi, record)
+        if cache is not None:
+            cache.put("plumx", doi, record)
+
+    fetch_plumx(todo, workers, rate, burst, retries, fetch, on_result=save)
+    for doi in dois:
+        record = records.get(doi)
+        if record is None and journal is not None and cache is None:
+            record = journal.get(doi)
+        collector.add_record(doi, record or error_record())
+    return collector
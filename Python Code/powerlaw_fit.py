@@ -0,0 +1,311 @@
+"""
+Discrete power-law, log-normal and exponential fits in Python.
+
+This mirrors what process_data() in R Code/OAresearch_Update_2024.07.24.R
+does with poweRlaw's displ / dislnorm / disexp and estimate_xmin(), so the
+merged PlumX tables can be analysed without handing them to R.
+
+Definitions follow poweRlaw (Gillespie 2015):
+  pl   P(x) = x^-alpha / zeta(alpha, xmin)
+  ln   P(x) = [S(x - 0.5) - S(x + 0.5)] / S(xmin - 0.5),  S = lognormal survival
+  exp  P(x) = (1 - e^-rate) e^-rate (x - xmin)
+
+For every candidate xmin (the distinct data values) the parameters are
+fitted by maximum likelihood on x >= xmin, and the xmin with the smallest
+Kolmogorov-Smirnov distance is kept. Rather than refitting from the raw
+data for each candidate, the data are reduced once to sorted distinct
+values with counts, and the tail sums each fit needs (n, sum x, sum log x,
+sum log^2 x) come from reverse cumulative sums. The power-law and
+exponential fits are then done for all candidates at once; the lognormal
+fits use the analytic gradient and start from the neighbouring candidate.
+
+    import pandas as pd
+    from powerlaw_fit import process_data, fit_table
+    chem = pd.read_csv("OA_REDO_ChemAgeMatch_2023.11.02.csv")
+    fit_table(process_data(chem))   # xmin / pars / KS for Scopus1, tweet1, reader1
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from scipy import optimize, special
+
+FAMILIES = ("pl", "ln", "exp")
+
+# same variable names as the R script
+VARIABLES = ("Scopus1", "tweet1", "reader1")
+
+Fit = namedtuple("Fit", "family xmin pars gof ntail")
+Fit.__doc__ = """Result of estimate_xmin(), like poweRlaw's estimate_xmin() list.
+
+pars is (alpha,) for pl, (meanlog, sdlog) for ln and (rate,) for exp;
+gof is the KS distance and ntail the number of observations >= xmin.
+"""
+
+
+def prepare(data):
+    """Non-negative integer observations as a sorted array (NaNs dropped)."""
+    x = pd.to_numeric(pd.Series(np.asarray(data).ravel()), errors="coerce").dropna()
+    x = np.round(x.to_numpy(dtype=float))
+    return np.sort(x[x >= 0])
+
+
+class _Tail:
+    """Distinct values, counts and reverse cumulative sums of a sample."""
+
+    def __init__(self, x):
+        self.values, self.counts = np.unique(x, return_counts=True)
+        self.n_total = len(x)
+        c = self.counts.astype(float)
+        v = self.values
+
+        def rev(a):
+            return np.cumsum(a[::-1])[::-1]
+
+        with np.errstate(divide="ignore"):
+            logv = np.where(v > 0, np.log(v), 0.0)
+        self.n = rev(c)              # observations >= values[i]
+        self.sum_x = rev(c * v)
+        self.sum_log = rev(c * logv)
+        self.sum_log2 = rev(c * logv ** 2)
+
+
+# --- CDFs ----------------------------------------------------------------
+
+def _log_sf_ln(q, meanlog, sdlog):
+    # log S(q) for the lognormal, with S(q) = 1 for q <= 0
+    q = np.asarray(q, dtype=float)
+    out = np.zeros_like(q)
+    pos = q > 0
+    out[pos] = special.log_ndtr((meanlog - np.log(q[pos])) / sdlog)
+    return out
+
+
+def dist_cdf(family, pars, xmin, x):
+    """P(X <= x) of the fitted distribution, for integer x >= xmin."""
+    x = np.asarray(x, dtype=float)
+    if family == "pl":
+        return 1 - special.zeta(pars[0], x + 1) / special.zeta(pars[0], xmin)
+    if family == "ln":
+        return 1 - np.exp(_log_sf_ln(x + 0.5, *pars) - _log_sf_ln(xmin - 0.5, *pars))
+    if family == "exp":
+        return 1 - np.exp(-pars[0] * (x + 1 - xmin))
+    raise ValueError("family must be one of " + ", ".join(FAMILIES))
+
+
+def dist_rand(family, pars, xmin, n, rng):
+    """n random draws (x >= xmin) from a fitted distribution.
+
+    `rng` is a numpy Generator. The power law uses the exact inverse CDF
+    for the first 10,000 values above xmin and the usual continuous
+    approximation beyond that.
+    """
+    u = rng.random(n)
+    if family == "exp":
+        return xmin + np.floor(-np.log1p(-u) / pars[0])
+    if family == "ln":
+        meanlog, sdlog = pars
+        # draw from the lognormal conditioned on y > xmin - 0.5, then round
+        log_s = np.log1p(-u) + _log_sf_ln([xmin - 0.5], meanlog, sdlog)[0]
+        z = -special.ndtri_exp(log_s)
+        return np.maximum(np.floor(np.exp(meanlog + sdlog * z) + 0.5), xmin)
+    if family == "pl":
+        alpha = pars[0]
+        table = xmin + np.arange(10000)
+        cdf = dist_cdf(family, pars, xmin, table)
+        pos = np.searchsorted(cdf, u)
+        out = np.empty(n)
+        inside = pos < len(table)
+        out[inside] = table[pos[inside]]
+        far = (xmin - 0.5) * (1 - u[~inside]) ** (-1 / (alpha - 1)) + 0.5
+        out[~inside] = np.maximum(np.floor(far), table[-1] + 1)
+        return out
+    raise ValueError("family must be one of " + ", ".join(FAMILIES))
+
+
+def _ks(tail, i, family, pars):
+    """KS distance for the tail starting at distinct value i.
+
+    The empirical CDF only moves at data values while the fitted CDF keeps
+    rising, so on the integer grid the largest gap sits either at a data
+    value or just before the next one.
+    """
+    v = tail.values[i:]
+    emp = np.cumsum(tail.counts[i:]) / tail.n[i]
+    before_next = np.append(v[1:] - 1, v[-1])
+    xmin = v[0]
+    d1 = np.abs(emp - dist_cdf(family, pars, xmin, v))
+    d2 = np.abs(emp - dist_cdf(family, pars, xmin, before_next))
+    return float(max(d1.max(), d2.max()))
+
+
+# --- maximum likelihood --------------------------------------------------
+
+def _fit_pl(tail, idx, lower=1.0001, upper=20.0, iterations=80):
+    """alpha for every candidate at once, by golden section search.
+
+    The negative log-likelihood n log zeta(alpha, xmin) + alpha sum(log x)
+    is convex in alpha, so the search cannot get stuck.
+    """
+    xmin = tail.values[idx]
+    n = tail.n[idx]
+    s = tail.sum_log[idx]
+
+    def nll(alpha):
+        return n * np.log(special.zeta(alpha, xmin)) + alpha * s
+
+    a = np.full(len(idx), lower)
+    b = np.full(len(idx), upper)
+    g = (np.sqrt(5) - 1) / 2
+    c = b - g * (b - a)
+    d = a + g * (b - a)
+    fc, fd = nll(c), nll(d)
+    for _ in range(iterations):
+        left = fc < fd
+        b = np.where(left, d, b)
+        a = np.where(left, a, c)
+        d_new = np.where(left, c, a + g * (b - a))
+        c_new = np.where(left, b - g * (b - a), d)
+        fc, fd = (np.where(left, nll(c_new), fd),
+                  np.where(left, fc, nll(d_new)))
+        c, d = c_new, d_new
+    return (a + b) / 2
+
+
+def _fit_exp(tail, idx):
+    """Closed form MLE of the rate for every candidate at once."""
+    xmin = tail.values[idx]
+    excess = tail.sum_x[idx] - tail.n[idx] * xmin
+    with np.errstate(divide="ignore"):
+        return np.log1p(tail.n[idx] / excess)
+
+
+def _ln_terms(q, meanlog, sdlog):
+    # log S(q), log phi(z) and z = (meanlog - log q) / sdlog; S(q) = 1 and
+    # phi = 0 for q <= 0
+    q = np.asarray(q, dtype=float)
+    z = np.zeros_like(q)
+    pos = q > 0
+    z[pos] = (meanlog - np.log(q[pos])) / sdlog
+    log_s = np.where(pos, special.log_ndtr(z), 0.0)
+    log_phi = np.where(pos, -0.5 * z ** 2 - 0.5 * np.log(2 * np.pi), -np.inf)
+    return log_s, log_phi, z
+
+
+def _fit_ln(tail, i, start):
+    """(meanlog, sdlog) for the tail starting at distinct value i."""
+    v = tail.values[i:]
+    c = tail.counts[i:]
+    xmin = v[0]
+
+    def nll(p):
+        # negative log-likelihood and its gradient in (meanlog, log sdlog):
+        # dS(q)/dmeanlog = phi(z) / sdlog and dS(q)/dlog sdlog = -z phi(z)
+        meanlog, sdlog = p[0], np.exp(p[1])
+        upper, phi_u, z_u = _ln_terms(v - 0.5, meanlog, sdlog)
+        lower, phi_l, z_l = _ln_terms(v + 0.5, meanlog, sdlog)
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            logp = upper + np.log1p(-np.exp(lower - upper))
+            ok = np.isfinite(logp)
+            w_u = np.where(ok, np.exp(phi_u - logp), 0.0)
+            w_l = np.where(ok, np.exp(phi_l - logp), 0.0)
+        logp = np.where(ok, logp, -745.0)
+        norm, phi_0, z_0 = _ln_terms([xmin - 0.5], meanlog, sdlog)
+        w_0 = np.exp(phi_0[0] - norm[0])
+        n = tail.n[i]
+        value = -(c * logp).sum() + n * norm[0]
+        grad = [-(c * (w_u - w_l)).sum() / sdlog + n * w_0 / sdlog,
+                (c * (w_u * z_u - w_l * z_l)).sum() - n * w_0 * z_0[0]]
+        return value, np.array(grad)
+
+    # sdlog is fitted on the log scale and, as in poweRlaw, only kept
+    # positive. meanlog is bounded so that power-law like tails, where the
+    # likelihood keeps improving as meanlog -> -inf, stop at -20 instead of
+    # running away (poweRlaw's optimiser gives up somewhere there as well);
+    # fits that end on that edge are the ones to read with care
+    bounds = [(-20.0, np.log(v[-1]) + 20.0), (np.log(np.finfo(float).eps), None)]
+    x0 = [np.clip(start[0], *bounds[0]), np.clip(np.log(start[1]), *bounds[1])]
+    res = optimize.minimize(nll, x0, method="L-BFGS-B", jac=True, bounds=bounds)
+    return float(res.x[0]), float(np.exp(res.x[1]))
+
+
+def _fit_ln_scan(tail, idx):
+    """_fit_ln() for every candidate, each started from its neighbour's fit.
+
+    Neighbouring tails differ by one distinct value, so the previous fit is
+    a much closer start than the moments of log x. The first candidate, and
+    any after a fit that ended on the meanlog bound, start from the moments.
+    """
+    means, sds = _ln_starts(tail, idx)
+    pars = []
+    for i, m, sd in zip(idx, means, sds):
+        if pars and pars[-1][0] > -20.0:
+            start = pars[-1]
+        else:
+            start = (m, sd)
+        pars.append(_fit_ln(tail, i, start))
+    return pars
+
+
+def _ln_starts(tail, idx):
+    # mean and sd of log x over each tail, from the cumulative sums
+    n = tail.n[idx]
+    mean = tail.sum_log[idx] / n
+    var = np.maximum(tail.sum_log2[idx] / n - mean ** 2, 1e-4)
+    return mean, np.sqrt(var)
+
+
+# --- xmin scan -----------------------------------------------------------
+
+def estimate_xmin(data, family, xmins=None):
+    """Fit `family` with the KS-minimising xmin, like poweRlaw's estimate_xmin().
+
+    `xmins` restricts the candidates (default: every distinct value that
+    leaves at least two distinct values in the tail; values >= 1 only for
+    the power law, whose normalising constant is undefined at 0).
+    """
+    tail = _Tail(prepare(data))
+    idx = np.arange(max(len(tail.values) - 1, 0))
+    if family == "pl":
+        idx = idx[tail.values[idx] >= 1]
+    if xmins is not None:
+        idx = idx[np.isin(tail.values[idx], np.asarray(xmins))]
+    if len(idx) == 0:
+        raise ValueError("not enough distinct values to fit a tail")
+
+    if family == "pl":
+        pars = [(a,) for a in _fit_pl(tail, idx)]
+    elif family == "exp":
+        pars = [(r,) for r in _fit_exp(tail, idx)]
+    elif family == "ln":
+        pars = _fit_ln_scan(tail, idx)
+    else:
+        raise ValueError("family must be one of " + ", ".join(FAMILIES))
+
+    gofs = np.array([_ks(tail, i, family, p) for i, p in zip(idx, pars)])
+    best = int(np.nanargmin(gofs))
+    i = idx[best]
+    return Fit(family, float(tail.values[i]), tuple(float(p) for p in pars[best]),
+               float(gofs[best]), int(tail.n[i]))
+
+
+def fit_all(data, families=FAMILIES):
+    """estimate_xmin() for each family: {"pl": Fit, "ln": Fit, "exp": Fit}."""
+    return {family: estimate_xmin(data, family) for family in families}
+
+
+def process_data(df, variables=VARIABLES):
+    """Python version of the R process_data() applied over `variables`."""
+    return {var: fit_all(df[var]) for var in variables}
+
+
+def fit_table(results):
+    """Flatten process_data() output into one row per variable and family."""
+    rows = []
+    for var, fits in results.items():
+        for family, fit in fits.items():
+            rows.append({"variable": var, "family": family, "xmin": fit.xmin,
+                         "par1": fit.pars[0],
+                         "par2": fit.pars[1] if len(fit.pars) > 1 else np.nan,
+                         "gof": fit.gof, "ntail": fit.ntail})
+    return pd.DataFrame(rows)
@@ -0,0 +1,248 @@
+"""
+One adaptive rate governor per API, shared by every call site.
+
+The fixed sleeps (2 s for ChemRxiv, 0.1-1 s for Crossref, 0.25 s for
+Elsevier) waste capacity when a server allows more and do not slow down
+when it pushes back. A HostGovernor instead
+
+  - spaces request starts `interval` seconds apart and allows at most
+    `concurrency` requests in flight;
+  - speeds up additively (rate + `increase` req/s, concurrency + 1) after
+    every `window` successful requests;
+  - halves the rate and the concurrency on a 429 or 503, and waits out
+    a Retry-After;
+  - never goes faster than what the server's headers allow:
+      Crossref   X-Rate-Limit-Limit / X-Rate-Limit-Interval  ("50", "1s")
+      Elsevier   X-RateLimit-Remaining / X-RateLimit-Reset    (nothing more is
+                 sent once the key's quota is used up, until it resets)
+    ChemRxiv sends neither, so DEFAULTS cap it at one request a second.
+
+Governors are keyed by host, except for Elsevier, which throttles and
+counts quota per API: PlumX and ScopusSearch each get their own
+(PLUMX_API and SCOPUS_API), so one running out does not slow the other.
+
+It works as a limiter for get_json(): wait() before the request and
+done(status, headers) after it. Call sites use the shared `governor`
+unless they are given a fixed interval / rate / delay:
+
+    from rate_governor import governor
+    governor.budget()      # current interval, rate, concurrency per host
+"""
+import re
+import threading
+from datetime import datetime
+from time import monotonic, sleep, time
+from urllib.parse import urlsplit
+
+import pandas as pd
+
+PLUMX_API = "api.elsevier.com/plumx"
+SCOPUS_API = "api.elsevier.com/scopus"
+
+# starting point and bounds per API; the starting intervals are the old fixed
+# sleeps. ChemRxiv sends no rate-limit headers, so it is held to at most one
+# request a second and two in flight however well it answers.
+DEFAULTS = {
+    "chemrxiv.org": {"interval": 2.0, "concurrency": 1, "min_interval": 1.0,
+                     "max_concurrency": 2},
+    "api.crossref.org": {"interval": 1.0, "concurrency": 1, "min_interval": 0.02},
+    PLUMX_API: {"interval": 0.25, "concurrency": 4, "min_interval": 1 / 9},
+    SCOPUS_API: {"interval": 0.25, "concurrency": 4, "min_interval": 1 / 9},
+}
+
+THROTTLED = (429, 503)
+
+
+def _header(headers, name):
+    # requests' headers are case-insensitive, a plain dict may not be
+    value = headers.get(name)
+    if value is None:
+        for key, v in headers.items():
+            if key.lower() == name.lower():
+                return v
+    return value
+
+
+def _seconds(text):
+    # Crossref intervals look like "1s"; also accept "500ms" and "2m"
+    m = re.fullmatch(r"\s*([\d.]+)\s*(ms|s|m|h)?\s*", str(text))
+    if not m:
+        return None
+    value = float(m.group(1))
+    return value * {"ms": 0.001, "s": 1, "m": 60, "h": 3600, None: 1}[m.group(2)]
+
+
+class HostGovernor:
+    """AIMD spacing and concurrency for one host. Thread-safe."""
+
+    def __init__(self, host, interval=0.5, concurrency=4, min_interval=0.0,
+                 max_interval=60.0, max_concurrency=16, increase=0.1, decrease=0.5,
+                 window=10):
+        self.host = host
+        self.interval = interval
+        self.concurrency = concurrency
+        self.min_interval = min_interval      # our own floor
+        self.max_interval = max_interval
+        self.max_concurrency = max_concurrency
+        self.increase = increase              # req/s added per window of successes
+        self.decrease = decrease              # factor applied on throttling
+        self.window = window
+        self.ceiling = None                   # min interval the server's headers allow
+        self.remaining = None                 # quota left (Elsevier)
+        self.reset = None                     # when the quota resets, epoch seconds
+        self.in_flight = 0
+        self.requests = 0
+        self.throttled = 0
+        self._ok = 0
+        self._next = 0.0
+        self._cond = threading.Condition()
+
+    def _floor(self):
+        # the quota is not spread over the time to its reset: Elsevier's resets
+        # weekly, so that would pace a run for days; running out pauses instead
+        floor = self.min_interval
+        if self.ceiling is not None:
+            floor = max(floor, self.ceiling)
+        return floor
+
+    def wait(self):
+        """Block for a free slot; returns the seconds spent waiting."""
+        start = monotonic()
+        with self._cond:
+            while self.in_flight >= self.concurrency:
+                self._cond.wait()
+            self.in_flight += 1
+            self.requests += 1
+            now = monotonic()
+            slot = max(now, self._next)
+            self._next = slot + max(self.interval, self._floor())
+        if slot > now:
+            sleep(slot - now)
+        return monotonic() - start
+
+    def done(self, status=None, headers=None):
+        """Report how the request went; status None means no answer (network error)."""
+        with self._cond:
+            self.in_flight = max(self.in_flight - 1, 0)
+            if headers:
+                self._read_headers(headers)
+            if status in THROTTLED:
+                self._throttle(headers)
+            elif status is not None and status < 400:
+                self._ok += 1
+                if self._ok >= self.window:
+                    self._ok = 0
+                    self._speed_up()
+            self._cond.notify_all()
+
+    def _speed_up(self):
+        floor = self._floor()
+        if self.interval > 0:
+            rate = 1 / self.interval + self.increase
+            self.interval = max(1 / rate, floor)
+        self.concurrency = min(self.concurrency + 1, self.max_concurrency)
+
+    def _throttle(self, headers):
+        self.throttled += 1
+        self._ok = 0
+        self.interval = min(max(self.interval, self._floor(), 0.01) / self.decrease,
+                            self.max_interval)
+        self.concurrency = max(int(self.concurrency * self.decrease), 1)
+        retry_after = _seconds(_header(headers, "Retry-After")) if headers else None
+        if retry_after:
+            self._next = max(self._next, monotonic() + retry_after)
+
+    def _read_headers(self, headers):
+        limit = _header(headers, "X-Rate-Limit-Limit")
+        interval = _header(headers, "X-Rate-Limit-Interval")
+        if limit and interval:
+            seconds = _seconds(interval)
+            if seconds and float(limit) > 0:
+                self.ceiling = seconds / float(limit)
+                self.interval = max(self.interval, self.ceiling)
+        concurrency = _header(headers, "X-Concurrency-Limit")
+        if concurrency and str(concurrency).isdigit():
+            self.max_concurrency = int(concurrency)
+            self.concurrency = min(self.concurrency, self.max_concurrency)
+
+        remaining = _header(headers, "X-RateLimit-Remaining")
+        reset = _header(headers, "X-RateLimit-Reset")
+        if remaining is not None and str(remaining).isdigit():
+            self.remaining = int(remaining)
+        if reset is not None:
+            try:
+                self.reset = float(reset)
+            except ValueError:
+                pass
+        if self.remaining == 0 and self.reset is not None:
+            # out of quota: nothing more until it resets
+            self._next = max(self._next, monotonic() + max(self.reset - time(), 0))
+
+    def budget(self):
+        """Current state: spacing, rate, concurrency and what the server told us."""
+        with self._cond:
+            interval = max(self.interval, self._floor())
+            return {"host": self.host, "interval": interval,
+                    "rate": 1 / interval if interval else float("inf"),
+                    "concurrency": self.concurrency, "in_flight": self.in_flight,
+                    "ceiling_rate": 1 / self.ceiling if self.ceiling else None,
+                    "remaining": self.remaining,
+                    "reset": (datetime.fromtimestamp(self.reset).isoformat(timespec="seconds")
+                              if self.reset else None),
+                    "requests": self.requests, "throttled": self.throttled}
+
+
+class RateGovernor:
+    """A HostGovernor per host (or per API, e.g. PLUMX_API), created on first use from DEFAULTS."""
+
+    def __init__(self, defaults=None):
+        self.defaults = DEFAULTS if defaults is None else defaults
+        self.hosts = {}
+        self._lock = threading.Lock()
+
+    def for_host(self, host):
+        """The governor for a host name or one of the per-API keys."""
+        host = host.lower()
+        with self._lock:
+            if host not in self.hosts:
+                self.hosts[host] = HostGovernor(host, **self.defaults.get(host, {}))
+            return self.hosts[host]
+
+    def for_url(self, url):
+        return self.for_host(urlsplit(url).netloc)
+
+    def budget(self):
+        """One row per host with its current budget."""
+        with self._lock:
+            hosts = list(self.hosts.values())
+        rows = [h.budget() for h in hosts]
+        return pd.DataFrame(rows).set_index("host") if rows else pd.DataFrame()
+
+    def reset(self):
+        with self._lock:
+            self.hosts = {}
+
+
+governor = RateGovernor()
+
+
+def elsevier_quota(result):
+    """Quota headers recovered from a pybliometrics object, if it has them.
+
+    pybliometrics does not hand out the response headers, but its
+    retrieval classes can report the key's remaining quota and reset time.
+    """
+    headers = {}
+    try:
+        remaining = result.get_key_remaining_quota()
+    except Exception:
+        return headers
+    if remaining is not None and str(remaining).isdigit():
+        headers["X-RateLimit-Remaining"] = str(remaining)
+    try:
+        reset = result.get_key_reset_time()
+        headers["X-RateLimit-Reset"] = str(
+            datetime.strptime(str(reset), "%Y-%m-%d %H:%M:%S").timestamp())
+    except Exception:
+        pass
+    return headers
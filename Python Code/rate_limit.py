@@ -0,0 +1,102 @@
+"""
+Politeness helpers shared by the API collection code.
+
+The original notebook slept a fixed amount after every call. When several
+worker threads are fetching at once, the delay has to be shared between
+them instead, otherwise 4 workers would hit the API 4x as often.
+"""
+import random
+import threading
+from time import monotonic, sleep
+
+
+class PoliteLimiter:
+    """Space out request starts across all threads using this limiter.
+
+    No two calls to `wait()` return closer together than `min_interval`
+    seconds, no matter how many threads are waiting.
+    """
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        # reserve the next free slot, then sleep outside the lock
+        with self._lock:
+            now = monotonic()
+            start = max(now, self._next)
+            self._next = start + self.min_interval
+        delay = start - now
+        if delay > 0:
+            sleep(delay)
+        return delay
+
+
+class TokenBucket:
+    """Token bucket allowing `rate` calls per second on average.
+
+    Up to `burst` calls can go out back to back after an idle period. Safe
+    to share between threads; `wait()` blocks until a token is available.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = float(burst)
+        self._last = monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            sleep(delay)
+            waited += delay
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """Exponential backoff with full jitter for retry number `attempt` (0 based)."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def status_of(exc):
+    """HTTP status behind an exception, or None if there was no answer.
+
+    Works with pybliometrics' Scopus429Error / Scopus5xxError classes and
+    with anything carrying a requests style `response.status_code`.
+    """
+    status = getattr(getattr(exc, "response", None), "status_code", None)
+    if status is None:
+        name = type(exc).__name__
+        if name.startswith("Scopus") and name.endswith("Error"):
+            code = name[len("Scopus"):-len("Error")]
+            if code.isdigit():
+                status = int(code)
+    return status
+
+
+def is_retryable(exc):
+    """True for rate limiting (429) and server side (5xx) errors."""
+    status = status_of(exc)
+    return status is not None and (status == 429 or 500 <= status < 600)
+
+
+def is_transient(exc):
+    """Errors worth trying again later: is_retryable() ones plus network failures.
+
+    requests' ConnectionError and Timeout are OSError subclasses. So is its
+    HTTPError, so an error that came with an HTTP answer (a 404, say) is
+    judged on the status code alone.
+    """
+    if getattr(getattr(exc, "response", None), "status_code", None) is not None:
+        return is_retryable(exc)
+    return is_retryable(exc) or isinstance(exc, OSError)
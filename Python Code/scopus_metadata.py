@@ -0,0 +1,257 @@
+"""
+Look up Scopus metadata for many DOIs with as few ScopusSearch calls as possible.
+
+The original loops ran one ScopusSearch('DOI(x)') per DOI and pulled each of
+19 fields out of a one-row DataFrame. search_metadata() packs many DOIs into
+one 'DOI(a) OR DOI(b) OR ...' query, puts every result into one table and
+maps the rows back onto the input DOIs, including the ones Scopus does not
+know about.
+"""
+from time import sleep
+
+import pandas as pd
+
+import elsevier_cache
+import instrumentation
+from doi_journal import Journal
+from rate_governor import SCOPUS_API, governor
+from rate_limit import backoff_delay, is_transient, status_of
+
+# fields kept from ScopusSearch.results, in the order of the saved TSVs
+FIELDS = ["author_names", "author_ids", "author_afids", "afid", "affilname",
+          "affiliation_city", "affiliation_country", "author_count", "title",
+          "coverDate", "publicationName", "issn", "volume", "issueIdentifier",
+          "article_number", "pageRange", "openaccess", "freetoread",
+          "freetoreadLabel"]
+COLUMNS = ["doi"] + FIELDS
+
+NOT_FOUND = "Not able to get metadata, DOI not found in ScopusSearch"
+# a lookup that failed with a server or network error; not saved, so tried again next run
+FETCH_ERROR = "Not able to get metadata, ScopusSearch request failed"
+
+# status of a query Scopus cannot parse (pybliometrics' Scopus400Error)
+QUERY_REJECTED = 400
+
+
+def doi_query(dois):
+    return " OR ".join("DOI(" + doi + ")" for doi in dois)
+
+
+def doi_batches(dois, max_dois=100, max_length=3000):
+    """Split DOIs into groups whose OR query stays under both limits."""
+    batch = []
+    length = 0
+    for doi in dois:
+        extra = len(doi) + len("DOI()") + (len(" OR ") if batch else 0)
+        if batch and (len(batch) >= max_dois or length + extra > max_length):
+            yield batch
+            batch = []
+            length = 0
+            extra = len(doi) + len("DOI()")
+        batch.append(doi)
+        length += extra
+    if batch:
+        yield batch
+
+
+def _scopus_search(query):
+    # imported here so the rest of this module works without pybliometrics
+    from pybliometrics.scopus import ScopusSearch
+    return ScopusSearch(query, download=True).results or []
+
+
+def _as_dict(result):
+    # ScopusSearch results are namedtuples
+    return result._asdict() if hasattr(result, "_asdict") else dict(result)
+
+
+def search_results(dois, max_dois=100, max_length=3000, delay=None, search=None,
+                   journal=None, progress=True, retries=3):
+    """Run the batched queries and return all raw results as one DataFrame.
+
+    If Scopus rejects a batch's query (HTTP 400, e.g. a DOI with characters
+    the query parser does not like) its DOIs are retried one at a time so
+    one bad DOI does not lose the whole batch; a DOI whose own query is
+    rejected is recorded as not found. Rate limited (429), server (5xx)
+    and network errors are retried `retries` times with backoff. Server and
+    network errors that persist leave the batch unsaved for the next run;
+    a persistent 429 and any other error (401/403 for a bad key or an
+    exhausted quota, say) are raised, so they are never saved as "not found".
+
+    Queries are paced by the ScopusSearch rate_governor;
+    a `delay` instead sleeps that many seconds after every query.
+
+    With `journal` (a Journal or a path to one) the result for each DOI,
+    or None when Scopus has nothing, is saved as soon as its batch comes
+    back. DOIs already in the journal are skipped and the returned table is
+    built from the journal. DOIs whose lookup failed with a network, rate
+    limit or server error are not saved, so the next run tries them again.
+
+    If an elsevier_cache is in use it decides what is queried: DOIs with a
+    fresh cached result are not, all others are queried again even if the
+    journal has them (the journal is then only the crash log of the run),
+    and every result (or None) that comes back is added to it.
+    """
+    return _search_results(dois, max_dois, max_length, delay, search, journal, progress,
+                           retries)[0]
+
+
+def _search_results(dois, max_dois, max_length, delay, search, journal, progress, retries):
+    # search_results(), and the DOIs whose lookup failed
+    if isinstance(journal, str):
+        # opened here, so closed here too
+        with Journal(journal) as opened:
+            return _search_results(dois, max_dois, max_length, delay, search, opened,
+                                   progress, retries)
+    if search is None:
+        search = _scopus_search
+    cache = elsevier_cache.current_cache()
+    todo = list(dict.fromkeys(dois))
+
+    results = []
+    failed = []
+    if cache is not None:
+        # freshness first: a journaled DOI whose cached result is stale is queried again
+        cached = cache.get_many("scopus", todo)
+        for doi, result in cached.items():
+            if result is not None:
+                results.append(result)
+            if journal is not None and (doi not in journal or journal[doi] != result):
+                journal.append(doi, result)
+        todo = [doi for doi in todo if doi not in cached]
+    elif journal is not None:
+        todo = journal.missing(todo)
+    metrics = instrumentation.metrics
+    tracker = instrumentation.Progress(len(todo), "ScopusSearch DOIs", enabled=progress)
+
+    limiter = governor.for_host(SCOPUS_API) if delay is None else None
+
+    def query(batch):
+        if limiter is None:
+            with instrumentation.timed("scopus"):
+                return [_as_dict(r) for r in search(doi_query(batch))]
+        metrics.slept("scopus", limiter.wait())
+        try:
+            with instrumentation.timed("scopus"):
+                found = [_as_dict(r) for r in search(doi_query(batch))]
+        except Exception as e:
+            limiter.done(status_of(e))
+            raise
+        limiter.done(200)
+        return found
+
+    def attempt(batch):
+        # query() with retries; None if a server or network error persists
+        for n in range(retries + 1):
+            try:
+                return query(batch)
+            except Exception as e:
+                if not is_transient(e):
+                    raise
+                if n == retries:
+                    if status_of(e) == 429:
+                        raise
+                    return None
+                metrics.retry("scopus")
+                wait = backoff_delay(n)
+                sleep(wait)
+                metrics.slept("scopus", wait)
+
+    def pause():
+        # delay between api calls to be nice to Elsevier
+        if delay:
+            sleep(delay)
+            metrics.slept("scopus", delay)
+
+    def save(batch, found):
+        results.extend(found)
+        if journal is None and cache is None:
+            return
+        by_doi = {}
+        for result in found:
+            if result.get("doi"):
+                by_doi.setdefault(result["doi"].lower(), result)
+        for doi in batch:
+            if journal is not None:
+                journal.append(doi, by_doi.get(doi.lower()))
+            if cache is not None:
+                cache.put("scopus", doi, by_doi.get(doi.lower()))
+
+    for batch in doi_batches(todo, max_dois, max_length):
+        try:
+            found = attempt(batch)
+        except Exception as e:
+            if status_of(e) != QUERY_REJECTED:
+                raise
+            for doi in batch:
+                metrics.retry("scopus")
+                try:
+                    found = attempt([doi])
+                except Exception as e:
+                    if status_of(e) != QUERY_REJECTED:
+                        raise
+                    # a DOI the query parser rejects will never be found
+                    found = []
+                if found is not None:
+                    save([doi], found)
+                else:
+                    failed.append(doi)
+                pause()
+        else:
+            if found is not None:
+                save(batch, found)
+            else:
+                failed.extend(batch)
+        pause()
+        tracker.update(len(batch))
+
+    if journal is not None and cache is None:
+        results = [journal[doi] for doi in dict.fromkeys(dois)
+                   if doi in journal and journal[doi] is not None]
+    return pd.DataFrame(results), failed
+
+
+def metadata_frame(dois, results, failed=()):
+    """Line up ScopusSearch results with the input DOIs.
+
+    One output row per input DOI, in input order. DOIs are matched case
+    insensitively and the first result wins, as in the original loops;
+    DOIs with no result get the NOT_FOUND note in the author_names column,
+    or FETCH_ERROR if they are in `failed` (their lookup got no answer, so
+    a rerun may still find them).
+    """
+    with instrumentation.stage("scopus.frame", len(dois)):
+        return _metadata_frame(dois, results, failed)
+
+
+def _metadata_frame(dois, results, failed):
+    out = pd.DataFrame({"doi": list(dois)})
+    if len(results) == 0 or "doi" not in results:
+        found = pd.DataFrame(columns=["key"] + FIELDS)
+    else:
+        found = results.reindex(columns=["doi"] + FIELDS)
+        found = found.loc[found["doi"].notna()]
+        found.insert(0, "key", found.pop("doi").str.lower())
+        found = found.drop_duplicates("key")
+    out["key"] = out["doi"].str.lower()
+    missing = ~out["key"].isin(found["key"])
+    out = out.merge(found, on="key", how="left")
+    # the notes are text even if no result had author names
+    out["author_names"] = out["author_names"].astype(object)
+    out.loc[missing.values, "author_names"] = NOT_FOUND
+    if len(failed):
+        errors = missing & out["key"].isin({doi.lower() for doi in failed})
+        out.loc[errors.values, "author_names"] = FETCH_ERROR
+    return out[COLUMNS]
+
+
+def search_metadata(dois, max_dois=100, max_length=3000, delay=None, search=None,
+                    journal=None):
+    """Batched replacement for the one-query-per-DOI metadata loops.
+
+    See search_results() for `journal`. DOIs whose lookup failed with a
+    server or network error get the FETCH_ERROR note rather than NOT_FOUND.
+    """
+    results, failed = _search_results(dois, max_dois, max_length, delay, search, journal,
+                                      True, 3)
+    return metadata_frame(dois, results, failed)
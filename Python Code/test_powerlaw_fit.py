@@ -0,0 +1,98 @@
+"""
+Checks of powerlaw_fit / bootstrap_scheduler on seeded synthetic samples.
+
+Each family is drawn with dist_rand() from known parameters. The fitted
+xmin and parameters are pinned, the MLEs are checked against the same
+likelihoods maximised independently with scipy, and the bootstrap
+goodness-of-fit p-values have to tell the right family from a wrong one.
+
+    python -m pytest -q test_powerlaw_fit.py
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import optimize, special, stats
+
+from bootstrap_scheduler import p_table, run_bootstraps
+from powerlaw_fit import dist_rand, estimate_xmin
+
+
+@pytest.fixture(scope="module")
+def samples():
+    rng = np.random.default_rng(2024)
+    return {"pl": dist_rand("pl", (2.5,), 3, 2000, rng),
+            "ln": dist_rand("ln", (2.0, 1.0), 5, 2000, rng),
+            "exp": dist_rand("exp", (0.1,), 2, 2000, rng)}
+
+
+# family -> (xmin, pars, ntail) fitted on samples()[family]
+PINNED = {"pl": (3.0, (2.470519715627714,), 2000),
+          "ln": (5.0, (1.9843676529956171, 0.9958319840494375), 2000),
+          "exp": (2.0, (0.1043808302896089,), 2000)}
+
+
+@pytest.mark.parametrize("family", sorted(PINNED))
+def test_pinned_fits(samples, family):
+    xmin, pars, ntail = PINNED[family]
+    fit = estimate_xmin(samples[family], family)
+    assert fit.xmin == xmin
+    assert fit.ntail == ntail
+    assert fit.pars == pytest.approx(pars, rel=1e-4)
+
+
+@pytest.mark.parametrize("family, truth", [("pl", (2.5,)), ("ln", (2.0, 1.0)),
+                                           ("exp", (0.1,))])
+def test_recovers_generating_parameters(samples, family, truth):
+    fit = estimate_xmin(samples[family], family)
+    assert fit.pars == pytest.approx(truth, rel=0.05)
+
+
+def test_pl_mle(samples):
+    x = samples["pl"]
+    fit = estimate_xmin(x, "pl", xmins=[3])
+    tail = x[x >= 3]
+
+    def nll(alpha):
+        return len(tail) * np.log(special.zeta(alpha, 3)) + alpha * np.log(tail).sum()
+
+    best = optimize.minimize_scalar(nll, bounds=(1.01, 10), method="bounded",
+                                    options={"xatol": 1e-10})
+    assert fit.pars[0] == pytest.approx(best.x, rel=1e-6)
+
+
+def test_exp_mle(samples):
+    x = samples["exp"]
+    fit = estimate_xmin(x, "exp", xmins=[2])
+    tail = x[x >= 2]
+    # geometric on x - xmin: rate = log(1 + n / sum(x - xmin))
+    assert fit.pars[0] == pytest.approx(np.log1p(len(tail) / (tail - 2).sum()), rel=1e-12)
+
+
+def test_ln_mle(samples):
+    x = samples["ln"]
+    fit = estimate_xmin(x, "ln", xmins=[5])
+    tail = x[x >= 5]
+
+    def nll(p):
+        meanlog, sdlog = p
+        if sdlog <= 0:
+            return np.inf
+        dist = stats.lognorm(s=sdlog, scale=np.exp(meanlog))
+        prob = dist.sf(tail - 0.5) - dist.sf(tail + 0.5)
+        return -np.log(prob).sum() + len(tail) * np.log(dist.sf(4.5))
+
+    best = optimize.minimize(nll, [1.5, 1.5], method="Nelder-Mead",
+                             options={"xatol": 1e-8, "fatol": 1e-10, "maxiter": 5000})
+    assert fit.pars == pytest.approx(tuple(best.x), rel=1e-3)
+
+
+def test_bootstrap_p_values():
+    rng = np.random.default_rng(3)
+    data = pd.DataFrame({"x": dist_rand("pl", (2.5,), 2, 400, rng)})
+    res = run_bootstraps({"c": data}, variables=["x"], kinds=("bootstrap_p",),
+                         sims=40, seed=1, workers=2, checkpoint=None)
+    p = p_table(res).loc[("c", "x")]
+    assert p["pl"] == pytest.approx(0.825)
+    assert p["exp"] == 0.0
+    # power-law data: the power law is not rejected, the exponential is
+    assert p["pl"] > 0.1 > p["exp"]